@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Small in-process caches.
+
+Values computed from the database are kept for a few seconds in each process;
+the code changing the data invalidates them in its own process and the TTL
+bounds how stale the other processes can be.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+# Returned by TTLCache.get when the key is not cached, so None can be cached
+MISSING = object()
+
+
+class TTLCache(object):
+    """Thread safe dict whose entries expire after ttl seconds, with an optional size limit (LRU)."""
+
+    def __init__(self, ttl, max_size=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is not None and entry[0] > time.time():
+                self._data[key] = entry
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time.time() + ttl, value)
+            if self.max_size is not None:
+                while len(self._data) > self.max_size:
+                    self._data.popitem(last=False)
+
+    def get_or_set(self, key, func):
+        """Cached value of key, computing it with func() when missing or expired."""
+        value = self.get(key)
+        if value is MISSING:
+            value = func()
+            self.set(key, value)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {'size': len(self._data), 'hits': self.hits, 'misses': self.misses}
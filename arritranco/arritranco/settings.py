@@ -1,5 +1,6 @@
 # Django settings for arritranco project.
 
+import datetime
 import os
 
 PROJECT_ROOT = os.path.split(os.path.dirname(os.path.abspath(__file__)))[0]
@@ -13,6 +14,21 @@ BROKER_URL = 'amqp://localhost//'
 #: from unwanted access (see userguide/security.html)
 CELERY_ACCEPT_CONTENT = ['json']
 
+CELERYBEAT_SCHEDULE = {
+    'roll-task-occurrences': {
+        'task': 'scheduler.tasks.roll_task_occurrences',
+        'schedule': datetime.timedelta(hours=1),
+    },
+    'archive-task-statuses': {
+        'task': 'scheduler.tasks.archive_task_statuses',
+        'schedule': datetime.timedelta(days=1),
+    },
+    'build-deletion-manifests': {
+        'task': 'backups.tasks.build_deletion_manifests',
+        'schedule': datetime.timedelta(hours=1),
+    },
+}
+
 
 DEBUG = False
 TEMPLATE_DEBUG = DEBUG
@@ -240,6 +256,14 @@ UPS_ROOM_NAMES = ('cpd',)
 
 MAX_COMPRESS_GB = 400
 
+# Days before and after now with precomputed task occurrences
+TASK_OCCURRENCE_HORIZON_DAYS = 45
+
+# Task statuses older than this (days) are archived and counted into daily rollups
+TASK_STATUS_RETENTION_DAYS = 90
+# Archive them to this gzipped JSON lines file (strftime format) instead of the archive table
+TASK_STATUS_ARCHIVE_FILE = None
+
 PX_FOR_UNITS = 15
 
 # Network settings
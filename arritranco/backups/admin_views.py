@@ -69,22 +69,23 @@ class BackupGrid(TemplateView):
         else:
             today = datetime.date.today()
         yesterday = today - datetime.timedelta(1)
+        tomorrow = today + datetime.timedelta(1)
         id = 0
-        for fbt in FileBackupTask.objects.filter(active=True, machine__up=True, **f):
-            last_run = fbt.next_run(datetime.datetime.combine(yesterday, midnight))
-            while last_run.date() == today:
-                if fbt.machine.fqdn not in list_of_tasks:
-                    list_of_tasks[fbt.machine.fqdn] = []
-                list_of_tasks[fbt.machine.fqdn].append({
-                    'time': last_run,
-                    'duration': fbt.duration,
-                    'description': fbt.description,
-                    'width': self.get_width(fbt.duration),
-                    'offset': 230 + self.get_offset(last_run),
-                    'id': id,
-                })
-                last_run = fbt.next_run(last_run + datetime.timedelta(minutes=1))
-                id += 1
+        for fbt, run_time in FileBackupTask.objects.occurrences(
+                datetime.datetime.combine(yesterday, midnight),
+                datetime.datetime.combine(tomorrow, datetime.time(0, 0)),
+                FileBackupTask.objects.filter(active=True, machine__up=True, **f).select_related('machine')):
+            if fbt.machine.fqdn not in list_of_tasks:
+                list_of_tasks[fbt.machine.fqdn] = []
+            list_of_tasks[fbt.machine.fqdn].append({
+                'time': run_time,
+                'duration': fbt.duration,
+                'description': fbt.description,
+                'width': self.get_width(fbt.duration),
+                'offset': 230 + self.get_offset(run_time),
+                'id': id,
+            })
+            id += 1
         return {
             'minute_width': self.minute_width,
             'list_of_tasks': list_of_tasks,
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from backups.retention import build_manifest, build_manifests
+from optparse import make_option
+
+
+class Command(BaseCommand):
+    args = ''
+    help = 'Plans the files to delete in every checker and stores them as a new deletion manifest'
+    option_list = BaseCommand.option_list + (
+        make_option('--checker',
+                    dest='checker',
+                    default=None,
+                    help='only plan the files of this checker'),
+    )
+
+    def handle(self, *args, **options):
+        if options['checker']:
+            manifests = [build_manifest(options['checker'])]
+        else:
+            manifests = build_manifests()
+        for manifest in manifests:
+            self.stdout.write('%s generation %d: %d files to delete' % (
+                manifest.checker_fqdn, manifest.generation, manifest.size))
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from backups.models import FileBackupTask
+from backups.planner import BackupWindowPlanner, plan_tasks
+from optparse import make_option
+
+
+class Command(BaseCommand):
+    args = ''
+    help = 'Proposes minute and hour for the file backup tasks that flatten the concurrent backups per checker'
+    option_list = BaseCommand.option_list + (
+        make_option('--checker',
+                    dest='checker',
+                    default=None,
+                    help='only plan the tasks of this checker'),
+        make_option('--days',
+                    dest='days',
+                    type='int',
+                    default=7,
+                    help='days of the load histogram'),
+        make_option('--apply',
+                    dest='apply',
+                    action='store_true',
+                    default=False,
+                    help="save the proposals, otherwise they are only shown"),
+    )
+
+    def handle(self, *args, **options):
+        tasks = FileBackupTask.objects.filter(active=True, machine__up=True).select_related('machine')
+        if options['checker']:
+            tasks = tasks.filter(checker_fqdn=options['checker'])
+        current = BackupWindowPlanner(days=options['days']).build()
+        planner, proposals = plan_tasks(tasks, BackupWindowPlanner(days=options['days']))
+        for proposal in proposals:
+            task = proposal.task
+            self.stdout.write('%s %s: %s %s -> %s %s%s' % (
+                task.checker_fqdn, task.description, task.minute, task.hour, proposal.minute, proposal.hour,
+                '' if proposal.changed() else ' (unchanged)'))
+        for checker_fqdn in sorted(set(p.checker_fqdn for p in proposals)):
+            self.stdout.write('%s peak of concurrent backups: %d -> %d' % (
+                checker_fqdn, current.peak(checker_fqdn), planner.peak(checker_fqdn)))
+        if options['apply']:
+            # Never make a checker worse than it is now
+            changed = [proposal for proposal in proposals if proposal.changed() and
+                       planner.peak(proposal.checker_fqdn) <= current.peak(proposal.checker_fqdn)]
+            for proposal in changed:
+                proposal.apply()
+            self.stdout.write('%d tasks updated' % len(changed))
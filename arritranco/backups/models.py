@@ -1,19 +1,59 @@
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import Q
 from django.utils.translation import ugettext_lazy as _
-from scheduler.models import Task, TaskCheck, TaskManager
-from inventory.models import Machine
+from scheduler.models import Task, TaskCheck, TaskManager, TaskState, update_occurrences, BULK_STATUS_BATCH_SIZE
+from django.db.models.signals import post_save, post_delete
+from inventory.models import Machine, PhysicalMachine, VirtualMachine
 from django.conf import settings
 from django.core.exceptions import ValidationError
 
 import datetime
+import hashlib
+import json
 import re
 
 import os
 
 import logging
 
+from arritranco.cache import TTLCache
+
 logger = logging.getLogger(__name__)
 
+# Seconds a machine pattern index is reused, changes done by other processes can take this long to be seen
+try:
+    from arritranco.settings import FILE_PATTERN_INDEX_TTL
+except ImportError:
+    FILE_PATTERN_INDEX_TTL = 300
+
+# Time a compressor has to compress the files it claims before others can take them
+try:
+    from arritranco.settings import COMPRESSION_LEASE
+except ImportError:
+    COMPRESSION_LEASE = datetime.timedelta(hours=6)
+
+# Extensions the compressors add to the backup files they compress
+COMPRESSED_EXTENSIONS = ('.bz2', '.gz')
+
+# Extension of the files being written by a compressor
+TEMPORARY_EXTENSION = '.tmp'
+
+# Deletion manifests kept for each checker
+DELETION_MANIFEST_KEEP = 2
+
+# Age of a deletion manifest after which it is planned again when requested, as its nightly build was missed
+try:
+    from arritranco.settings import DELETION_MANIFEST_MAX_AGE
+except ImportError:
+    DELETION_MANIFEST_MAX_AGE = datetime.timedelta(days=2)
+
+# Python re module does not support more groups in a single expression
+MAX_RE_GROUPS = 100
+
+GROUP_NAME_RE = re.compile(r'\(\?P([<=])(\w+)')
+# Global inline flags and numeric backreferences can not be combined with other patterns
+STANDALONE_RE = re.compile(r'\(\?[iLmsux]+\)|\\[1-9]')
+
 
 class BackupTask(Task):
     """
@@ -96,12 +136,20 @@ class FileBackupTask(BackupTask):
 
     objects = TaskManager()  # Include todo query from the task manager
 
+    def nearest_run(self, time):
+        """Run of the task (next or last one) closest to time, which is the one a file of that time belongs to."""
+        next_run = self.next_run(time)
+        previous_run = self.last_run(time)
+        if abs(next_run - time) <= abs(time - previous_run):
+            return next_run
+        return previous_run
+
     @staticmethod
     def get_fbp(machine, filename):
         logger.debug('Searching FileBackupProduct for filename %s and machine %s', filename, machine)
-        for fbp in FileBackupProduct.objects.filter(file_backup_task__machine=machine, file_backup_task__active=True):
-            if fbp.file_pattern.get_re(machine).match(filename):
-                return fbp
+        fbp = FilePatternIndex.get(machine).match(filename)
+        if fbp is not None:
+            return fbp
         logger.debug('There is no FileBackupProduct for machine %s', machine)
         return None
 
@@ -113,7 +161,8 @@ class FileNamePattern(models.Model):
     pattern = models.CharField('Nombre del archivo', max_length=255, blank=True, null=True,
                                help_text=_(u'File name pattern, you can use regexp and date patterns here.'))
 
-    def get_re (self, machine = None):
+    def get_re_pattern(self, machine=None):
+        """Regular expression source of the pattern, with the date patterns and the machine fqdn replaced."""
         # FIXME: Change month list based on default locale language
         sustituciones = (
                         ('%Y', '(?P<year4>\d{4})'),
@@ -130,7 +179,11 @@ class FileNamePattern(models.Model):
             patron_re = patron_re.replace('__FQDN__', machine.fqdn)
         for o, d in sustituciones:
             patron_re = patron_re.replace(o, d)
-        logger.error('Regular expression pattern: %s', patron_re)
+        return patron_re
+
+    def get_re (self, machine = None):
+        patron_re = self.get_re_pattern(machine)
+        logger.debug('Regular expression pattern: %s', patron_re)
         return re.compile(patron_re)
 
     def get_filename_for_date(self, d):
@@ -177,6 +230,332 @@ class FileBackupProduct(models.Model):
         return u"%si -> %s" % (self.file_backup_task, self.file_pattern)
 
 
+class FilePatternIndex(object):
+    """
+        File name patterns of the active FileBackupProducts of a machine compiled together.
+
+        Every pattern becomes a named group of an alternation, tried in the same order the
+        products were tried one by one, so a file name is matched with a single regex call.
+        Inner group names are prefixed with the product id to keep them unique.
+    """
+    _cache = TTLCache(FILE_PATTERN_INDEX_TTL)
+
+    def __init__(self, machine):
+        self.machine = machine
+        self.products = {}
+        self.regexes = []
+        fbps = FileBackupProduct.objects.filter(file_backup_task__machine=machine, file_backup_task__active=True)
+        parts = []
+        groups = 0
+        for fbp in fbps.select_related('file_backup_task', 'file_pattern').order_by('pk'):
+            pattern = fbp.file_pattern.get_re_pattern(machine)
+            try:
+                compiled = re.compile(pattern)
+            except re.error, e:
+                logger.error('Bad file name pattern %s for %s: %s', pattern, fbp, e)
+                continue
+            name = 'fbp%d' % fbp.pk
+            self.products[name] = fbp
+            if STANDALONE_RE.search(pattern):
+                self._add(parts)
+                parts, groups = [], 0
+                self.regexes.append((re.compile(pattern), name))
+                continue
+            if groups + compiled.groups + 1 > MAX_RE_GROUPS:
+                self._add(parts)
+                parts, groups = [], 0
+            parts.append('(?P<%s>%s)' % (name, GROUP_NAME_RE.sub(r'(?P\1%s_\2' % name, pattern)))
+            groups += compiled.groups + 1
+        self._add(parts)
+
+    def _add(self, parts):
+        if parts:
+            self.regexes.append((re.compile('|'.join(parts)), None))
+
+    @classmethod
+    def get(cls, machine):
+        """Index of a machine, built again when expired or invalidated."""
+        return cls._cache.get_or_set(machine.pk, lambda: cls(machine))
+
+    @classmethod
+    def invalidate(cls, machine=None):
+        """Forgets the index of a machine, or every index when machine is None."""
+        if machine is None:
+            cls._cache.clear()
+        else:
+            cls._cache.invalidate(machine.pk)
+
+    def match(self, filename):
+        """FileBackupProduct of the first pattern matching filename, None if there is none."""
+        for regex, name in self.regexes:
+            m = regex.match(filename)
+            if m is not None:
+                return self.products[name or m.lastgroup]
+        return None
+
+
+def supports_window_functions():
+    """Whether the database computes SUM() OVER (ORDER BY ...)."""
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 25)
+    return False
+
+
+class BackupFileManager(models.Manager):
+    def pending_compression(self, checker_fqdn, now=None):
+        """Files of a checker neither compressed, deleted nor claimed by a compressor."""
+        if now is None:
+            now = datetime.datetime.now()
+        return self.filter(Q(compression_lease_expires__isnull=True) | Q(compression_lease_expires__lte=now),
+                           compressed_file_name='', deletion_date__isnull=True,
+                           file_backup_product__file_backup_task__checker_fqdn=checker_fqdn)
+
+    def to_verify(self, checker_fqdn, unchecked=False):
+        """Files of a checker still on disk whose MD5 is known, so their integrity can be verified.
+
+        The MD5 of a compressed file is the one of its compressed file, the one on disk.
+        With unchecked only the files never verified are returned.
+        """
+        queryset = self.filter(Q(compressed_file_name='') & ~Q(original_md5='') |
+                               ~Q(compressed_file_name='') & ~Q(compressed_md5=''),
+                               deletion_date__isnull=True,
+                               file_backup_product__file_backup_task__checker_fqdn=checker_fqdn)
+        if unchecked:
+            queryset = queryset.filter(integrity_checked__isnull=True)
+        return queryset
+
+    def set_integrity(self, checker_fqdn, hashes):
+        """Stores whether the MD5 computed by a checker for its files are the expected ones.
+
+        hashes is a list of (BackupFile id, MD5, path) tuples, None as MD5 when the file
+        could not be read. path is the file hashed, when given and it is not the current
+        file of the backup file (as it was compressed meanwhile) the MD5 is ignored.
+        Files are updated with two queries per batch. Returns, in the same order, the
+        integrity of each file, None for the files unknown to the checker or ignored.
+        """
+        results = []
+        for i in range(0, len(hashes), BULK_STATUS_BATCH_SIZE):
+            batch = hashes[i:i + BULK_STATUS_BATCH_SIZE]
+            expected = {}
+            for pk, directory, original_file_name, compressed_file_name, original_md5, compressed_md5 in self.filter(
+                    pk__in=[pk for pk, md5, path in batch],
+                    file_backup_product__file_backup_task__checker_fqdn=checker_fqdn).values_list(
+                    'pk', 'file_backup_product__file_backup_task__directory', 'original_file_name',
+                    'compressed_file_name', 'original_md5', 'compressed_md5'):
+                expected[pk] = (os.path.join(directory, compressed_file_name or original_file_name),
+                                (compressed_md5 if compressed_file_name else original_md5).lower())
+            integrity = {True: [], False: []}
+            for pk, md5, path in batch:
+                if pk not in expected or path is not None and path != expected[pk][0]:
+                    results.append(None)
+                    continue
+                checked = bool(md5) and md5.lower() == expected[pk][1]
+                integrity[checked].append(pk)
+                results.append(checked)
+            for checked, pks in integrity.items():
+                if pks:
+                    self.filter(pk__in=pks).update(integrity_checked=checked)
+        return results
+
+    def claim(self, checker_fqdn, worker, budget, limit=None, lease=COMPRESSION_LEASE):
+        """Leases the next files to compress of a checker (as in to_compress) to a worker.
+
+        Files are leased with a single conditional UPDATE, so a file is never given to
+        two workers while its lease lasts; when others claim the same files at the same
+        time fewer files than available can be returned. Returns the claimed files.
+
+        The UPDATE has no joins (the checker is already constrained by to_compress):
+        the database checks the lease again on rows updated meanwhile by another
+        claim, which it does not do for the conditions of a subquery.
+        """
+        now = datetime.datetime.now()
+        files, more = self.to_compress(checker_fqdn, budget, limit=limit)
+        expires = now + lease
+        ids = [bf.pk for bf in files]
+        for i in range(0, len(ids), BULK_STATUS_BATCH_SIZE):
+            self.filter(Q(compression_lease_expires__isnull=True) | Q(compression_lease_expires__lte=now),
+                        pk__in=ids[i:i + BULK_STATUS_BATCH_SIZE], compressed_file_name='',
+                        deletion_date__isnull=True).update(
+                compression_claimed_by=worker, compression_lease_expires=expires)
+        claimed = set()
+        for i in range(0, len(ids), BULK_STATUS_BATCH_SIZE):
+            claimed.update(self.filter(pk__in=ids[i:i + BULK_STATUS_BATCH_SIZE], compression_claimed_by=worker,
+                                       compression_lease_expires=expires).values_list('pk', flat=True))
+        claimed_files = []
+        for bf in files:
+            if bf.pk in claimed:
+                bf.compression_claimed_by = worker
+                bf.compression_lease_expires = expires
+                claimed_files.append(bf)
+        return claimed_files
+
+    def to_compress(self, checker_fqdn, budget, after=None, limit=None):
+        """Next files of a checker to compress, newest first, adding up to budget bytes.
+
+        As many files are returned as fit in budget, plus the one going past it, and
+        at most limit. after is the last file of the previous page, so pages are
+        taken with keyset pagination on (original date, id); files without date go
+        last. Returns the files, with their task loaded, and whether there can be
+        more files after them.
+        """
+        queryset = self.pending_compression(checker_fqdn)
+        if after is not None:
+            if after.original_date is None:
+                queryset = queryset.filter(original_date__isnull=True, pk__lt=after.pk)
+            else:
+                queryset = queryset.filter(Q(original_date__lt=after.original_date) |
+                                           Q(original_date=after.original_date, pk__lt=after.pk) |
+                                           Q(original_date__isnull=True))
+        if supports_window_functions():
+            ids = self._cut_with_window(queryset, budget, limit)
+        else:
+            ids = self._cut(queryset, budget, limit)
+        more = limit is not None and len(ids) > limit
+        ids = ids[:limit]
+        files = {}
+        for i in range(0, len(ids), BULK_STATUS_BATCH_SIZE):
+            for bf in self.filter(pk__in=[pk for pk, size in ids[i:i + BULK_STATUS_BATCH_SIZE]]).select_related(
+                    'file_backup_product__file_backup_task'):
+                files[bf.pk] = bf
+        more = more or sum(size for pk, size in ids) > budget
+        return [files[pk] for pk, size in ids], more
+
+    def _cut_with_window(self, queryset, budget, limit):
+        """(id, size) of the files in the budget, the running total computed by the database."""
+        sql, params = queryset.order_by().values('id', 'original_date', 'original_file_size').query.sql_with_params()
+        order = "original_date IS NULL, original_date DESC, id DESC"
+        sql = ("SELECT id, size FROM ("
+               "SELECT id, original_date, original_file_size AS size, "
+               "SUM(original_file_size) OVER (ORDER BY " + order + ") AS total FROM (" + sql + ") candidates"
+               ") sums WHERE total - size <= %s ORDER BY " + order)
+        params = list(params) + [budget]
+        if limit is not None:
+            sql += " LIMIT %s"
+            params.append(limit + 1)
+        cursor = connection.cursor()
+        cursor.execute(sql, params)
+        return [(pk, size) for pk, size in cursor.fetchall()]
+
+    def _cut(self, queryset, budget, limit):
+        """(id, size) of the files in the budget, adding up the sizes while reading them in order."""
+        ids = []
+        total = 0
+        for files in (queryset.filter(original_date__isnull=False).order_by('-original_date', '-pk'),
+                      queryset.filter(original_date__isnull=True).order_by('-pk')):
+            for pk, size in files.values_list('pk', 'original_file_size').iterator():
+                if total > budget or (limit is not None and len(ids) > limit):
+                    return ids
+                ids.append((pk, size))
+                total += size
+        return ids
+
+    def lookup(self, checker_fqdn, files):
+        """BackupFiles of a checker for many (directory, file name) at once.
+
+        A backup file matches when its original or compressed name is the file name,
+        with or without its extension, and the oldest one is taken. Returns, in the
+        same order, the BackupFile (with its task loaded) or None for each item.
+        """
+        results = []
+        # Every file name is looked up with and without extension, in two columns
+        batch_size = BULK_STATUS_BATCH_SIZE // 4
+        for i in range(0, len(files), batch_size):
+            results.extend(self._lookup(checker_fqdn, files[i:i + batch_size]))
+        return results
+
+    def _lookup(self, checker_fqdn, files):
+        names = {}
+        for directory, file_name in files:
+            names.setdefault(directory, set()).update((file_name, os.path.splitext(file_name)[0]))
+        found = {}
+        for directory, directory_names in names.items():
+            directory_names.discard('')
+            queryset = self.filter(Q(original_file_name__in=directory_names) |
+                                   Q(compressed_file_name__in=directory_names),
+                                   file_backup_product__file_backup_task__checker_fqdn=checker_fqdn,
+                                   file_backup_product__file_backup_task__directory=directory)
+            for position, bf in enumerate(queryset.select_related('file_backup_product__file_backup_task').order_by(
+                    'original_date', 'pk')):
+                for name in (bf.original_file_name, bf.compressed_file_name):
+                    if name:
+                        found.setdefault((directory, name), (position, bf))
+        results = []
+        for directory, file_name in files:
+            matches = [found[(directory, name)] for name in (file_name, os.path.splitext(file_name)[0])
+                       if (directory, name) in found]
+            results.append(min(matches)[1] if matches else None)
+        return results
+
+    def compressed_copies(self, files):
+        """(directory, file name) of files that are the compressed file of a known backup file.
+
+        A file is a compressed copy when it is the compressed file of a backup file of
+        its directory, or its name is the original name of one plus a compressor
+        extension (the compressor writes it before the inventory is told).
+        """
+        names = {}
+        for directory, file_name in files:
+            stem, extension = os.path.splitext(file_name)
+            names.setdefault(directory, set()).add(file_name)
+            if extension in COMPRESSED_EXTENSIONS:
+                names[directory].add(stem)
+        copies = set()
+        for directory, directory_names in names.items():
+            directory_names = list(directory_names)
+            for i in range(0, len(directory_names), BULK_STATUS_BATCH_SIZE // 2):
+                batch = directory_names[i:i + BULK_STATUS_BATCH_SIZE // 2]
+                for original, compressed in self.filter(
+                        Q(original_file_name__in=batch) | Q(compressed_file_name__in=batch),
+                        file_backup_product__file_backup_task__directory=directory).values_list(
+                        'original_file_name', 'compressed_file_name'):
+                    if compressed:
+                        copies.add((directory, compressed))
+                    for extension in COMPRESSED_EXTENSIONS:
+                        copies.add((directory, original + extension))
+        return set(f for f in files if f in copies)
+
+    @transaction.atomic
+    def register(self, files):
+        """Registers many backup files at once.
+
+        files is a list of (file_backup_product, file name, file date, file size) tuples.
+        The TaskCheck of every file is the nearest run of its task to the file date, checks
+        and files are created with bulk operations and files already registered are kept.
+        Returns the list of (task_time, created) for each file.
+        """
+        results = []
+        for i in range(0, len(files), BULK_STATUS_BATCH_SIZE):
+            results.extend(self._register(files[i:i + BULK_STATUS_BATCH_SIZE]))
+        return results
+
+    def _register(self, files):
+        runs = {}
+        for fbp, filename, filedate, filesize in files:
+            key = (fbp.file_backup_task_id, filedate)
+            if key not in runs:
+                runs[key] = fbp.file_backup_task.nearest_run(filedate)
+        checks, created = TaskCheck.objects.get_or_create_checks((key[0], t) for key, t in runs.items())
+        if created:
+            TaskState.objects.refresh([checks[key] for key in created])
+        existing = set(self.filter(task_check__in=set(checks.values())).values_list(
+            'file_backup_product', 'task_check', 'original_file_name', 'original_date', 'original_file_size'))
+        results = []
+        new_files = []
+        for fbp, filename, filedate, filesize in files:
+            task_time = runs[(fbp.file_backup_task_id, filedate)]
+            key = (fbp.pk, checks[(fbp.file_backup_task_id, task_time)], filename, filedate, float(filesize))
+            results.append((task_time, key not in existing))
+            if key not in existing:
+                existing.add(key)
+                new_files.append(BackupFile(file_backup_product_id=key[0], task_check_id=key[1],
+                                            original_file_name=filename, original_date=filedate,
+                                            original_file_size=key[4]))
+        self.bulk_create(new_files)
+        return results
+
+
 class BackupFile(models.Model):
     file_backup_product = models.ForeignKey(FileBackupProduct)
     task_check = models.ForeignKey(TaskCheck, null=True, blank=True)
@@ -213,6 +592,31 @@ class BackupFile(models.Model):
     utility_checked = models.NullBooleanField(blank=True, null=True,
         help_text=_(u'Useful.'))
 
+    compression_claimed_by = models.CharField(_(u'Compressor'), max_length=255, blank=True, null=True,
+        help_text=_(u'Compressor compressing this file.'))
+
+    compression_lease_expires = models.DateTimeField(blank=True, null=True, db_index=True,
+        help_text=_(u'Until when the compressor has the file.'))
+
+    objects = BackupFileManager()
+
+    def set_compressed(self, compressed_file_name, filesize, filedate, compressedmd5=None, originalmd5=None):
+        """Stores the compressed file of this backup, ending the lease of its compressor."""
+        self.compressed_file_name = compressed_file_name
+        self.compressed_file_size = filesize
+        self.compressed_date = filedate
+        if compressedmd5:
+            self.compressed_md5 = compressedmd5
+        if originalmd5:
+            self.original_md5 = originalmd5
+        self.compression_claimed_by = None
+        self.compression_lease_expires = None
+        self.save()
+
+    def md5(self):
+        """MD5 of the file on disk, the compressed one if there is one."""
+        return self.compressed_md5 if self.compressed_file_name else self.original_md5
+
     def machine(self):
         return self.file_backup_product.file_backup_task.machine
 
@@ -220,7 +624,7 @@ class BackupFile(models.Model):
         return self.file_backup_product.file_backup_task.directory
 
     def path(self):
-        return os.path.join(self.directory(), self.compressed_filen_name or self.original_file_name)
+        return os.path.join(self.directory(), self.compressed_file_name or self.original_file_name)
 
     def checker(self):
         return self.file_backup_product.file_backup_task.checker_fqdn
@@ -253,6 +657,88 @@ class BackupFile(models.Model):
         verbose_name = _(u'Backup file')
 
 
+class DeletionManifestManager(models.Manager):
+    def latest_for(self, checker_fqdn):
+        """Newest manifest of a checker, None when there is none."""
+        try:
+            return self.filter(checker_fqdn=checker_fqdn).latest('generation')
+        except DeletionManifest.DoesNotExist:
+            return None
+
+    @transaction.atomic
+    def create_manifest(self, checker_fqdn, files):
+        """New generation of the manifest of a checker with files, a list of {'pk', 'path'} of BackupFiles.
+
+        Only the newest DELETION_MANIFEST_KEEP manifests of the checker are kept.
+        """
+        latest = self.latest_for(checker_fqdn)
+        manifest = self.create(checker_fqdn=checker_fqdn, generation=latest.generation + 1 if latest else 1,
+                               digest=hashlib.md5(json.dumps([[f['pk'], f['path']] for f in files])).hexdigest(),
+                               size=len(files))
+        DeletionManifestEntry.objects.bulk_create([
+            DeletionManifestEntry(manifest=manifest, backup_file_id=f['pk'], path=f['path']) for f in files
+        ], batch_size=500)
+        old = self.filter(checker_fqdn=checker_fqdn).order_by('-generation')[DELETION_MANIFEST_KEEP:]
+        self.filter(pk__in=list(old.values_list('pk', flat=True))).delete()
+        return manifest
+
+
+class DeletionManifest(models.Model):
+    """
+        Files to delete in a checker, planned in background from the retention policy.
+    """
+    checker_fqdn = models.CharField(max_length=255, choices=settings.FILE_BACKUP_CHECKERS,
+                                    verbose_name=_(u"Checker fqdn"), db_index=True)
+    generation = models.IntegerField(help_text=_(u'Number of the manifest, increased by one each time the '
+                                                 u'files of the checker are planned.'))
+    created = models.DateTimeField(auto_now_add=True)
+    digest = models.CharField(max_length=32, help_text=_(u'MD5 hash of the planned files.'))
+    size = models.IntegerField(default=0, help_text=_(u'Number of planned files.'))
+
+    objects = DeletionManifestManager()
+
+    def __unicode__(self):
+        return u"%s #%d (%d files)" % (self.checker_fqdn, self.generation, self.size)
+
+    def pending(self):
+        """Entries whose files are not deleted yet."""
+        return self.entries.filter(backup_file__deletion_date__isnull=True)
+
+    def pending_files(self):
+        """{'pk', 'path'} of the files not deleted yet, with their current path as they can be compressed later."""
+        return [{'pk': pk, 'path': os.path.join(directory, compressed_file_name or original_file_name)}
+                for pk, directory, original_file_name, compressed_file_name in self.pending().order_by('pk').values_list(
+                    'backup_file', 'backup_file__file_backup_product__file_backup_task__directory',
+                    'backup_file__original_file_name', 'backup_file__compressed_file_name')]
+
+    def is_stale(self, now=None):
+        """Whether the manifest is older than DELETION_MANIFEST_MAX_AGE."""
+        if now is None:
+            now = datetime.datetime.now()
+        return self.created < now - DELETION_MANIFEST_MAX_AGE
+
+    def etag(self, files=None):
+        """Changes when a new generation has other files or when files are deleted or compressed."""
+        if files is None:
+            files = self.pending_files()
+        return '"%s-%s"' % (self.digest, hashlib.md5(json.dumps([[f['pk'], f['path']] for f in files])).hexdigest())
+
+    class Meta:
+        unique_together = (('checker_fqdn', 'generation'),)
+        verbose_name_plural = _(u'Deletion manifests')
+        verbose_name = _(u'Deletion manifest')
+
+
+class DeletionManifestEntry(models.Model):
+    manifest = models.ForeignKey(DeletionManifest, related_name='entries')
+    backup_file = models.ForeignKey(BackupFile)
+    # Path when planned, the current one is served
+    path = models.CharField(max_length=1024)
+
+    def __unicode__(self):
+        return u"%s" % self.path
+
+
 class FileBackupTaskTemplate(models.Model):
     """
         File backup task Template
@@ -303,4 +789,30 @@ class FileBackupProductTemplate(models.Model):
                                               help_text=_(u"% size that you expect to change between two backups"))
 
     def __unicode__(self):
-        return u"%si -> %s" % (self.file_backup_task_template, self.file_pattern)
\ No newline at end of file
+        return u"%si -> %s" % (self.file_backup_task_template, self.file_pattern)
+
+
+for task_model in (BackupTask, VCBBackupTask, TSMBackupTask, R1BackupTask, FileBackupTask):
+    post_save.connect(update_occurrences, sender=task_model,
+                      dispatch_uid="update_occurrences_%s" % task_model._meta.model_name)
+
+
+def invalidate_file_pattern_index(sender, instance, **kwargs):
+    """Any change on patterns, products or tasks can change the products of several machines."""
+    FilePatternIndex.invalidate()
+
+
+def invalidate_machine_file_pattern_index(sender, instance, **kwargs):
+    """Patterns use the machine fqdn."""
+    FilePatternIndex.invalidate(instance)
+
+
+for model in (FileNamePattern, FileBackupProduct, FileBackupTask):
+    post_save.connect(invalidate_file_pattern_index, sender=model,
+                      dispatch_uid="invalidate_file_pattern_index_save_%s" % model._meta.model_name)
+    post_delete.connect(invalidate_file_pattern_index, sender=model,
+                        dispatch_uid="invalidate_file_pattern_index_delete_%s" % model._meta.model_name)
+# Machines are saved as their subclasses too, and post_save is sent with the class saved
+for model in (Machine, PhysicalMachine, VirtualMachine):
+    post_save.connect(invalidate_machine_file_pattern_index, sender=model,
+                      dispatch_uid="invalidate_machine_file_pattern_index_%s" % model._meta.model_name)
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Backup window planner.
+
+Builds, for every checker, how many file backups are running at each minute of
+a period of time (a week by default) from the cron occurrences and duration of
+the active FileBackupTasks, and proposes the minute and hour for new or existing
+tasks that keep the peak of concurrent backups of their checker as low as
+possible.
+"""
+
+import datetime
+import re
+
+from backups.models import FileBackupTask
+from scheduler.schedule import get_schedule
+
+# Hours proposed for the backups
+try:
+    from arritranco.settings import BACKUP_PLANNER_HOURS
+except ImportError:
+    BACKUP_PLANNER_HOURS = range(0, 7)
+
+# Minutes proposed are multiples of this
+BACKUP_PLANNER_MINUTE_STEP = 5
+
+# Duration assumed for the tasks without one (as BackupTask.fecha_fin does)
+DEFAULT_DURATION = 30
+
+ONE_SECOND = datetime.timedelta(seconds=1)
+
+SINGLE_VALUE_RE = re.compile(r'^\d+$')
+
+
+def duration_minutes(duration):
+    """Minutes of a BackupTask duration (a time), DEFAULT_DURATION when it is not set."""
+    if duration is None:
+        return DEFAULT_DURATION
+    minutes = duration.hour * 60 + duration.minute + (1 if duration.second else 0)
+    return minutes or DEFAULT_DURATION
+
+
+class Proposal(object):
+    """Slot proposed for a task (which can be None for a new one)."""
+
+    def __init__(self, task, checker_fqdn, monthday, hour, minute, peak):
+        self.task = task
+        self.checker_fqdn = checker_fqdn
+        self.monthday = monthday
+        self.hour = hour
+        self.minute = minute
+        self.peak = peak
+
+    def __repr__(self):
+        return "<Proposal: %s %s %s:%02d (peak %d)>" % (self.task, self.monthday, self.hour, self.minute, self.peak)
+
+    def changed(self):
+        return self.task is not None and (self.task.hour, self.task.minute, self.task.monthday) != \
+            (str(self.hour), str(self.minute), str(self.monthday))
+
+    def apply(self):
+        self.task.hour = str(self.hour)
+        self.task.minute = str(self.minute)
+        self.task.monthday = str(self.monthday)
+        self.task.save()
+
+
+class BackupWindowPlanner(object):
+    """Concurrent backups per checker and minute from start, for a number of days.
+
+    The period is taken as cyclic, so a backup running past the end counts at the
+    beginning: with the default week a backup on sunday night also loads monday.
+    """
+
+    def __init__(self, start=None, days=7, hours=BACKUP_PLANNER_HOURS, minute_step=BACKUP_PLANNER_MINUTE_STEP):
+        if start is None:
+            today = datetime.date.today()
+            # Next monday
+            start = datetime.datetime.combine(today + datetime.timedelta(days=7 - today.weekday()), datetime.time())
+        self.start = start
+        self.end = start + datetime.timedelta(days=days)
+        self.size = days * 24 * 60
+        self.hours = list(hours)
+        self.minutes = range(0, 60, minute_step)
+        self.load = {}
+        self._runs = {}
+
+    def offsets(self, expression):
+        """Minutes from start of the runs of a cron expression in the period."""
+        if expression not in self._runs:
+            runs = get_schedule(expression).runs_between(self.start - ONE_SECOND, self.end)
+            self._runs[expression] = [int((t - self.start).total_seconds()) // 60 for t in runs]
+        return self._runs[expression]
+
+    def build(self, exclude=()):
+        """Loads every active FileBackupTask of an up machine, except the ones in exclude."""
+        exclude = set(task.pk for task in exclude)
+        diffs = {}
+        for task in FileBackupTask.objects.filter(active=True, machine__up=True):
+            if task.pk in exclude:
+                continue
+            diff = diffs.setdefault(task.checker_fqdn, [0] * (self.size + 1))
+            duration = min(duration_minutes(task.duration), self.size)
+            for offset in self.offsets(task.cron_syntax()):
+                end = offset + duration
+                diff[offset] += 1
+                if end <= self.size:
+                    diff[end] -= 1
+                else:
+                    diff[self.size] -= 1
+                    diff[0] += 1
+                    diff[end - self.size] -= 1
+        for checker_fqdn, diff in diffs.items():
+            load = []
+            running = 0
+            for change in diff[:self.size]:
+                running += change
+                load.append(running)
+            self.load[checker_fqdn] = load
+        return self
+
+    def get_load(self, checker_fqdn):
+        if checker_fqdn not in self.load:
+            self.load[checker_fqdn] = [0] * self.size
+        return self.load[checker_fqdn]
+
+    def peak(self, checker_fqdn):
+        return max(self.get_load(checker_fqdn))
+
+    def _intervals(self, offsets, duration):
+        for offset in offsets:
+            end = offset + duration
+            if end <= self.size:
+                yield offset, end
+            else:
+                yield offset, self.size
+                yield 0, end - self.size
+
+    def add(self, checker_fqdn, expression, duration, count=1):
+        """Adds (or with a negative count removes) the runs of a cron expression to the load of a checker."""
+        load = self.get_load(checker_fqdn)
+        for start, end in self._intervals(self.offsets(expression), min(duration, self.size)):
+            for i in xrange(start, end):
+                load[i] += count
+
+    def best_slot(self, checker_fqdn, duration, monthdays=('*',), month='*', weekday='*'):
+        """(peak, monthday, hour, minute) with the lowest peak of concurrent backups for a new task.
+
+        Ties go to the slot with less load along the backup, then to the earliest one.
+        """
+        load = self.get_load(checker_fqdn)
+        duration = min(duration, self.size)
+        best = None
+        for monthday in monthdays:
+            for hour in self.hours:
+                for minute in self.minutes:
+                    expression = "%s %s %s %s %s" % (minute, hour, monthday, month, weekday)
+                    peak = total = 0
+                    for start, end in self._intervals(self.offsets(expression), duration):
+                        window = load[start:end]
+                        peak = max(peak, max(window))
+                        total += sum(window)
+                    candidate = (peak + 1, total, monthday, hour, minute)
+                    if best is None or candidate < best:
+                        best = candidate
+        if best is None:
+            raise ValueError("No slots to plan")
+        return best[0], best[2], best[3], best[4]
+
+    def propose(self, checker_fqdn, duration, monthdays=('*',), month='*', weekday='*', task=None):
+        """Proposal for a task, whose runs are added to the load so next proposals take them into account."""
+        peak, monthday, hour, minute = self.best_slot(checker_fqdn, duration, monthdays, month, weekday)
+        self.add(checker_fqdn, "%s %s %s %s %s" % (minute, hour, monthday, month, weekday), duration)
+        return Proposal(task, checker_fqdn, monthday, hour, minute, peak)
+
+
+def can_replan(task):
+    """Only tasks running once at a single minute and hour keep their frequency when replanned."""
+    return bool(SINGLE_VALUE_RE.match(task.minute) and SINGLE_VALUE_RE.match(task.hour))
+
+
+def plan_tasks(tasks, planner=None):
+    """Proposals for existing FileBackupTasks, keeping their day fields.
+
+    The load of the other tasks is built first and the longest backups are placed first.
+    Returns the planner and the proposals.
+    """
+    tasks = [task for task in tasks if can_replan(task)]
+    if planner is None:
+        planner = BackupWindowPlanner()
+    planner.build(exclude=tasks)
+    proposals = []
+    for task in sorted(tasks, key=lambda t: (-duration_minutes(t.duration), t.pk)):
+        proposals.append(planner.propose(task.checker_fqdn, duration_minutes(task.duration), (task.monthday,),
+                                         task.month, task.weekday, task=task))
+    return planner, proposals
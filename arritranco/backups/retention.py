@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Retention policy of the file backups.
+
+A TaskCheck of a FileBackupTask is deleted from disk when it is older than the
+days_in_hard_drive of its task. Besides, in each of the last eleven whole months
+only max_backup_month checks are kept, evenly spread over the month.
+
+The checks of every task of a checker are read with a single aggregate query and
+the selection is done in memory, so planning costs the same few queries however
+many tasks the checker has. build_manifests stores the plan of every checker as
+a DeletionManifest, so checkers get it without planning on each request.
+"""
+
+import bisect
+import datetime
+import math
+
+from django.db.models import Count
+
+from backups.models import BackupFile, DeletionManifest, FileBackupTask
+from backups.serializers import BackupFileToDeleteSerializer
+from scheduler.models import TaskCheck
+
+# Whole months before the current one thinned to max_backup_month checks
+RETENTION_MONTHS = 11
+
+# Maximum TaskCheck ids in a query
+RETENTION_BATCH_SIZE = 500
+
+
+def tasks_with_files(checker_fqdn):
+    """FileBackupTasks of a checker with files not deleted yet."""
+    return FileBackupTask.objects.filter(checker_fqdn=checker_fqdn,
+                                         taskcheck__backupfile__deletion_date__isnull=True,  # matches no backups too
+                                         taskcheck__backupfile__isnull=False).distinct()  # so at least one backup
+
+
+def months(today, count=RETENTION_MONTHS):
+    """(first day, first day of the next month) of the count months before the month of today, newest first."""
+    last_month_day = datetime.datetime(today.year, today.month, 1)
+    for i in range(count):
+        previous = last_month_day - datetime.timedelta(minutes=1)
+        first_month_day = datetime.datetime(previous.year, previous.month, 1)
+        yield first_month_day, last_month_day
+        last_month_day = first_month_day
+
+
+def thin(checks, max_backup_month):
+    """Checks (sorted by time) to delete so that max_backup_month of them remain, evenly spread."""
+    selected = []
+    if len(checks) > max_backup_month:
+        step = float(len(checks)) / (len(checks) - max_backup_month)
+        last = len(checks) - step
+        while last >= 0:
+            selected.append(checks[int(math.ceil(last))])
+            last -= step
+    return selected
+
+
+def plan_task(task, checks, now, today):
+    """Ids of the checks of a task to delete.
+
+    checks are (id, task_time, files with date) of the checks of the task with files not deleted,
+    sorted by time.
+    """
+    limit = now - datetime.timedelta(days=task.days_in_hard_drive)
+    selected = [check_id for check_id, task_time, dated in checks if task_time <= limit]
+    checks = [(task_time, check_id) for check_id, task_time, dated in checks if dated]
+    times = [task_time for task_time, check_id in checks]
+    for first_month_day, last_month_day in months(today):
+        # Both days are included, as a check at midnight of the first day belongs to both months
+        month = checks[bisect.bisect_left(times, first_month_day):bisect.bisect_right(times, last_month_day)]
+        selected.extend(check_id for task_time, check_id in thin(month, task.max_backup_month))
+    return selected
+
+
+def plan_deletions(tasks, now=None):
+    """BackupFiles not deleted yet of the TaskChecks of tasks out of the retention policy.
+
+    tasks is a FileBackupTask queryset, usually from tasks_with_files. Files are
+    returned task by task, with their task and directory already loaded.
+    """
+    if now is None:
+        now = datetime.datetime.now()
+    today = now.date()
+    # Checks with files not deleted, counting the ones with date as only those count for the monthly thinning
+    checks = TaskCheck.objects.filter(task__in=tasks.values('pk'), task_time__isnull=False,
+                                      backupfile__deletion_date__isnull=True).values(
+        'id', 'task', 'task_time').annotate(dated=Count('backupfile__original_date'))
+    tasks = list(tasks)
+    task_checks = dict((task.pk, []) for task in tasks)
+    for check in checks:
+        task_checks[check['task']].append((check['id'], check['task_time'], check['dated']))
+    check_ids = []
+    seen = set()
+    for task in tasks:
+        for check_id in plan_task(task, sorted(task_checks[task.pk], key=lambda c: (c[1], c[0])), now, today):
+            if check_id not in seen:
+                seen.add(check_id)
+                check_ids.append(check_id)
+    files = {}
+    for i in range(0, len(check_ids), RETENTION_BATCH_SIZE):
+        for bf in BackupFile.objects.filter(task_check__in=check_ids[i:i + RETENTION_BATCH_SIZE],
+                                            deletion_date__isnull=True).select_related(
+                'file_backup_product__file_backup_task'):
+            files.setdefault(bf.task_check_id, []).append(bf)
+    return [bf for check_id in check_ids for bf in files.get(check_id, [])]
+
+
+def build_manifest(checker_fqdn, now=None):
+    """New DeletionManifest of a checker with the files planned for deletion now."""
+    files = [BackupFileToDeleteSerializer(bf).data for bf in plan_deletions(tasks_with_files(checker_fqdn), now)]
+    return DeletionManifest.objects.create_manifest(checker_fqdn, files)
+
+
+def build_manifests(now=None):
+    """New DeletionManifest of every checker with file backup tasks."""
+    checkers = FileBackupTask.objects.order_by('checker_fqdn').values_list('checker_fqdn', flat=True).distinct()
+    return [build_manifest(checker_fqdn, now) for checker_fqdn in checkers]
@@ -29,6 +29,30 @@ class BackupFileInfoSerializer(serializers.ModelSerializer):
         return os.path.join(obj.file_backup_product.file_backup_task.directory, obj.original_file_name)
 
 
+class BackupFileLookupSerializer(serializers.Serializer):
+    """One file of a bulk backup file info request, with the parameters of backupFileInfo."""
+    directory = serializers.CharField(max_length=512)
+    file_name = serializers.CharField(max_length=512)
+
+
+class AddBackupFileSerializer(serializers.Serializer):
+    """One file of a bulk registration. host defaults to the machine doing the request."""
+    host = serializers.CharField(required=False)
+    filename = serializers.CharField(max_length=512)
+    filedate = serializers.FloatField()
+    filesize = serializers.FloatField()
+
+
+class CompressedBackupFileSerializer(serializers.Serializer):
+    """Compressed file of a backup file, with the parameters of addCompressedBackupFile."""
+    id = serializers.IntegerField()
+    compressedfilename = serializers.CharField(max_length=512)
+    filedate = serializers.FloatField()
+    filesize = serializers.FloatField()
+    compressedmd5 = serializers.CharField(max_length=32, required=False)
+    originalmd5 = serializers.CharField(max_length=32, required=False)
+
+
 class BackupFileSerializer(serializers.ModelSerializer):
     path = serializers.SerializerMethodField('get_full_path')
 
@@ -54,6 +78,32 @@ class BackupFileToDeleteSerializer(serializers.ModelSerializer):
                             obj.compressed_file_name or obj.original_file_name)
 
 
+class BackupFileToVerifySerializer(serializers.ModelSerializer):
+    """Serializer for the files to verify, with the size and MD5 of the file on disk."""
+    path = serializers.SerializerMethodField('get_full_path')
+    size = serializers.SerializerMethodField('get_size')
+    md5 = serializers.Field(source='md5')
+    pk = serializers.Field(source='id')
+
+    class Meta:
+        model = BackupFile
+        fields = ('pk', 'path', 'size', 'md5')
+
+    def get_full_path(self, obj):
+        return os.path.join(obj.file_backup_product.file_backup_task.directory,
+                            obj.compressed_file_name or obj.original_file_name)
+
+    def get_size(self, obj):
+        return obj.compressed_file_size if obj.compressed_file_name else obj.original_file_size
+
+
+class IntegrityStatusSerializer(serializers.Serializer):
+    """MD5 computed by a checker for a backup file, empty when the file could not be read, and the file hashed."""
+    id = serializers.IntegerField()
+    md5 = serializers.CharField(max_length=32, required=False)
+    path = serializers.CharField(max_length=1024, required=False)
+
+
 class FileBackupProductSerializer(serializers.ModelSerializer):
     pattern = serializers.SerializerMethodField('get_pattern')
 
@@ -72,9 +122,9 @@ class FileBackupTaskSerializer(serializers.ModelSerializer):
     directory = serializers.CharField()
     files = FileBackupProductSerializer(source='file_backup', many=True)
     id = serializers.Field()
-    last_run = serializers.DateTimeField(source='last_run')
+    last_run = serializers.SerializerMethodField('get_last_run')
     previous_run = serializers.SerializerMethodField('get_previous_run')
-    next_run = serializers.DateTimeField('next_run')
+    next_run = serializers.SerializerMethodField('get_next_run')
 
     class Meta:
         model = FileBackupTask
@@ -92,8 +142,22 @@ class FileBackupTaskSerializer(serializers.ModelSerializer):
                    'max_backup_month',
                    'machine',)
 
+    def get_runs(self, obj):
+        """(last run, previous run, next run) of a task, from the runs in the context when they are there."""
+        runs = self.context.get('runs', {}).get(obj.pk)
+        if runs is None:
+            last_run = obj.last_run()
+            runs = (last_run, obj.last_run(last_run), obj.next_run())
+        return runs
+
+    def get_last_run(self, obj):
+        return self.get_runs(obj)[0]
+
     def get_previous_run(self, obj):
-        return obj.last_run(obj.last_run())
+        return self.get_runs(obj)[1]
+
+    def get_next_run(self, obj):
+        return self.get_runs(obj)[2]
 
 
 class BackupTaskSerializer(serializers.ModelSerializer):
@@ -0,0 +1,9 @@
+from __future__ import absolute_import
+
+from celery import shared_task
+from backups.retention import build_manifests
+
+
+@shared_task
+def build_deletion_manifests():
+    build_manifests()
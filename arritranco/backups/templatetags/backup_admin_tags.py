@@ -27,17 +27,15 @@ def today_backups():
     yesterday = today - datetime.timedelta(days=1)
     list_of_tasks = {}
     number_of_tasks = 0
-    for fbt in FileBackupTask.objects.filter(active=True, machine__up=True):
-        last_run = fbt.next_run(yesterday)
-        while last_run <= today:
-            if fbt.machine.fqdn not in list_of_tasks:
-                list_of_tasks[fbt.machine.fqdn] = []
-            number_of_tasks += 1
-            list_of_tasks[fbt.machine.fqdn].append({
-                'time': last_run,
-                'task': fbt,
-            })
-            last_run = fbt.next_run(last_run + datetime.timedelta(minutes=1))
+    for fbt, run_time in FileBackupTask.objects.occurrences(
+            yesterday, today, FileBackupTask.objects.filter(active=True, machine__up=True).select_related('machine')):
+        if fbt.machine.fqdn not in list_of_tasks:
+            list_of_tasks[fbt.machine.fqdn] = []
+        number_of_tasks += 1
+        list_of_tasks[fbt.machine.fqdn].append({
+            'time': run_time,
+            'task': fbt,
+        })
     return {
         'list_of_tasks': list_of_tasks,
         'number_of_tasks': number_of_tasks,
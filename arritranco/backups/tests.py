@@ -1,16 +1,727 @@
-"""
-This file demonstrates writing tests using the unittest module. These will pass
-when you run "manage.py test".
-
-Replace this with more appropriate tests for your application.
-"""
+import datetime
+import json
+import math
+import os
+import random
+import re
+import time
+from urllib import urlencode
 
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from backups import models as backups_models
+from backups.models import BackupFile, DeletionManifest, DELETION_MANIFEST_MAX_AGE, FileBackupProduct, \
+    FileBackupTask, FileNamePattern, FilePatternIndex, MAX_RE_GROUPS
+from backups.planner import BackupWindowPlanner, plan_tasks
+from backups.retention import build_manifest, plan_deletions, tasks_with_files
+from hardware.models import Server
+from hardware_model.models import HwModel, HwType, Manufacturer
+from inventory.models import Machine, PhysicalMachine
+from scheduler.models import TaskCheck, TaskState
+
+GB = 1024 ** 3
+
+
+class BackupFixtures(object):
+    """The checker1 and host.example.com machines, with the backup products made by create_product."""
+
+    def setUp(self):
+        FilePatternIndex.invalidate()
+        self.checker = Machine.objects.create(fqdn='checker1', up=True)
+        self.machine = Machine.objects.create(fqdn='host.example.com', up=True)
+        self.patterns = {}
+
+    def create_product(self, directory='/backups', checker='checker1', pattern='db-%Y%m%d.gz', **kwargs):
+        """Product of a new backup task of host.example.com, sharing the FileNamePattern of the same pattern."""
+        for name, default in (('minute', '0'), ('hour', '3'), ('description', 'backup')):
+            kwargs.setdefault(name, default)
+        task = FileBackupTask.objects.create(checker_fqdn=checker, machine=self.machine, directory=directory, **kwargs)
+        if pattern not in self.patterns:
+            self.patterns[pattern] = FileNamePattern.objects.create(pattern=pattern)
+        return FileBackupProduct.objects.create(file_backup_task=task, file_pattern=self.patterns[pattern])
+
+
+class BackupWindowPlannerTest(TestCase):
+    def setUp(self):
+        self.machine = Machine.objects.create(fqdn='host.example.com', up=True)
+        self.start = datetime.datetime(2014, 5, 5)  # monday
+
+    def create_task(self, minute, hour, duration=datetime.time(1, 0), checker='checker1', **kwargs):
+        return FileBackupTask.objects.create(minute=minute, hour=hour, duration=duration, checker_fqdn=checker,
+                                             machine=self.machine, directory='/backups', description='backup',
+                                             **kwargs)
+
+    def test_load(self):
+        self.create_task('30', '1')
+        self.create_task('0', '2', duration=None)
+        self.create_task('50', '23', weekday='0')
+        self.create_task('0', '1', checker='checker2')
+        self.create_task('0', '1', active=False)
+        planner = BackupWindowPlanner(self.start, hours=[1]).build()
+        load = planner.get_load('checker1')
+        self.assertEqual(load[89], 0)
+        self.assertEqual(load[90:120], [1] * 30)
+        self.assertEqual(load[120:150], [2] * 30)
+        self.assertEqual(load[150], 0)
+        # Sunday 23:50 wraps to monday
+        self.assertEqual(load[-10:], [1] * 10)
+        self.assertEqual(load[:50], [1] * 50)
+        self.assertEqual(planner.peak('checker1'), 2)
+        self.assertEqual(planner.peak('checker2'), 1)
+
+    def test_propose(self):
+        self.create_task('0', '1')
+        self.create_task('30', '2')
+        planner = BackupWindowPlanner(self.start, hours=[1, 2, 3]).build()
+        proposal = planner.propose('checker1', 30)
+        self.assertEqual((proposal.hour, proposal.minute, proposal.peak), (2, 0, 1))
+        # The proposal counts for the next ones
+        proposal = planner.propose('checker1', 30)
+        self.assertEqual((proposal.hour, proposal.minute, proposal.peak), (3, 30, 1))
+        proposal = planner.propose('checker1', 30)
+        self.assertEqual(proposal.peak, 2)
+
+    def test_plan_tasks(self):
+        tasks = [self.create_task('0', '1') for i in range(3)]
+        fixed = self.create_task('0', '1,13')
+        planner, proposals = plan_tasks(FileBackupTask.objects.all(), BackupWindowPlanner(self.start, hours=[1, 2, 3]))
+        self.assertEqual(sorted(p.task.pk for p in proposals), [t.pk for t in tasks])
+        self.assertEqual(planner.peak('checker1'), 2)
+        self.assertEqual(len(set((p.hour, p.minute) for p in proposals)), 3)
+        for proposal in proposals:
+            if proposal.changed():
+                proposal.apply()
+        self.assertEqual(FileBackupTask.objects.get(pk=fixed.pk).hour, '1,13')
+        self.assertEqual(BackupWindowPlanner(self.start).build().peak('checker1'), 2)
+
+
+class FilePatternIndexTest(TestCase):
+    def setUp(self):
+        FilePatternIndex.invalidate()
+        self.machine = Machine.objects.create(fqdn='host.example.com', up=True)
+        self.task = FileBackupTask.objects.create(minute='0', hour='1', checker_fqdn='checker1', machine=self.machine,
+                                                  directory='/backups', description='backup')
+
+    def create_product(self, pattern, task=None):
+        return FileBackupProduct.objects.create(file_backup_task=task or self.task,
+                                                file_pattern=FileNamePattern.objects.create(pattern=pattern))
+
+    def get_fbp(self, filename):
+        """get_fbp checking it returns the same product as trying the patterns one by one."""
+        expected = None
+        for fbp in FileBackupProduct.objects.filter(file_backup_task__machine=self.machine,
+                                                    file_backup_task__active=True).order_by('pk'):
+            try:
+                regex = fbp.file_pattern.get_re(self.machine)
+            except re.error:
+                continue
+            if regex.match(filename):
+                expected = fbp
+                break
+        fbp = FileBackupTask.get_fbp(self.machine, filename)
+        self.assertEqual(fbp, expected)
+        return fbp
+
+    def test_match(self):
+        db = self.create_product('db-%Y%m%d.sql.gz')
+        fqdn = self.create_product('__FQDN__-(?P<name>\w+)-(?P=name)-%Y%m%d.tar')
+        chunks = self.create_product('files-%d-%m-%Y.#.tar')
+        anything = self.create_product('.*')
+        self.assertEqual(self.get_fbp('db-20140501.sql.gz'), db)
+        self.assertEqual(self.get_fbp('host.example.com-etc-etc-20140501.tar'), fqdn)
+        self.assertEqual(self.get_fbp('files-01-05-2014.3.tar'), chunks)
+        self.assertEqual(self.get_fbp('host.example.com-etc-var-20140501.tar'), anything)
+        self.assertEqual(self.get_fbp('other'), anything)
+
+    def test_no_match(self):
+        self.create_product('db-%Y%m%d.sql.gz')
+        self.create_product('bad-(%Y')
+        self.create_product('(?i)IGNORECASE')
+        self.assertEqual(self.get_fbp('ignorecase'), FileBackupProduct.objects.get(file_pattern__pattern='(?i)IGNORECASE'))
+        self.assertEqual(self.get_fbp('db-2014.sql.gz'), None)
+        self.task.active = False
+        self.task.save()
+        self.assertEqual(self.get_fbp('db-20140501.sql.gz'), None)
+
+    def test_invalidation(self):
+        fbp = self.create_product('db-%Y%m%d.sql.gz')
+        self.assertEqual(self.get_fbp('db-20140501.sql.gz'), fbp)
+        self.assertEqual(FilePatternIndex.get(self.machine), FilePatternIndex.get(self.machine))
+        fbp.file_pattern.pattern = 'database-%Y%m%d.sql.gz'
+        fbp.file_pattern.save()
+        self.assertEqual(self.get_fbp('db-20140501.sql.gz'), None)
+        self.assertEqual(self.get_fbp('database-20140501.sql.gz'), fbp)
+        other = self.create_product('db-%Y%m%d.sql.gz')
+        self.assertEqual(self.get_fbp('db-20140501.sql.gz'), other)
+        other.delete()
+        self.assertEqual(self.get_fbp('db-20140501.sql.gz'), None)
+        fqdn = self.create_product('__FQDN__.tar')
+        self.machine.fqdn = 'other.example.com'
+        self.machine.save()
+        self.assertEqual(self.get_fbp('other.example.com.tar'), fqdn)
+
+    def test_subclass_invalidation(self):
+        hw_model = HwModel.objects.create(type=HwType.objects.create(name='server', slug='server'),
+                                          manufacturer=Manufacturer.objects.create(name='acme', slug='acme'),
+                                          name='s1', slug='s1')
+        machine = PhysicalMachine.objects.create(fqdn='physical.example.com', up=True,
+                                                 server=Server.objects.create(model=hw_model, serial_number='1'))
+        task = FileBackupTask.objects.create(minute='0', hour='1', checker_fqdn='checker1', machine=machine,
+                                             directory='/backups', description='backup')
+        fqdn = self.create_product('__FQDN__.tar', task)
+        self.assertEqual(FileBackupTask.get_fbp(machine, 'physical.example.com.tar'), fqdn)
+        machine.fqdn = 'renamed.example.com'
+        machine.save()
+        self.assertEqual(FileBackupTask.get_fbp(machine, 'renamed.example.com.tar'), fqdn)
+        self.assertEqual(FileBackupTask.get_fbp(machine, 'physical.example.com.tar'), None)
+
+    def test_many_patterns(self):
+        products = [self.create_product('f%d-%%Y%%m%%d%%H%%M.tar' % i) for i in range(MAX_RE_GROUPS)]
+        index = FilePatternIndex.get(self.machine)
+        self.assertTrue(len(index.regexes) > 1)
+        for i in (0, 50, MAX_RE_GROUPS - 1):
+            self.assertEqual(self.get_fbp('f%d-201405011230.tar' % i), products[i])
+
+
+class AddBackupFilesTest(BackupFixtures, TestCase):
+    def setUp(self):
+        super(AddBackupFilesTest, self).setUp()
+        self.fbp = self.create_product()
+        self.task = self.fbp.file_backup_task
+
+    def timestamp(self, *args):
+        return time.mktime(datetime.datetime(*args).timetuple())
+
+    def test_register(self):
+        files = [
+            (self.fbp, 'db-20140501.gz', datetime.datetime(2014, 5, 1, 3, 10), 100),
+            (self.fbp, 'db-20140502.gz', datetime.datetime(2014, 5, 2, 2, 50), 100),
+            (self.fbp, 'db-20140501.gz', datetime.datetime(2014, 5, 1, 3, 10), 100),
+        ]
+        results = BackupFile.objects.register(files)
+        self.assertEqual(results, [(datetime.datetime(2014, 5, 1, 3, 0), True),
+                                   (datetime.datetime(2014, 5, 2, 3, 0), True),
+                                   (datetime.datetime(2014, 5, 1, 3, 0), False)])
+        self.assertEqual(BackupFile.objects.count(), 2)
+        self.assertEqual(TaskCheck.objects.count(), 2)
+        self.assertEqual(TaskState.objects.get(task=self.task).task_time, datetime.datetime(2014, 5, 2, 3, 0))
+        self.assertEqual([created for task_time, created in BackupFile.objects.register(files[:2])], [False, False])
+        self.assertEqual(BackupFile.objects.count(), 2)
+
+    def test_post(self):
+        records = [
+            {'host': 'host.example.com', 'filename': 'db-20140501.gz', 'filedate': self.timestamp(2014, 5, 1, 3, 10),
+             'filesize': 1024},
+            {'host': 'host.example.com', 'filename': 'other.gz', 'filedate': self.timestamp(2014, 5, 1, 3, 10),
+             'filesize': 1024},
+            {'host': 'unknown', 'filename': 'db-20140501.gz', 'filedate': self.timestamp(2014, 5, 1, 3, 10),
+             'filesize': 1024},
+        ]
+        response = self.client.post(reverse('addBackupFiles'), json.dumps(records), content_type='application/json',
+                                    HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['status'] for r in json.loads(response.content)], ['created', 'no pattern', 'no machine'])
+        bf = BackupFile.objects.get()
+        self.assertEqual((bf.file_backup_product, bf.task_check.task_time, bf.original_file_size),
+                         (self.fbp, datetime.datetime(2014, 5, 1, 3, 0), 1024))
+        response = self.client.post(reverse('addBackupFiles'), json.dumps(records[:1]),
+                                    content_type='application/json', HTTP_ACCEPT='application/json')
+        self.assertEqual(json.loads(response.content)[0]['status'], 'exists')
+        response = self.client.post(reverse('addBackupFiles'), json.dumps([{'filename': 'db-20140501.gz'}]),
+                                    content_type='application/json', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_compressed(self):
+        BackupFile.objects.register([(self.fbp, 'db-20140501.gz', datetime.datetime(2014, 5, 1, 3, 10), 100),
+                                     (self.fbp, 'db-20140502.gz', datetime.datetime(2014, 5, 2, 3, 10), 100)])
+        BackupFile.objects.filter(original_file_name='db-20140502.gz').update(compressed_file_name='db-20140502.gz.7z')
+        records = [{'host': 'host.example.com', 'filename': filename, 'filedate': self.timestamp(2014, 5, 1, 3, 10),
+                    'filesize': 10}
+                   for filename in ('db-20140501.gz.bz2', 'db-20140501.gz.bz2.tmp', 'db-20140502.gz.7z',
+                                    'db-20140503.gz.bz2', 'db-20140503.gz')]
+        response = self.client.post(reverse('addBackupFiles'), json.dumps(records), content_type='application/json',
+                                    HTTP_ACCEPT='application/json')
+        self.assertEqual([r['status'] for r in json.loads(response.content)],
+                         ['compressed', 'compressed', 'compressed', 'created', 'created'])
+        self.assertEqual(BackupFile.objects.count(), 4)
+
+
+class RetentionFixtures(BackupFixtures):
+    def setUp(self):
+        super(RetentionFixtures, self).setUp()
+        self.now = datetime.datetime.now().replace(hour=3, minute=0, second=0, microsecond=0)
+        self.rnd = random.Random(14)
+
+    def create_task(self, days=400, **kwargs):
+        fbp = self.create_product(**kwargs)
+        task = fbp.file_backup_task
+        for day in range(days):
+            task_time = self.now - datetime.timedelta(days=day)
+            if self.rnd.random() < 0.1:
+                continue
+            check = TaskCheck.objects.create(task=task, task_time=task_time)
+            for i in range(self.rnd.choice((1, 1, 2))):
+                BackupFile.objects.create(
+                    file_backup_product=fbp, task_check=check, original_file_name='db-%d-%d' % (day, i),
+                    original_file_size=1, original_date=None if self.rnd.random() < 0.1 else task_time,
+                    deletion_date=task_time if self.rnd.random() < 0.2 else None)
+        return task
+
+    def old_plan(self):
+        """Files the view selected before the retention module, check by check."""
+        selected = []
+        today = datetime.date.today()
+        for task in tasks_with_files('checker1'):
+            checks = list(TaskCheck.objects.filter(
+                task=task, task_time__lte=datetime.datetime.now() - datetime.timedelta(days=task.days_in_hard_drive)))
+            first_month_day = datetime.datetime(today.year, today.month, 1, 0, 0, 0)
+            for m in range(1, 12):
+                last_month_day = first_month_day
+                tmp_day = last_month_day - datetime.timedelta(minutes=1)
+                first_month_day = datetime.datetime(tmp_day.year, tmp_day.month, 1, 0, 0, 0)
+                tchs = [tch for tch in TaskCheck.objects.filter(
+                    task=task, task_time__gte=first_month_day, task_time__lte=last_month_day,
+                    backupfile__deletion_date__isnull=True, backupfile__original_date__isnull=False).distinct()
+                    .order_by('task_time') if tch.backupfile_set.filter(deletion_date__isnull=True).count()]
+                if len(tchs) > task.max_backup_month:
+                    step = float(len(tchs)) / (len(tchs) - task.max_backup_month)
+                    last = len(tchs) - step
+                    while last >= 0:
+                        checks.append(tchs[int(math.ceil(last))])
+                        last -= step
+            for tch in checks:
+                selected.extend(tch.backupfile_set.filter(deletion_date__isnull=True))
+        return set(bf.pk for bf in selected)
+
+
+class RetentionTest(RetentionFixtures, TestCase):
+    def test_same_files(self):
+        self.create_task(days_in_hard_drive=180, max_backup_month=7)
+        self.create_task(days_in_hard_drive=60, max_backup_month=2)
+        self.create_task(days=90, days_in_hard_drive=30, max_backup_month=0)
+        files = plan_deletions(tasks_with_files('checker1'))
+        self.assertEqual(len(files), len(set(files)))
+        self.assertTrue(files)
+        self.assertEqual(set(bf.pk for bf in files), self.old_plan())
+
+    def test_queries(self):
+        self.create_task(days=60)
+        with CaptureQueriesContext(connection) as one_task:
+            plan_deletions(tasks_with_files('checker1'))
+        for i in range(3):
+            self.create_task(days=60)
+        with CaptureQueriesContext(connection) as four_tasks:
+            plan_deletions(tasks_with_files('checker1'))
+        self.assertEqual(len(one_task), len(four_tasks))
+
+    def test_get(self):
+        task = self.create_task(days=5, days_in_hard_drive=2)
+        other = Machine.objects.create(fqdn='other.example.com', up=True)
+        response = self.client.get(reverse('backup-files-to-delete'), {'checker': 'checker1'},
+                                   HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(f['pk'] for f in json.loads(response.content)), self.old_plan())
+        response = self.client.get(reverse('backup-files-to-delete'), {'checker': 'checker1', 'host': other.fqdn},
+                                   HTTP_ACCEPT='application/json')
+        self.assertEqual(json.loads(response.content), [])
+
+
+class DeletionManifestTest(RetentionFixtures, TestCase):
+    def get(self, **kwargs):
+        return self.client.get(reverse('backup-files-to-delete'), {'checker': 'checker1'},
+                               HTTP_ACCEPT='application/json', **kwargs)
+
+    def test_build(self):
+        self.create_task(days_in_hard_drive=60, max_backup_month=2)
+        call_command('build_deletion_manifests', stdout=open(os.devnull, 'w'))
+        manifest = DeletionManifest.objects.latest_for('checker1')
+        self.assertEqual(manifest.generation, 1)
+        self.assertEqual(set(manifest.entries.values_list('backup_file', flat=True)), self.old_plan())
+        self.assertEqual(manifest.size, len(self.old_plan()))
+        for i in range(3):
+            build_manifest('checker1')
+        self.assertEqual(list(DeletionManifest.objects.values_list('generation', flat=True).order_by('generation')),
+                         [3, 4])
+        self.assertEqual(DeletionManifest.objects.latest_for('checker1').digest, manifest.digest)
+        self.assertEqual(DeletionManifest.objects.latest_for('checker2'), None)
+
+    def test_get(self):
+        self.create_task(days=100, days_in_hard_drive=60)
+        manifest = build_manifest('checker1')
+        with CaptureQueriesContext(connection) as context:
+            response = self.get()
+        # Resolving the checker and reading the manifest
+        self.assertTrue(len(context) <= 5, len(context))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Manifest-Generation'], '1')
+        files = json.loads(response.content)
+        self.assertEqual(set(f['pk'] for f in files), self.old_plan())
+        etag = response['ETag']
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        BackupFile.objects.filter(pk=files[0]['pk']).update(deletion_date=datetime.datetime.now())
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.content)), len(files) - 1)
+        self.assertNotEqual(response['ETag'], etag)
+        # Files compressed after planning are served with their compressed file
+        etag = response['ETag']
+        bf = BackupFile.objects.get(pk=files[1]['pk'])
+        bf.compressed_file_name = bf.original_file_name + '.bz2'
+        bf.save()
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual([f['path'] for f in json.loads(response.content) if f['pk'] == bf.pk], [bf.path()])
+        # Filtering by host plans in the request
+        response = self.client.get(reverse('backup-files-to-delete'), {'checker': 'checker1', 'host': 'other'},
+                                   HTTP_ACCEPT='application/json')
+        self.assertEqual(json.loads(response.content), [])
+
+    def test_stale(self):
+        self.create_task(days=100, days_in_hard_drive=60)
+        manifest = build_manifest('checker1')
+        DeletionManifest.objects.filter(pk=manifest.pk).update(
+            created=datetime.datetime.now() - DELETION_MANIFEST_MAX_AGE - datetime.timedelta(hours=1))
+        response = self.get()
+        self.assertEqual(response['X-Manifest-Generation'], '2')
+        self.assertEqual(set(f['pk'] for f in json.loads(response.content)), self.old_plan())
+        self.assertEqual(self.get()['X-Manifest-Generation'], '2')
+
+
+class DeletedFilesTest(BackupFixtures, TestCase):
+    def setUp(self):
+        super(DeletedFilesTest, self).setUp()
+        self.files = {}
+        for directory, checker in (('/backups/a', 'checker1'), ('/backups/b', 'checker1'), ('/backups/c', 'other')):
+            fbp = self.create_product(directory, checker)
+            check = TaskCheck.objects.create(task=fbp.file_backup_task, task_time=datetime.datetime(2014, 5, 1, 3, 0))
+            for name in ('db-1', 'db-2'):
+                self.files[(directory, name)] = BackupFile.objects.create(
+                    file_backup_product=fbp, task_check=check, original_file_name=name,
+                    compressed_file_name=name + '.bz2', original_file_size=1)
+
+    def deleted(self):
+        return sorted(k for k, bf in self.files.items()
+                      if BackupFile.objects.get(pk=bf.pk).deletion_date is not None)
+
+    def test_post(self):
+        paths = ['/backups/a/db-1', '/backups/b/db-2.bz2', '/backups/a/missing', '/backups/c/db-1', '/backups/db-2']
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse('backup-files-to-delete') + '?checker=checker1',
+                                        {'deleted_files': paths}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), [[paths[0], True], [paths[1], True], [paths[2], False],
+                                                        [paths[3], False], [paths[4], True]])
+        self.assertEqual(self.deleted(), [('/backups/a', 'db-1'), ('/backups/a', 'db-2'), ('/backups/b', 'db-2')])
+        # Resolving the checker and two queries per directory
+        self.assertTrue(len(context) <= 2 + 2 * 4, len(context))
+        response = self.client.post(reverse('backup-files-to-delete') + '?checker=checker1', {},
+                                    HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class BackupFilesInfoTest(BackupFixtures, TestCase):
+    def setUp(self):
+        super(BackupFilesInfoTest, self).setUp()
+        self.files = {}
+        for directory, checker in (('/backups/a', 'checker1'), ('/backups/b', 'other')):
+            fbp = self.create_product(directory, checker, 'db-%Y%m%d.tar')
+            for day in (2, 1):
+                self.files[(directory, day)] = BackupFile.objects.create(
+                    file_backup_product=fbp, original_file_name='db.tar', compressed_file_name='db.tar.bz2',
+                    original_file_size=day, original_date=datetime.datetime(2014, 5, day, 3, 0))
+            self.files[(directory, 'new')] = BackupFile.objects.create(
+                file_backup_product=fbp, original_file_name='new.tar', original_file_size=1,
+                original_date=datetime.datetime(2014, 5, 3, 3, 0))
+
+    def test_lookup(self):
+        files = [('/backups/a', 'db.tar'), ('/backups/a', 'db.tar.bz2'), ('/backups/a', 'new.tar.bz2'),
+                 ('/backups/a', 'missing'), ('/backups/b', 'new.tar'), ('/backups/c', 'db.tar')]
+        self.assertEqual(BackupFile.objects.lookup('checker1', files),
+                         [self.files[('/backups/a', 1)], self.files[('/backups/a', 1)],
+                          self.files[('/backups/a', 'new')], None, None, None])
+        self.assertEqual(BackupFile.objects.lookup('other', files[4:5]), [self.files[('/backups/b', 'new')]])
+
+    def test_post(self):
+        records = [{'directory': '/backups/a', 'file_name': 'new.tar.bz2'},
+                   {'directory': '/backups/a', 'file_name': 'missing'}]
+        response = self.client.post(reverse('BackupFilesInfo') + '?checker=checker1', json.dumps(records),
+                                    content_type='application/json', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        info, missing = json.loads(response.content)
+        self.assertEqual((info['id'], info['path'], missing), (self.files[('/backups/a', 'new')].pk,
+                                                                '/backups/a/new.tar', None))
+        response = self.client.post(reverse('BackupFilesInfo') + '?checker=checker1', json.dumps([{}]),
+                                    content_type='application/json', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('BackupFileInfo'), {'checker': 'checker1', 'directory': '/backups/a',
+                                                               'file_name': 'db.tar.bz2'},
+                                   HTTP_ACCEPT='application/json')
+        self.assertEqual(json.loads(response.content)['id'], self.files[('/backups/a', 1)].pk)
+
+
+class IntegrityTest(BackupFixtures, TestCase):
+    def setUp(self):
+        super(IntegrityTest, self).setUp()
+        self.files = {}
+        for directory, checker in (('/backups/a', 'checker1'), ('/backups/b', 'other')):
+            fbp = self.create_product(directory, checker, 'db-%Y%m%d.tar')
+            for name, original_md5, compressed_name, compressed_md5, deletion_date in (
+                    ('plain', 'a' * 32, '', '', None),
+                    ('compressed', 'a' * 32, 'compressed.bz2', 'B' * 32, None),
+                    ('nomd5', '', '', '', None),
+                    ('deleted', 'a' * 32, '', '', datetime.datetime(2014, 5, 1))):
+                self.files[(directory, name)] = BackupFile.objects.create(
+                    file_backup_product=fbp, original_file_name=name, original_md5=original_md5,
+                    original_file_size=10, compressed_file_name=compressed_name, compressed_md5=compressed_md5,
+                    compressed_file_size=5 if compressed_name else None, deletion_date=deletion_date)
+
+    def test_get(self):
+        response = self.client.get(reverse('backup-files-to-verify'), {'checker': 'checker1', 'limit': 1},
+                                   HTTP_ACCEPT='application/json')
+        self.assertEqual(json.loads(response.content), [{'pk': self.files[('/backups/a', 'plain')].pk,
+                                                         'path': '/backups/a/plain', 'size': 10, 'md5': 'a' * 32}])
+        response = self.client.get(reverse('backup-files-to-verify'),
+                                   {'checker': 'checker1', 'after': response['X-Next-Cursor']},
+                                   HTTP_ACCEPT='application/json')
+        self.assertEqual(json.loads(response.content), [{'pk': self.files[('/backups/a', 'compressed')].pk,
+                                                         'path': '/backups/a/compressed.bz2', 'size': 5,
+                                                         'md5': 'B' * 32}])
+        self.assertFalse(response.has_header('X-Next-Cursor'))
+        self.files[('/backups/a', 'plain')].integrity_checked = True
+        self.files[('/backups/a', 'plain')].save()
+        response = self.client.get(reverse('backup-files-to-verify'), {'checker': 'checker1', 'unchecked': 1},
+                                   HTTP_ACCEPT='application/json')
+        self.assertEqual([f['pk'] for f in json.loads(response.content)],
+                         [self.files[('/backups/a', 'compressed')].pk])
+
+    def test_post(self):
+        records = [{'id': self.files[('/backups/a', 'plain')].pk, 'md5': 'A' * 32},
+                   {'id': self.files[('/backups/a', 'compressed')].pk, 'md5': 'a' * 32},
+                   {'id': self.files[('/backups/a', 'nomd5')].pk},
+                   {'id': self.files[('/backups/b', 'plain')].pk, 'md5': 'a' * 32}]
+        response = self.client.post(reverse('set-integrity-status') + '?checker=checker1', json.dumps(records),
+                                    content_type='application/json', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), [[r['id'], checked]
+                                                        for r, checked in zip(records, [True, False, False, None])])
+        self.assertEqual([BackupFile.objects.get(pk=r['id']).integrity_checked for r in records],
+                         [True, False, False, None])
+        response = self.client.post(reverse('set-integrity-status') + '?checker=checker1', json.dumps([{}]),
+                                    content_type='application/json', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_post_path(self):
+        compressed = self.files[('/backups/a', 'compressed')]
+        # The original was hashed, but the file was compressed before the report
+        records = [{'id': compressed.pk, 'md5': '', 'path': '/backups/a/compressed'},
+                   {'id': compressed.pk, 'md5': 'b' * 32, 'path': '/backups/a/compressed.bz2'}]
+        response = self.client.post(reverse('set-integrity-status') + '?checker=checker1', json.dumps(records[:1]),
+                                    content_type='application/json', HTTP_ACCEPT='application/json')
+        self.assertEqual(json.loads(response.content), [[compressed.pk, None]])
+        self.assertEqual(BackupFile.objects.get(pk=compressed.pk).integrity_checked, None)
+        response = self.client.post(reverse('set-integrity-status') + '?checker=checker1', json.dumps(records[1:]),
+                                    content_type='application/json', HTTP_ACCEPT='application/json')
+        self.assertEqual(json.loads(response.content), [[compressed.pk, True]])
+
+
+class WatchedDirectoriesTest(TestCase):
+    def test_get(self):
+        Machine.objects.create(fqdn='checker1', up=True)
+        host1 = Machine.objects.create(fqdn='host1.example.com', up=True)
+        host2 = Machine.objects.create(fqdn='host2.example.com', up=True)
+        db = FileNamePattern.objects.create(pattern='db-%Y%m%d.gz')
+        fqdn = FileNamePattern.objects.create(pattern='__FQDN__-#.tar')
+        for machine, directory, checker, active, patterns in (
+                (host2, '/backups/b', 'checker1', True, (fqdn, db)),
+                (host1, '/backups/b', 'checker1', True, (db,)),
+                (host1, '/backups/a', 'checker1', True, (db, db)),
+                (host1, '/backups/c', 'checker1', False, (db,)),
+                (host1, '/backups/d', 'other', True, (db,))):
+            task = FileBackupTask.objects.create(minute='0', hour='3', checker_fqdn=checker, machine=machine,
+                                                 directory=directory, description='backup', active=active)
+            for pattern in patterns:
+                FileBackupProduct.objects.create(file_backup_task=task, file_pattern=pattern)
+        response = self.client.get(reverse('backup-watched-directories'), {'checker': 'checker1'},
+                                   HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        db_re = db.get_re_pattern()
+        self.assertEqual(json.loads(response.content), [
+            {'directory': '/backups/a', 'hosts': [{'host': 'host1.example.com', 'patterns': [db_re]}]},
+            {'directory': '/backups/b', 'hosts': [
+                {'host': 'host2.example.com', 'patterns': [fqdn.get_re_pattern(host2), db_re]},
+                {'host': 'host1.example.com', 'patterns': [db_re]}]},
+        ])
+
+
+class CompressionFixtures(BackupFixtures):
+    def setUp(self):
+        super(CompressionFixtures, self).setUp()
+        fbp = self.create_product()
+        day = datetime.datetime(2014, 5, 1, 3, 0)
+        self.files = []
+        for i, size in enumerate((1, 2, 1, 3, 1, 1)):
+            self.files.append(BackupFile.objects.create(
+                file_backup_product=fbp, original_file_name='db-%d' % i, original_file_size=size * GB,
+                original_date=day - datetime.timedelta(days=i // 2)))
+        self.files.append(BackupFile.objects.create(file_backup_product=fbp, original_file_name='nodate',
+                                                    original_file_size=GB))
+        BackupFile.objects.create(file_backup_product=fbp, original_file_name='compressed', original_file_size=GB,
+                                  original_date=day, compressed_file_name='compressed.bz2')
+        BackupFile.objects.create(file_backup_product=fbp, original_file_name='deleted', original_file_size=GB,
+                                  original_date=day, deletion_date=day)
+        # Newest first, the ones of the same day by id descending
+        self.order = [self.files[i] for i in (1, 0, 3, 2, 5, 4, 6)]
+
+
+class FilesToCompressTest(CompressionFixtures, TestCase):
+    def pages(self, budget, limit=None):
+        pages = []
+        after = None
+        while True:
+            files, more = BackupFile.objects.to_compress('checker1', budget * GB, after, limit)
+            pages.append([bf.original_file_name for bf in files])
+            if not more or not files:
+                return pages
+            after = files[-1]
+
+    def check_pages(self):
+        names = [bf.original_file_name for bf in self.order]
+        self.assertEqual(self.pages(100), [names])
+        # The file going past the budget is included
+        self.assertEqual(self.pages(3), [names[:3], names[3:], []])
+        self.assertEqual(self.pages(100, limit=3), [names[:3], names[3:6], names[6:]])
+
+    def test_window(self):
+        if not backups_models.supports_window_functions():
+            return
+        self.check_pages()
+
+    def test_loop(self):
+        supports_window_functions = backups_models.supports_window_functions
+        backups_models.supports_window_functions = lambda: False
+        try:
+            self.check_pages()
+        finally:
+            backups_models.supports_window_functions = supports_window_functions
+
+    def test_get(self):
+        url = reverse('backup-files-to-compress')
+        response = self.client.get(url, {'checker': 'checker1', 'budget_gb': '3'}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([f['id'] for f in json.loads(response.content)], [bf.pk for bf in self.order[:3]])
+        self.assertEqual(json.loads(response.content)[0]['path'], '/backups/db-1')
+        response = self.client.get(url, {'checker': 'checker1', 'budget_gb': '3', 'after': response['X-Next-Cursor']},
+                                   HTTP_ACCEPT='application/json')
+        self.assertEqual([f['id'] for f in json.loads(response.content)], [bf.pk for bf in self.order[3:]])
+        response = self.client.get(url, {'checker': 'checker1'}, HTTP_ACCEPT='application/json')
+        self.assertEqual(len(json.loads(response.content)), 7)
+        self.assertFalse(response.has_header('X-Next-Cursor'))
+        response = self.client.get(url, {'checker': 'checker1', 'limit': 'x'}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class CompressionClaimTest(CompressionFixtures, TestCase):
+    def claim(self, worker, **params):
+        params.setdefault('checker', 'checker1')
+        response = self.client.post('%s?%s' % (reverse('backup-files-to-compress-claim'), urlencode(params)),
+                                    HTTP_ACCEPT='application/json', REMOTE_ADDR=worker)
+        self.assertEqual(response.status_code, 200)
+        return [f['id'] for f in json.loads(response.content)]
+
+    def test_claim(self):
+        first = self.claim('10.0.0.1', budget_gb=3)
+        self.assertEqual(first, [bf.pk for bf in self.order[:3]])
+        second = self.claim('10.0.0.2', limit=2)
+        self.assertEqual(second, [bf.pk for bf in self.order[3:5]])
+        # Claimed files are not listed
+        files, more = BackupFile.objects.to_compress('checker1', 100 * GB)
+        self.assertEqual([bf.pk for bf in files], [bf.pk for bf in self.order[5:]])
+        self.assertEqual(BackupFile.objects.get(pk=first[0]).compression_claimed_by, '10.0.0.1')
+        # Expired leases can be claimed again
+        BackupFile.objects.filter(pk__in=first).update(
+            compression_lease_expires=datetime.datetime.now() - datetime.timedelta(minutes=1))
+        self.assertEqual(self.claim('10.0.0.3'), first + [bf.pk for bf in self.order[5:]])
+        self.assertEqual(self.client.get(reverse('backup-files-to-compress-claim'),
+                                         {'checker': 'checker1'}).status_code, 405)
+
+    def test_concurrent_claim(self):
+        first = BackupFile.objects.claim('checker1', '10.0.0.1', 100 * GB)
+        self.assertEqual([bf.pk for bf in first], [bf.pk for bf in self.order])
+        # A second worker choosing the same files before the first one leased them gets none
+        to_compress = BackupFile.objects.to_compress
+        BackupFile.objects.to_compress = lambda *args, **kwargs: (first, False)
+        try:
+            self.assertEqual(BackupFile.objects.claim('checker1', '10.0.0.2', 100 * GB), [])
+        finally:
+            BackupFile.objects.to_compress = to_compress
+        self.assertEqual(set(BackupFile.objects.filter(pk__in=[bf.pk for bf in first]).values_list(
+            'compression_claimed_by', flat=True)), set(['10.0.0.1']))
+
+    def test_complete(self):
+        claimed = self.claim('10.0.0.1', limit=2)
+        records = [{'id': claimed[0], 'compressedfilename': 'db-1.bz2', 'filedate': time.time(), 'filesize': 10,
+                    'compressedmd5': 'a' * 32},
+                   {'id': 0, 'compressedfilename': 'missing.bz2', 'filedate': time.time(), 'filesize': 10}]
+        response = self.client.post(reverse('addCompressedBackupFiles'), json.dumps(records),
+                                    content_type='application/json', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), [[claimed[0], True], [0, False]])
+        bf = BackupFile.objects.get(pk=claimed[0])
+        self.assertEqual((bf.compressed_file_name, bf.compressed_file_size, bf.compressed_md5),
+                         ('db-1.bz2', 10, 'a' * 32))
+        self.assertEqual((bf.compression_claimed_by, bf.compression_lease_expires), (None, None))
+        self.assertEqual(BackupFile.objects.get(pk=claimed[1]).compression_claimed_by, '10.0.0.1')
+        response = self.client.post(reverse('addCompressedBackupFiles'), json.dumps([{'id': claimed[1]}]),
+                                    content_type='application/json', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class BackupFileCheckerTest(BackupFixtures, TestCase):
+    def create_task(self, description, **kwargs):
+        return self.create_product(description=description, **kwargs).file_backup_task
+
+    def get(self, **kwargs):
+        return self.client.get(reverse('backup-file-checker'), {'checker': 'checker1'},
+                               HTTP_ACCEPT='application/json', **kwargs)
 
+    def test_get(self):
+        ok = self.create_task('ok')
+        ok.update_status(ok.last_run(), 'Ok')
+        old_ok = self.create_task('old ok')
+        old_ok.update_status(old_ok.last_run(old_ok.last_run()), 'Ok')
+        critical = self.create_task('critical', hour='4')
+        critical.update_status(critical.last_run(), 'Critical')
+        self.create_task('unchecked')
+        self.create_task('inactive', active=False)
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        tasks = json.loads(response.content)['host.example.com']
+        self.assertEqual(sorted(t['description'] for t in tasks), ['critical', 'old ok', 'unchecked'])
+        task = [t for t in tasks if t['description'] == 'critical'][0]
+        last_run = critical.last_run()
+        self.assertEqual(task['last_run'], last_run.isoformat())
+        self.assertEqual(task['previous_run'], critical.last_run(last_run).isoformat())
+        self.assertEqual(task['next_run'], critical.next_run().isoformat())
+        self.assertEqual(task['files'], [{'pattern': 'db-%Y%m%d.gz', 'start_seq': None, 'end_seq': None,
+                                          'variable_percentage': '20'}])
+        etag = response['ETag']
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        critical.update_status(critical.last_run(), 'Ok')
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
 
-class SimpleTest(TestCase):
-    def test_basic_addition(self):
-        """
-        Tests that 1 + 1 always equals 2.
-        """
-        self.assertEqual(1 + 1, 2)
+    def test_queries(self):
+        self.create_task('first')
+        with CaptureQueriesContext(connection) as one_task:
+            self.get()
+        for i in range(5):
+            self.create_task('task %d' % i, hour=str(i))
+        with CaptureQueriesContext(connection) as six_tasks:
+            self.get()
+        self.assertEqual(len(one_task), len(six_tasks))
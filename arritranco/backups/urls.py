@@ -8,11 +8,20 @@ urlpatterns = patterns('',
                        url(r'^todo/$', FileBackupsTodo.as_view(), name='backups-todo'),
                        url(r'^backupfilechecker/$', BackupFileCheckerView.as_view(), name='backup-file-checker'),
                        url(r'^filesToCompress$', FilesToCompressView.as_view(), name='backup-files-to-compress'),
+                       url(r'^filesToCompress/claim$', ClaimFilesToCompressView.as_view(),
+                           name='backup-files-to-compress-claim'),
                        url(r'^filesToDelete$', FilesToDeleteView.as_view(), name='backup-files-to-delete'),
+                       url(r'^filesToVerify$', FilesToVerifyView.as_view(), name='backup-files-to-verify'),
+                       url(r'^watchedDirectories$', WatchedDirectoriesView.as_view(), name='backup-watched-directories'),
+                       url(r'^set_integrity_status$', SetIntegrityStatusView.as_view(), name='set-integrity-status'),
                        url(r'^addBackupFile$', add_backup_file, name="addBackupFile"),
+                       url(r'^addBackupFiles$', AddBackupFilesView.as_view(), name="addBackupFiles"),
                        url(r'^backupFileInfo$', GetBackupFileInfo.as_view(), name="BackupFileInfo"),
+                       url(r'^backupFilesInfo$', BackupFilesInfoView.as_view(), name="BackupFilesInfo"),
                        url(r'^addWindowsBackupFile$', add_backup_file, {'windows': True}, name="addWindowsBackupFile"),
                        url(r'^registerFileFromChecker$', register_file_from_checker, name="register_file_from_checker"),
                        url(r'^addCompressedBackupFile$', add_compressed_backup_file, name="addCompressedBackupFile"),
+                       url(r'^addCompressedBackupFiles$', AddCompressedBackupFilesView.as_view(),
+                           name="addCompressedBackupFiles"),
                        url(r'^(?P<pk>[^/]+)/$', BackupTaskView.as_view()),
 )
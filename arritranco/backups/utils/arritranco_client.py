@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+HTTP client of the backup utilities for the inventory REST API.
+
+Connections are kept alive and reused (one per server and thread), failed
+requests are retried with an exponential backoff, task status updates are sent
+in batches and backup file info is looked up for many files at once.
+"""
+
+import httplib
+import json
+import logging
+import socket
+import threading
+import time
+import urllib
+import urlparse
+
+logger = logging.getLogger(__name__)
+
+# Status codes worth retrying, the server or a proxy could be restarting
+RETRY_STATUS = (502, 503, 504)
+
+
+class ArritrancoError(Exception):
+    """The inventory answered with an error status."""
+
+    def __init__(self, status, body):
+        Exception.__init__(self, "HTTP %d: %s" % (status, body[:200]))
+        self.status = status
+        self.body = body
+
+
+class ArritrancoClient(object):
+    """Keep-alive JSON client, safe to use from several threads."""
+
+    def __init__(self, retries=3, backoff=1.0, timeout=120):
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def _connection(self, scheme, netloc):
+        connections = getattr(self.local, 'connections', None)
+        if connections is None:
+            connections = self.local.connections = {}
+        if (scheme, netloc) not in connections:
+            if scheme == 'https':
+                connections[(scheme, netloc)] = httplib.HTTPSConnection(netloc, timeout=self.timeout)
+            else:
+                connections[(scheme, netloc)] = httplib.HTTPConnection(netloc, timeout=self.timeout)
+        return connections[(scheme, netloc)]
+
+    def _close(self, scheme, netloc):
+        connection = self.local.connections.pop((scheme, netloc), None)
+        if connection is not None:
+            connection.close()
+
+    def request(self, method, url, body=None, headers=None):
+        """(status, body, headers) of a request, retrying on connection errors and RETRY_STATUS."""
+        url = urlparse.urlsplit(url)
+        path = url.path or '/'
+        if url.query:
+            path += '?' + url.query
+        headers = dict(headers or {})
+        attempt = 0
+        while True:
+            try:
+                connection = self._connection(url.scheme, url.netloc)
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+                data = response.read()
+                if response.will_close:
+                    self._close(url.scheme, url.netloc)
+                if response.status not in RETRY_STATUS or attempt >= self.retries:
+                    return response.status, data, dict(response.getheaders())
+                logger.warning("%s %s: HTTP %d, retrying", method, url.geturl(), response.status)
+            except (socket.error, httplib.HTTPException), e:
+                # A kept alive connection closed by the server fails here too
+                self._close(url.scheme, url.netloc)
+                if attempt >= self.retries:
+                    raise
+                logger.warning("%s %s: %s, retrying", method, url.geturl(), e)
+            time.sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+
+    def _request_json(self, method, url, data=None, params=None):
+        if params:
+            url += ('&' if '?' in url else '?') + urllib.urlencode(params)
+        headers = {'Accept': 'application/json'}
+        body = None
+        if data is not None:
+            body = json.dumps(data)
+            headers['Content-Type'] = 'application/json'
+        status, response, response_headers = self.request(method, url, body, headers)
+        if not 200 <= status < 300:
+            raise ArritrancoError(status, response)
+        return (json.loads(response) if response else None), response_headers
+
+    def request_json(self, method, url, data=None, params=None):
+        """Response of a request (with data sent as JSON) to the inventory, parsed."""
+        return self._request_json(method, url, data, params)[0]
+
+    def get_json(self, url, params=None):
+        return self.request_json('GET', url, params=params)
+
+    def post_json(self, url, data, params=None):
+        return self.request_json('POST', url, data, params)
+
+    def get_pages(self, url, params=None):
+        """Items of every page of a listing, following the X-Next-Cursor header with the after parameter."""
+        params = dict(params or {})
+        while True:
+            items, headers = self._request_json('GET', url, params=params)
+            for item in items:
+                yield item
+            if 'x-next-cursor' not in headers:
+                return
+            params['after'] = headers['x-next-cursor']
+
+    def file_info(self, url, files, checker=None):
+        """Info of many backup files with a single request.
+
+        files are (directory, file name) pairs; returns a dict with the info of
+        each of them, None for the files the inventory does not know.
+        """
+        files = list(files)
+        if not files:
+            return {}
+        params = {'checker': checker} if checker else None
+        infos = self.post_json(url, [{'directory': d, 'file_name': f} for d, f in files], params)
+        return dict(zip(files, infos))
+
+
+class StatusSender(object):
+    """Sends task status to the bulk status endpoint, batch_size of them at once."""
+
+    def __init__(self, client, url, batch_size=50):
+        self.client = client
+        self.url = url
+        self.batch_size = batch_size
+        self.batch = []
+
+    def add(self, status):
+        """Queues a {task, task_time, status, comment} record, sending the batch when full."""
+        self.batch.append(status)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, []
+        logger.info("    * Sending %d status to inventory ...", len(batch))
+        result = self.client.post_json(self.url, batch)
+        logger.info('      * Ok: %s', result)
@@ -3,9 +3,6 @@
 
 import os
 import sys
-import urllib2
-import urllib
-import simplejson as json
 import datetime
 import getopt
 import getpass
@@ -16,16 +13,38 @@ import fnmatch
 import platform
 import locale
 import time
+import bisect
+import re
+import threading
+import itertools
+from multiprocessing.pool import ThreadPool
 from stat import *
 
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
 import logging
 import logging.config
 from logging.handlers import *
 
+from arritranco_client import ArritrancoClient, StatusSender
+
 # Default options
 verbose = False
 nagios = False
 
+# Tasks checked at once (-j), and at most per filesystem (-f)
+JOBS = 1
+JOBS_PER_FILESYSTEM = 2
+
+# Status updates sent to the inventory at once (-b)
+STATUS_BATCH_SIZE = 50
+
 OK = 0
 WARNING = 1
 CRITICAL = 2
@@ -41,7 +60,7 @@ STATE_TO_HUMAN = {
 URLBASE = 'https://inventario.stic.ull.es/rest/backup/backupfilechecker/?checker=xxxx'
 UPDATEURL = 'https://inventario.stic.ull.es/rest/backup/set_integrity_status'
 UPDATE_STATUS_URL = 'https://inventario.stic.ull.es/rest/scheduler/taskstatus/'
-FILE_INFO_URL = 'https://inventario.stic.ull.es/rest/backup/BackupFileInfo'
+FILES_INFO_URL = 'https://inventario.stic.ull.es/rest/backup/backupFilesInfo'
 
 LOGGING = {
     'version': 1,
@@ -80,6 +99,11 @@ LOGGING = {
             'level': 'DEBUG',
             'propagate': True,
         },
+        'arritranco_client': {
+            'handlers': ['log_file'],
+            'level': 'INFO',
+            'propagate': True,
+        },
     },
 }
 
@@ -91,6 +115,7 @@ if sys.stdout.isatty():
         'stream': 'ext://sys.stdout'
     }
     LOGGING['loggers']['__main__']['handlers'].append('console')
+    LOGGING['loggers']['arritranco_client']['handlers'].append('console')
 
 # We might want to use a different one, e.g. importlib
 
@@ -143,6 +168,7 @@ for h in LOGGING['handlers'].keys():
     handlers[h].setFormatter(formatters[LOGGING['handlers'][h]['formatter']])
 for l in LOGGING['loggers'].keys():
     logger = logging.getLogger(l)
+    logger.setLevel(logging._levelNames[LOGGING['loggers'][l]['level']])
     for h in LOGGING['loggers'][l]['handlers']:
         logger.addHandler(handlers[h])
 
@@ -156,11 +182,15 @@ def usage():
     print """
 Usage: check_file_backups.py [options]
 
- -v  Verbose.
- -n  Nagios mode.
- -d  Dry run, do not update arritranco information
- -h  Print this help message
-"""
+ -v       Verbose.
+ -n       Nagios mode.
+ -H fqdn  Check only this host.
+ -j N     Tasks checked at once (%d by default).
+ -f N     Tasks checked at once in the same filesystem (%d by default).
+ -b N     Status updates sent to the inventory at once (%d by default).
+ -d       Dry run, do not update arritranco information
+ -h       Print this help message
+""" % (JOBS, JOBS_PER_FILESYSTEM, STATUS_BATCH_SIZE)
 
 
 def sizeof_fmt(num):
@@ -170,16 +200,129 @@ def sizeof_fmt(num):
         num /= 1024.0
 
 
+GLOB_CHARS_RE = re.compile(r'[*?\[]')
+
+
+class DirectoryIndex(object):
+    """
+        Files of a directory, read once and sorted by lowercase name, so the files
+        starting with a prefix are found with a binary search. Stats are cached.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.entries = {}
+        if scandir is not None:
+            for entry in scandir(directory):
+                self.entries[entry.name] = entry
+        else:
+            for name in os.listdir(directory):
+                self.entries[name] = None
+        self.names = sorted((name.lower(), name) for name in self.entries)
+        self.keys = [key for key, name in self.names]
+        self.stats = {}
+
+    def search(self, pattern):
+        """Names of the files matching a glob pattern, case insensitive."""
+        pattern = pattern.lower()
+        prefix = GLOB_CHARS_RE.split(pattern, 1)[0]
+        names = []
+        i = bisect.bisect_left(self.keys, prefix)
+        while i < len(self.keys) and self.keys[i].startswith(prefix):
+            if fnmatch.fnmatchcase(self.keys[i], pattern):
+                names.append(self.names[i][1])
+            i += 1
+        return names
+
+    def stat(self, name):
+        if name not in self.stats:
+            entry = self.entries.get(name)
+            if entry is not None:
+                self.stats[name] = entry.stat()
+            else:
+                self.stats[name] = os.stat(os.path.join(self.directory, name))
+        return self.stats[name]
+
+    def size(self, name):
+        return self.stat(name)[ST_SIZE]
+
+    def mtime(self, name):
+        return self.stat(name)[ST_MTIME]
+
+
+directory_indexes = {}
+directory_locks = {}
+locks_lock = threading.Lock()
+
+
+def get_directory_index(directory):
+    """Index of a directory, read the first time it is needed in this run."""
+    with locks_lock:
+        lock = directory_locks.setdefault(directory, threading.Lock())
+    with lock:
+        if directory not in directory_indexes:
+            directory_indexes[directory] = DirectoryIndex(directory)
+    return directory_indexes[directory]
+
+
+filesystem_semaphores = {}
+
+
+def filesystem_semaphore(directory):
+    """Semaphore limiting the tasks checked at once in the filesystem of a directory."""
+    try:
+        device = os.stat(directory)[ST_DEV]
+    except OSError:
+        device = None
+    with locks_lock:
+        if device not in filesystem_semaphores:
+            filesystem_semaphores[device] = threading.BoundedSemaphore(JOBS_PER_FILESYSTEM)
+        return filesystem_semaphores[device]
+
+
+class LogBuffer(logging.Filter):
+    """
+        Keeps the records a thread logs while capturing, so the log of the tasks
+        checked at once can be written afterwards in order.
+    """
+
+    def __init__(self):
+        logging.Filter.__init__(self)
+        self.local = threading.local()
+
+    def capture(self):
+        self.local.records = []
+
+    def release(self):
+        records = self.local.records
+        self.local.records = None
+        return records
+
+    def filter(self, record):
+        records = getattr(self.local, 'records', None)
+        if records is None:
+            return True
+        records.append(record)
+        return False
+
+
+log_buffer = LogBuffer()
+logger.addFilter(log_buffer)
+
+
 def parseOpts():
     """
         Parse command line options
     """
-    global verbose, nagios
+    global verbose, nagios, JOBS, JOBS_PER_FILESYSTEM, STATUS_BATCH_SIZE
     fqdn = None
     dryrun = False
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "vnhH:d")
-    except getopt.GetoptError:
+        opts, args = getopt.getopt(sys.argv[1:], "vnhH:j:f:b:d")
+        for o, a in opts:
+            if o in ("-j", "-f", "-b") and int(a) < 1:
+                raise ValueError(a)
+    except (getopt.GetoptError, ValueError):
         # print help information and exit:
         usage()
         sys.exit(1)
@@ -190,6 +333,12 @@ def parseOpts():
             nagios = True
         elif o == "-H":
             fqdn = a
+        elif o == "-j":
+            JOBS = int(a)
+        elif o == "-f":
+            JOBS_PER_FILESYSTEM = int(a)
+        elif o == "-b":
+            STATUS_BATCH_SIZE = int(a)
         elif o == "-d":
             dryrun = True
         elif o == "-h":
@@ -198,6 +347,11 @@ def parseOpts():
     return (fqdn, dryrun)
 
 
+def is_compressed(filename):
+    name, extension = os.path.splitext(filename)
+    return extension in ('.gz', '.zip', '.bz', '.bz2', '.rar')
+
+
 class FileBackupProduct(object):
     def __init__(self, fbp, directory, host, verbose=False):
         self.host = host
@@ -217,90 +371,87 @@ class FileBackupProduct(object):
             filenames.append(self.pattern)
         return [run.strftime(f) for f in filenames]
 
-    def check(self, last_run, previous_run):
-        status = []
+    def get_filenames(self):
         if self.start_seq:
-            for chunk in range(self.start_seq, self.end_seq + 1):
-                filename = str(self.pattern.replace('#', str(chunk)))
-                status.append(self.check_sizes(filename, last_run, previous_run))
-        else:
-            status.append(self.check_sizes(str(self.pattern), last_run, previous_run))
-        return status
+            return [str(self.pattern.replace('#', str(chunk))) for chunk in range(self.start_seq, self.end_seq + 1)]
+        return [str(self.pattern)]
+
+    def search(self, last_run, previous_run):
+        """
+            Searches the files of the last and previous runs, reading their sizes
+            so that checking them does not touch the disk.
+        """
+        self.found = []
+        for filename in self.get_filenames():
+            logger.debug("Last run: %s" % last_run)
+            last_run_files = self.search_file(last_run.strftime(filename), last_run)
+            logger.debug("Previous run: %s" % previous_run)
+            previous_run_files = self.search_file(previous_run.strftime(filename), previous_run)
+            logger.debug("last run files: %s" % last_run_files)
+            logger.debug("previous run files: %s" % previous_run_files)
+            for files in (last_run_files, previous_run_files):
+                if files:
+                    get_directory_index(self.directory).size(files[0])
+            self.found.append((last_run_files, previous_run_files))
+
+    def get_file_info_needed(self):
+        """
+            Previous run files whose original size must be asked to the inventory,
+            as only one of the compared files is compressed.
+        """
+        return [(self.directory, previous_run_files[0]) for last_run_files, previous_run_files in self.found
+                if last_run_files and previous_run_files and
+                is_compressed(last_run_files[0]) != is_compressed(previous_run_files[0])]
+
+    def check(self, last_run, previous_run, files_info):
+        return [self.check_sizes(last_run_files, previous_run_files, last_run, files_info)
+                for last_run_files, previous_run_files in self.found]
 
     def search_file(self, filename, expected_time):
         files = []
         logger.debug("Buscando: %s en %s" % (filename, self.directory))
         try:
-            for f in os.listdir(self.directory):
-                if fnmatch.fnmatch(f.lower(), filename.lower() + '*'):
-                    msg = "  - Encontrado %s" % f
-                    st = os.stat(os.path.join(self.directory, f))
-                    if st[ST_MTIME] >= int(time.mktime(expected_time.timetuple())):
-                        logger.debug("%s (En fecha y hora)" % msg)
-                        files.append(f)
-                    else:
-                        logger.debug("%s (NO en fecha y hora)" % msg)
+            index = get_directory_index(self.directory)
+            for f in index.search(filename + '*'):
+                msg = "  - Encontrado %s" % f
+                if index.mtime(f) >= int(time.mktime(expected_time.timetuple())):
+                    logger.debug("%s (En fecha y hora)" % msg)
+                    files.append(f)
+                else:
+                    logger.debug("%s (NO en fecha y hora)" % msg)
         except OSError, e:
             print e
             return None
         return files
 
-    def check_sizes(self, filename, last_run, previous_run):
-        def _is_compressed(filename):
-            name, extension = os.path.splitext(filename)
-            compressed = extension in ('.gz', '.zip', '.bz', '.bz2', '.rar')
-            logger.debug("Fichero: %s" % filename)
-            logger.debug("Extension: %s" % extension)
-            logger.debug("Comprimido: %s" % compressed)
-            return compressed
-
-        logger.debug("Last run: %s" % last_run)
-        last_run_files = self.search_file(last_run.strftime(filename), last_run)
-        logger.debug("Previous run: %s" % previous_run)
-        previous_run_files = self.search_file(previous_run.strftime(filename), previous_run)
-        logger.debug("last run files: %s" % last_run_files)
-        logger.debug("previous run files: %s" % previous_run_files)
+    def check_sizes(self, last_run_files, previous_run_files, last_run, files_info):
         if not last_run_files:
             return (CRITICAL, 'No hay ultimo backup (%s)' % last_run)
-        elif not previous_run_files:
+        index = get_directory_index(self.directory)
+        if not previous_run_files:
             return (WARNING, "No hay backup anterior con el que comparar la copia del: %s [%s %s]" % (
                 last_run,
                 last_run_files[0],
-                sizeof_fmt(os.path.getsize(os.path.join(self.directory, last_run_files[0]))))
+                sizeof_fmt(index.size(last_run_files[0])))
             )
         else:
             # We need manage the situation where we have more than one file in time.
             prev_file = os.path.join(self.directory, previous_run_files[0])
             last_file = os.path.join(self.directory, last_run_files[0])
-            file_info = None
-            if _is_compressed(last_file) != _is_compressed(prev_file):
-                data = {
-                    'file_name': os.path.basename(prev_file),
-                    'directory': os.path.dirname(prev_file),
-                }
-                file_info_url = FILE_INFO_URL + '?' + urllib.urlencode(data)
-                logger.debug("Descargando informacion del inventario para comparar los tamanyos originales")
-                logger.debug("url: %s", file_info_url)
-                try:
-                    request = urllib2.Request(file_info_url, headers={'Accept': 'application/json'})
-                    res = urllib2.urlopen(request)
-                    file_info = json.load(res)
-                except urllib2.HTTPError, e:
-                    if e.code == 404:
-                        logger.debug("No hay fichero en la base de datos")
-                    else:
-                        print e.read()
-                        raise e
-                except Exception, e:
-                    print e
-                    raise e
+            prev_size = index.size(previous_run_files[0])
+            last_size = index.size(last_run_files[0])
+            logger.debug("Comprimidos: %s %s, %s %s" % (last_file, is_compressed(last_file),
+                                                         prev_file, is_compressed(prev_file)))
+            if is_compressed(last_file) != is_compressed(prev_file):
+                file_info = files_info.get((self.directory, previous_run_files[0]))
                 if file_info is None:
+                    logger.debug("No hay fichero en la base de datos")
                     return (WARNING,
                             "No se pueden comparar los ficheros, uno esta comprimido y el otro no. (last:%s [%s] Vs previous:%s [%s])" % (
                                 last_run_files[0],
-                                sizeof_fmt(os.path.getsize(last_file)),
+                                sizeof_fmt(last_size),
                                 os.path.basename(prev_file),
-                                sizeof_fmt(os.path.getsize(prev_file))
+                                sizeof_fmt(prev_size)
                             )
                     )
                 else:
@@ -310,30 +461,31 @@ class FileBackupProduct(object):
                 size_min = self.variable_percentage / 100 * file_info['original_file_size']
                 size_max = (1 + self.variable_percentage / 100) * file_info['original_file_size']
             else:
-                size_min = self.variable_percentage / 100 * os.path.getsize(prev_file)
-                size_max = (1 + self.variable_percentage / 100) * os.path.getsize(prev_file)
+                file_info = None
+                size_min = self.variable_percentage / 100 * prev_size
+                size_max = (1 + self.variable_percentage / 100) * prev_size
             if file_info is None:
                 logger.debug("Comparando los siguientes ficheros con el umbral %s%%" % self.variable_percentage)
-                logger.debug("   - ultimo %s (%s)" % (last_run_files[0], sizeof_fmt(os.path.getsize(last_file))))
-                logger.debug("   - anterior %s (%s)" % (previous_run_files[0], sizeof_fmt(os.path.getsize(prev_file))))
+                logger.debug("   - ultimo %s (%s)" % (last_run_files[0], sizeof_fmt(last_size)))
+                logger.debug("   - anterior %s (%s)" % (previous_run_files[0], sizeof_fmt(prev_size)))
             else:
                 logger.debug("Comparando los siguientes ficheros con el umbral %s%%" % self.variable_percentage)
-                logger.debug("   - ultimo %s (%s)" % (last_run_files[0], sizeof_fmt(os.path.getsize(last_file))))
+                logger.debug("   - ultimo %s (%s)" % (last_run_files[0], sizeof_fmt(last_size)))
                 logger.debug("   - anterior segun el inventario %s (%s)" % (
                     file_info['original_file_name'], sizeof_fmt(file_info['original_file_size'])))
             logger.debug("  Minimum aceptable size: %s" % size_min)
             logger.debug("  Maximum aceptable size: %s" % size_max)
-            logger.debug("  Last backup size: %s" % os.path.getsize(last_file))
-            if (os.path.getsize(last_file) >= size_min) and (os.path.getsize(last_file) <= size_max):
+            logger.debug("  Last backup size: %s" % last_size)
+            if (last_size >= size_min) and (last_size <= size_max):
                 logger.debug("  - OK")
-                return (OK, "%s (%s)" % (last_run_files[0], sizeof_fmt(os.path.getsize(last_file))))
+                return (OK, "%s (%s)" % (last_run_files[0], sizeof_fmt(last_size)))
             logger.debug("  - WARNING")
             return (WARNING, "Error: Los ficheros difieren mas de un %d%% (%s [%s] Vs %s [%s])" % (
                 self.variable_percentage,
                 last_run_files[0],
-                sizeof_fmt(os.path.getsize(last_file)),
+                sizeof_fmt(last_size),
                 previous_run_files[0],
-                sizeof_fmt(os.path.getsize(prev_file))
+                sizeof_fmt(prev_size)
             ))
 
 
@@ -350,12 +502,26 @@ class FileBackup(object):
         for fbp in backup['files']:
             self.products.append(FileBackupProduct(fbp, backup['directory'], self.host, verbose))
 
-    def check_products(self):
+    def search(self):
+        for fbp in self.products:
+            fbp.search(self.last_run, self.previous_run)
+
+    def get_file_info_needed(self):
+        files = []
+        for fbp in self.products:
+            files += fbp.get_file_info_needed()
+        return files
+
+    def check_products(self, files_info):
+        """
+            Checks the files found by search, files_info has the inventory info
+            of the files in get_file_info_needed.
+        """
         status = []
         global_status = OK
         msg = ''
         for fbp in self.products:
-            status += fbp.check(self.last_run, self.previous_run)
+            status += fbp.check(self.last_run, self.previous_run, files_info)
         for s in status:
             if s[0] == CRITICAL:
                 global_status = s[0]
@@ -372,6 +538,37 @@ class FileBackup(object):
         return filepaths
 
 
+def search_task(fbp):
+    """
+        Searches the files of a task, at most JOBS_PER_FILESYSTEM at once in its
+        filesystem. Returns the files to look up in the inventory and the records
+        it logged.
+    """
+    log_buffer.capture()
+    try:
+        logger.info(" - Task %s", fbp.description)
+        with filesystem_semaphore(fbp.directory):
+            fbp.search()
+        needed = fbp.get_file_info_needed()
+    finally:
+        records = log_buffer.release()
+    return needed, records
+
+
+def send_status(sender, data=None):
+    """
+        Queues the status of a task, or sends the queued ones without data
+    """
+    try:
+        if data is None:
+            sender.flush()
+        else:
+            sender.add(data)
+    except Exception, e:
+        logger.critical('Error sending status to inventory: %s', e)
+        raise e
+
+
 if __name__ == "__main__":
     fqdn, dryrun = parseOpts()
 
@@ -379,48 +576,65 @@ if __name__ == "__main__":
     if verbose:
         logger.setLevel(logging.DEBUG)
 
+    client = ArritrancoClient()
+    sender = StatusSender(client, UPDATE_STATUS_URL, STATUS_BATCH_SIZE)
     try:
-        request = urllib2.Request(URLBASE, None, {'Accept': 'application/json'})
-        res = urllib2.urlopen(request)
+        filesToCheck = client.get_json(URLBASE)
     except Exception, e:
         print e
         raise e
 
-    filesToCheck = json.load(res)
+    tasks = []
     for host in filesToCheck.keys():
         if fqdn is not None and host != fqdn:
             continue
-        logger.debug("---------------- Host: %s ---------------" % host)
-        logger.debug("%s" % filesToCheck[host])
-        logger.info("Checking host %s", host)
         for bckp in filesToCheck[host]:
-            fbp = FileBackup(bckp, host, verbose)
-            logger.info(" - Task %s", fbp.description)
-            out = fbp.check_products()
-            data = {
-                'task': fbp.id,
-                'task_time': fbp.last_run,
-                'status': STATE_TO_HUMAN[out[0]],
-                'comment': out[1]
-            }
-            logger.info("   * Status information: %s (%s)", data['status'], data['comment'].replace('\n', ''))
-            if not dryrun:
-                try:
-                    logger.info("    * Sending status to inventory ...")
-                    request = urllib2.Request(UPDATE_STATUS_URL, urllib.urlencode(data), {'Accept': 'application/json'})
-                    res = urllib2.urlopen(request)
-                except Exception, e:
-                    logger.critical('Error sending status to inventory: %s', e)
-                    raise e
-
-                logger.info('      * Ok: %s', res.read())
-            elif verbose:
-                if data['task_time'] > datetime.datetime.now():
-                    logger.debug("ERROR!!!!!!: task_time cant be in the future")
-                    sys.exit(0)
-                logger.debug(u"notify inventory: %s" % data)
-            if nagios:
-                print "%s\t%s\t%s\t%s" % (host, fbp.description, out[0], out[1])
-            elif (verbose or (out[0] != OK)):
-                logger.debug("%s %s: %s %s" % (host, fbp.description, STATE_TO_HUMAN[out[0]], out[1]))
+            tasks.append(FileBackup(bckp, host, verbose))
+
+    # The disk is read in the pool, the inventory asked and the files compared here
+    pool = None
+    if JOBS > 1:
+        pool = ThreadPool(JOBS)
+        results = pool.imap(search_task, tasks)
+    else:
+        results = itertools.imap(search_task, tasks)
 
+    # Results come in the order of the tasks, so the log of each host is written together
+    try:
+        for host, host_tasks in itertools.groupby(itertools.izip(tasks, results), lambda task: task[0].host):
+            host_tasks = list(host_tasks)
+            logger.debug("---------------- Host: %s ---------------" % host)
+            logger.debug("%s" % filesToCheck[host])
+            logger.info("Checking host %s", host)
+            needed = set()
+            for fbp, (files, records) in host_tasks:
+                needed.update(files)
+            if needed:
+                logger.debug("Descargando informacion del inventario para comparar los tamanyos originales")
+            files_info = client.file_info(FILES_INFO_URL, needed)
+            for fbp, (files, records) in host_tasks:
+                for record in records:
+                    logger.handle(record)
+                out = fbp.check_products(files_info)
+                data = {
+                    'task': fbp.id,
+                    'task_time': fbp.last_run.strftime('%Y-%m-%d %H:%M:%S'),
+                    'status': STATE_TO_HUMAN[out[0]],
+                    'comment': out[1]
+                }
+                logger.info("   * Status information: %s (%s)", data['status'], data['comment'].replace('\n', ''))
+                if not dryrun:
+                    send_status(sender, data)
+                elif verbose:
+                    if fbp.last_run > datetime.datetime.now():
+                        logger.debug("ERROR!!!!!!: task_time cant be in the future")
+                        sys.exit(0)
+                    logger.debug(u"notify inventory: %s" % data)
+                if nagios:
+                    print "%s\t%s\t%s\t%s" % (host, fbp.description, out[0], out[1])
+                elif (verbose or (out[0] != OK)):
+                    logger.debug("%s %s: %s %s" % (host, fbp.description, STATE_TO_HUMAN[out[0]], out[1]))
+        send_status(sender)
+    finally:
+        if pool is not None:
+            pool.terminate()
@@ -0,0 +1,359 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Compresses the backup files of this checker.
+
+Claims the files to compress from the inventory (so several runs never compress
+the same file), compresses them in a pool of processes and reports the
+compressed files back in batches. The MD5 hashes of the original and the
+compressed file are computed while compressing, reading each file only once.
+
+Originals are only removed once the inventory has acknowledged their compressed
+file. Batches that could not be reported are saved and sent again on the next run.
+"""
+
+import bz2
+import datetime
+import getopt
+import gzip
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import sys
+import time
+from logging.handlers import RotatingFileHandler
+
+from arritranco_client import ArritrancoClient, ArritrancoError
+
+CLAIM_URL = 'https://inventario.stic.ull.es/rest/backup/filesToCompress/claim'
+COMPRESSED_FILES_URL = 'https://inventario.stic.ull.es/rest/backup/addCompressedBackupFiles'
+
+LOG_FILE = '/var/log/compress_backups.log'
+
+# Compressed files not reported to the inventory yet
+UNSENT_FILE = '/var/lib/arritranco/compress_backups.unsent'
+
+# Bytes read and compressed at once
+CHUNK_SIZE = 2 ** 20
+
+COMPRESSORS = ('bz2', 'gzip')
+
+logger = logging.getLogger(__name__)
+
+client = ArritrancoClient()
+
+
+def usage():
+    """
+        Prints help
+    """
+    print """
+Usage: compress_backups.py [options]
+
+ -c checker  Checker fqdn (the address of this machine by default).
+ -j N        Number of compressing processes (one per CPU by default).
+ -b GB       GB of original files to compress in this run (the inventory default if not set).
+ -l N        Maximum number of files to compress in this run.
+ -n N        Compressed files reported to the inventory at once (20 by default).
+ -z name     Compressor: bz2 (default) or gzip.
+ -k          Keep the original files.
+ -u file     Compressed files not reported yet (%s by default).
+ -d          Dry run, do not compress nor update arritranco information
+ -v          Verbose.
+ -h          Print this help message
+""" % UNSENT_FILE
+
+
+def parseOpts():
+    """
+        Parse command line options
+    """
+    options = {
+        'checker': None,
+        'processes': multiprocessing.cpu_count(),
+        'budget_gb': None,
+        'limit': None,
+        'batch_size': 20,
+        'compressor': 'bz2',
+        'keep': False,
+        'unsent': UNSENT_FILE,
+        'dryrun': False,
+        'verbose': False,
+    }
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "c:j:b:l:n:z:ku:dvh")
+        for o, a in opts:
+            if o == "-c":
+                options['checker'] = a
+            elif o == "-j":
+                options['processes'] = int(a)
+            elif o == "-b":
+                options['budget_gb'] = float(a)
+            elif o == "-l":
+                options['limit'] = int(a)
+            elif o == "-n":
+                options['batch_size'] = int(a)
+            elif o == "-z":
+                if a not in COMPRESSORS:
+                    raise ValueError(a)
+                options['compressor'] = a
+            elif o == "-k":
+                options['keep'] = True
+            elif o == "-u":
+                options['unsent'] = a
+            elif o == "-d":
+                options['dryrun'] = True
+            elif o == "-v":
+                options['verbose'] = True
+            elif o == "-h":
+                usage()
+                sys.exit(0)
+    except (getopt.GetoptError, ValueError):
+        # print help information and exit:
+        usage()
+        sys.exit(1)
+    return options
+
+
+def sizeof_fmt(num):
+    for x in ['bytes', 'KB', 'MB', 'GB', 'TB']:
+        if num < 1024.0:
+            return "%3.1f%s" % (num, x)
+        num /= 1024.0
+
+
+def setup_logging(verbose):
+    formatter = logging.Formatter('%(asctime)s compress_backups[%(levelname)s] %(processName)s %(message)s')
+    handlers = []
+    try:
+        handlers.append(RotatingFileHandler(LOG_FILE, maxBytes=2 ** 20, backupCount=50))
+    except IOError:
+        pass
+    if sys.stdout.isatty() or not handlers:
+        handlers.append(logging.StreamHandler(sys.stdout))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    for log in (logger, logging.getLogger('arritranco_client')):
+        for handler in handlers:
+            log.addHandler(handler)
+        log.setLevel(logging.DEBUG if verbose else logging.INFO)
+
+
+class HashingWriter(object):
+    """File object writing to another one and computing the MD5 of what is written."""
+
+    def __init__(self, f):
+        self.f = f
+        self.md5 = hashlib.md5()
+        self.size = 0
+
+    def write(self, data):
+        self.md5.update(data)
+        self.size += len(data)
+        self.f.write(data)
+
+    def flush(self):
+        self.f.flush()
+
+
+def compress_file(path, compressor='bz2', keep=True):
+    """Compresses path next to it, with the extension of the compressor.
+
+    Returns a dict with the name, size and MD5 of the compressed file and the MD5
+    of the original one, computed in the same read. The original is removed unless
+    keep is set. A partial compressed file is removed on errors.
+    """
+    extension = '.bz2' if compressor == 'bz2' else '.gz'
+    compressed_path = path + extension
+    tmp_path = compressed_path + '.tmp'
+    original_md5 = hashlib.md5()
+    try:
+        with open(path, 'rb') as original:
+            with open(tmp_path, 'wb') as out:
+                writer = HashingWriter(out)
+                if compressor == 'bz2':
+                    c = bz2.BZ2Compressor(9)
+                    for chunk in iter(lambda: original.read(CHUNK_SIZE), ''):
+                        original_md5.update(chunk)
+                        writer.write(c.compress(chunk))
+                    writer.write(c.flush())
+                else:
+                    gz = gzip.GzipFile(os.path.basename(path), 'wb', 9, writer, os.path.getmtime(path))
+                    for chunk in iter(lambda: original.read(CHUNK_SIZE), ''):
+                        original_md5.update(chunk)
+                        gz.write(chunk)
+                    gz.close()
+                out.flush()
+                os.fsync(out.fileno())
+        os.rename(tmp_path, compressed_path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if not keep:
+        os.remove(path)
+    return {
+        'compressedfilename': os.path.basename(compressed_path),
+        'filedate': time.time(),
+        'filesize': writer.size,
+        'compressedmd5': writer.md5.hexdigest(),
+        'originalmd5': original_md5.hexdigest(),
+    }
+
+
+def _compress(args):
+    """Pool worker: (backup file, compressor) -> (backup file, result or None, error or None).
+
+    The original is kept, it is removed once the inventory knows the compressed file.
+    """
+    backup_file, compressor = args
+    start = time.time()
+    try:
+        result = compress_file(backup_file['path'], compressor)
+    except (IOError, OSError), e:
+        return backup_file, None, str(e)
+    result['id'] = backup_file['id']
+    result['seconds'] = time.time() - start
+    return backup_file, result, None
+
+
+def load_unsent(path):
+    """[path of the original, compressed file] not reported by previous runs."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except IOError:
+        return []
+    except ValueError, e:
+        logger.error("Can not read the unsent compressed files of %s: %s", path, e)
+        return []
+
+
+def save_unsent(path, unsent):
+    if not unsent:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(unsent, f)
+    os.rename(path + '.tmp', path)
+
+
+class Reporter(object):
+    """Sends the compressed files to the inventory in batches, removing the originals acknowledged."""
+
+    def __init__(self, options):
+        self.options = options
+        self.batch = []
+        self.unsent = []
+        self.reported = 0
+
+    def add(self, original, result):
+        self.batch.append((original, result))
+        if len(self.batch) >= self.options['batch_size']:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, []
+        logger.debug("notify inventory: %s", [result for original, result in batch])
+        try:
+            statuses = dict(client.post_json(COMPRESSED_FILES_URL, [result for original, result in batch]))
+        except ArritrancoError, e:
+            if e.status < 500:
+                # Would be refused again, the files are claimed and compressed again later
+                logger.critical('The inventory refused %d compressed files: %s', len(batch), e)
+                return
+            logger.critical('Error sending compressed files to inventory: %s', e)
+            self.unsent.extend(batch)
+            return
+        except Exception, e:
+            logger.critical('Error sending compressed files to inventory: %s', e)
+            self.unsent.extend(batch)
+            return
+        for original, result in batch:
+            if not statuses.get(result['id']):
+                logger.error('The inventory does not know backup file %s', result['id'])
+                continue
+            self.reported += 1
+            if not self.options['keep']:
+                try:
+                    os.remove(original)
+                except OSError, e:
+                    logger.error("Can not remove %s: %s", original, e)
+
+
+def claim(options):
+    """Files to compress leased to this run."""
+    params = {'worker': '%s:%d' % (socket.getfqdn(), os.getpid())}
+    if options['checker']:
+        params['checker'] = options['checker']
+    if options['budget_gb'] is not None:
+        params['budget_gb'] = options['budget_gb']
+    if options['limit'] is not None:
+        params['limit'] = options['limit']
+    if options['dryrun']:
+        # Listing does not lease the files
+        return client.get_json(CLAIM_URL.rsplit('/', 1)[0], params)
+    return client.post_json(CLAIM_URL, {}, params)
+
+
+def main():
+    options = parseOpts()
+    setup_logging(options['verbose'])
+    reporter = Reporter(options)
+    if not options['dryrun']:
+        # Before claiming, so the files already compressed are not claimed again
+        unsent = load_unsent(options['unsent'])
+        if unsent:
+            logger.info("Sending %d compressed files of previous runs", len(unsent))
+            for original, result in unsent:
+                reporter.add(original, result)
+            reporter.flush()
+            save_unsent(options['unsent'], reporter.unsent)
+    files = claim(options)
+    logger.info("%d files to compress (%s) with %d processes", len(files),
+                sizeof_fmt(sum(os.path.getsize(f['path']) for f in files if os.path.exists(f['path']))),
+                options['processes'])
+    if options['dryrun']:
+        for f in files:
+            logger.info(" - %s", f['path'])
+        return 0
+
+    start = datetime.datetime.now()
+    errors = 0
+    pool = multiprocessing.Pool(options['processes'])
+    try:
+        for backup_file, result, error in pool.imap_unordered(
+                _compress, [(f, options['compressor']) for f in files]):
+            if error is not None:
+                errors += 1
+                logger.error("Error compressing %s: %s", backup_file['path'], error)
+                continue
+            logger.info(" - %s compressed in %.1fs (%s)", backup_file['path'], result.pop('seconds'),
+                        sizeof_fmt(result['filesize']))
+            reporter.add(backup_file['path'], result)
+        reporter.flush()
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        save_unsent(options['unsent'], reporter.unsent + reporter.batch)
+    if reporter.unsent:
+        logger.error("%d compressed files not reported, saved in %s", len(reporter.unsent), options['unsent'])
+    logger.info("%d files compressed, %d reported, %d errors in %s", len(files) - errors, reporter.reported, errors,
+                datetime.datetime.now() - start)
+    return 1 if errors or reporter.unsent else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
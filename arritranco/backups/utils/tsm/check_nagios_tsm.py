@@ -4,14 +4,16 @@
 import datetime
 import getpass
 import locale
-import urllib2
-import urllib
-import simplejson as json
 import getopt
+import os
 import socket
+import sys
 
 from tsmclient import *
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from arritranco_client import ArritrancoClient
+
 URLBASE = 'https://inventario.stic.ull.es/rest/backup/tsm/hosts/'
 
 # Default options
@@ -244,20 +246,18 @@ if __name__ == "__main__":
         sys.exit(0)
 
     try:
-        hosts_url = URLBASE + '?' + urllib.urlencode({'tsm_server': tivoli_server})
-        request = urllib2.Request(hosts_url, None, {'Accept': 'application/json'})
-        res = urllib2.urlopen(request)
+        maquinas = ArritrancoClient().get_json(URLBASE, {'tsm_server': tivoli_server})
     except Exception, e:
         print e
         raise e
 
     if nagios:
-        chequea_inventario(json.load(res), fecha_anterior)
+        chequea_inventario(maquinas, fecha_anterior)
         sys.exit(0)
 
     if verbose:
         print " ----------------- Escaneando nodos del inventario ------------------------------"
-    nodos_inventario = chequea_inventario(json.load(res), fecha_anterior)
+    nodos_inventario = chequea_inventario(maquinas, fecha_anterior)
     if verbose:
         print " ----------------- Escaneando nodos del tsm ------------------------------"
     nodos_TSM = chequea_tsm(fecha_anterior, nodos_inventario)
@@ -0,0 +1,309 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Verifies the integrity of the backup files of this checker.
+
+Gets from the inventory the files with a known MD5, hashes them in a pool of
+processes (memory mapped, in big chunks) and reports the MD5 computed back in
+batches, so the inventory marks them as verified or wrong.
+
+The MD5 of every file is kept in a local SQLite file, with its
+inode, size and modification time: files not changed since the last run are not
+read again, so a nightly run only hashes the new files.
+
+Files removed meanwhile (compress_backups replaces them by their compressed
+file) are skipped, and the path hashed is reported with every MD5, so the
+inventory ignores the ones of files compressed before the report arrives.
+"""
+
+import datetime
+import errno
+import getopt
+import hashlib
+import logging
+import mmap
+import multiprocessing
+import os
+import sqlite3
+import sys
+import time
+from logging.handlers import RotatingFileHandler
+
+from arritranco_client import ArritrancoClient
+
+FILES_TO_VERIFY_URL = 'https://inventario.stic.ull.es/rest/backup/filesToVerify'
+SET_INTEGRITY_URL = 'https://inventario.stic.ull.es/rest/backup/set_integrity_status'
+
+LOG_FILE = '/var/log/verify_backups.log'
+
+HASH_CACHE = '/var/lib/arritranco/verify_backups.sqlite'
+
+# Hashes of files not seen in this many days are removed from the cache
+HASH_CACHE_DAYS = 30
+
+# Bytes hashed at once
+CHUNK_SIZE = 16 * 2 ** 20
+
+logger = logging.getLogger(__name__)
+
+client = ArritrancoClient()
+
+
+def usage():
+    """
+        Prints help
+    """
+    print """
+Usage: verify_backups.py [options]
+
+ -c checker  Checker fqdn (the address of this machine by default).
+ -j N        Number of hashing processes (one per CPU by default).
+ -s file     Hash cache (%s by default).
+ -u          Only the files never verified.
+ -n N        Results reported to the inventory at once (500 by default).
+ -d          Dry run, do not update arritranco information
+ -v          Verbose.
+ -h          Print this help message
+""" % HASH_CACHE
+
+
+def parseOpts():
+    """
+        Parse command line options
+    """
+    options = {
+        'checker': None,
+        'processes': multiprocessing.cpu_count(),
+        'cache': HASH_CACHE,
+        'unchecked': False,
+        'batch_size': 500,
+        'dryrun': False,
+        'verbose': False,
+    }
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "c:j:s:un:dvh")
+        for o, a in opts:
+            if o == "-c":
+                options['checker'] = a
+            elif o == "-j":
+                options['processes'] = int(a)
+            elif o == "-s":
+                options['cache'] = a
+            elif o == "-u":
+                options['unchecked'] = True
+            elif o == "-n":
+                options['batch_size'] = int(a)
+            elif o == "-d":
+                options['dryrun'] = True
+            elif o == "-v":
+                options['verbose'] = True
+            elif o == "-h":
+                usage()
+                sys.exit(0)
+    except (getopt.GetoptError, ValueError):
+        # print help information and exit:
+        usage()
+        sys.exit(1)
+    return options
+
+
+def sizeof_fmt(num):
+    for x in ['bytes', 'KB', 'MB', 'GB', 'TB']:
+        if num < 1024.0:
+            return "%3.1f%s" % (num, x)
+        num /= 1024.0
+
+
+def setup_logging(verbose):
+    formatter = logging.Formatter('%(asctime)s verify_backups[%(levelname)s] %(processName)s %(message)s')
+    handlers = []
+    try:
+        handlers.append(RotatingFileHandler(LOG_FILE, maxBytes=2 ** 20, backupCount=50))
+    except IOError:
+        pass
+    if sys.stdout.isatty() or not handlers:
+        handlers.append(logging.StreamHandler(sys.stdout))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    for log in (logger, logging.getLogger('arritranco_client')):
+        for handler in handlers:
+            log.addHandler(handler)
+        log.setLevel(logging.DEBUG if verbose else logging.INFO)
+
+
+class HashCache(object):
+    """MD5 of files by path, valid while their inode, size and modification time do not change."""
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS hashes (path TEXT PRIMARY KEY, inode INTEGER, size INTEGER, "
+                        "mtime REAL, md5 TEXT, seen REAL)")
+        self.now = time.time()
+
+    def get(self, path, st):
+        row = self.db.execute("SELECT md5 FROM hashes WHERE path = ? AND inode = ? AND size = ? AND mtime = ?",
+                              (path, st.st_ino, st.st_size, st.st_mtime)).fetchone()
+        if row is None:
+            return None
+        self.db.execute("UPDATE hashes SET seen = ? WHERE path = ?", (self.now, path))
+        return row[0]
+
+    def set(self, path, st, md5):
+        self.db.execute("INSERT OR REPLACE INTO hashes (path, inode, size, mtime, md5, seen) VALUES (?, ?, ?, ?, ?, ?)",
+                        (path, st.st_ino, st.st_size, st.st_mtime, md5, self.now))
+
+    def close(self):
+        """Removes the hashes of the files not seen for HASH_CACHE_DAYS and saves the cache."""
+        self.db.execute("DELETE FROM hashes WHERE seen < ?", (self.now - HASH_CACHE_DAYS * 24 * 3600,))
+        self.db.commit()
+        self.db.close()
+
+
+def hash_file(path):
+    """MD5 of a file, memory mapped when possible."""
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):
+            # Empty files and filesystems without mmap
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), ''):
+                md5.update(chunk)
+        else:
+            try:
+                for offset in xrange(0, len(data), CHUNK_SIZE):
+                    md5.update(buffer(data, offset, CHUNK_SIZE))
+            finally:
+                data.close()
+    return md5.hexdigest()
+
+
+def _hash(backup_file):
+    """Pool worker: backup file -> (backup file, MD5 or None, (errno, error) or None, seconds)."""
+    start = time.time()
+    try:
+        md5 = hash_file(backup_file['path'])
+    except (IOError, OSError), e:
+        return backup_file, None, (e.errno, str(e)), time.time() - start
+    return backup_file, md5, None, time.time() - start
+
+
+class Reporter(object):
+    """Sends the MD5 of the files to the inventory in batches, counting the wrong ones."""
+
+    def __init__(self, options):
+        self.options = options
+        self.batch = []
+        self.verified = 0
+        self.wrong = 0
+
+    def add(self, backup_file, md5):
+        if md5 is not None and md5 != backup_file['md5'].lower():
+            logger.error("MD5 mismatch in %s: %s, expected %s", backup_file['path'], md5, backup_file['md5'])
+        self.batch.append({'id': backup_file['pk'], 'md5': md5 or '', 'path': backup_file['path']})
+        if len(self.batch) >= self.options['batch_size']:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, []
+        if self.options['dryrun']:
+            logger.debug("notify inventory: %s", batch)
+            return
+        params = {'checker': self.options['checker']} if self.options['checker'] else None
+        try:
+            for backup_file_id, checked in client.post_json(SET_INTEGRITY_URL, batch, params):
+                if checked is None:
+                    logger.warning('The inventory does not know backup file %s or it changed meanwhile',
+                                   backup_file_id)
+                elif checked:
+                    self.verified += 1
+                else:
+                    self.wrong += 1
+        except Exception, e:
+            logger.critical('Error sending integrity to inventory: %s', e)
+            raise
+
+
+def main():
+    options = parseOpts()
+    setup_logging(options['verbose'])
+    params = {}
+    if options['checker']:
+        params['checker'] = options['checker']
+    if options['unchecked']:
+        params['unchecked'] = 1
+    start = datetime.datetime.now()
+    # Started before opening the cache, so the processes do not inherit its connection
+    pool = multiprocessing.Pool(options['processes'])
+    try:
+        cache = HashCache(options['cache'])
+    except:
+        pool.terminate()
+        raise
+    reporter = Reporter(options)
+    to_hash = []
+    cached = 0
+    gone = 0
+    for backup_file in client.get_pages(FILES_TO_VERIFY_URL, params):
+        try:
+            st = os.stat(backup_file['path'])
+        except OSError, e:
+            if e.errno == errno.ENOENT:
+                # Compressed or deleted since listed, not a corrupted file
+                logger.debug("%s is gone", backup_file['path'])
+                gone += 1
+                continue
+            logger.error("Can not read %s: %s", backup_file['path'], e)
+            reporter.add(backup_file, None)
+            continue
+        if backup_file['size'] is not None and st.st_size != int(backup_file['size']):
+            # Can not be the same file, no need to read it
+            logger.error("Size mismatch in %s: %d, expected %d", backup_file['path'], st.st_size, backup_file['size'])
+            reporter.add(backup_file, None)
+            continue
+        md5 = cache.get(backup_file['path'], st)
+        if md5 is not None:
+            cached += 1
+            reporter.add(backup_file, md5)
+        else:
+            to_hash.append((backup_file, st))
+    # Biggest files first, so no process is left hashing a big one at the end
+    to_hash.sort(key=lambda f: -f[1].st_size)
+    stats = dict((backup_file['pk'], st) for backup_file, st in to_hash)
+    logger.info("%d files unchanged, %d files to hash (%s) with %d processes", cached, len(to_hash),
+                sizeof_fmt(sum(st.st_size for backup_file, st in to_hash)), options['processes'])
+
+    errors = 0
+    try:
+        for backup_file, md5, error, seconds in pool.imap_unordered(_hash, [f for f, st in to_hash]):
+            if error is not None and error[0] == errno.ENOENT:
+                logger.debug("%s is gone", backup_file['path'])
+                gone += 1
+                continue
+            if error is not None:
+                errors += 1
+                logger.error("Error hashing %s: %s", backup_file['path'], error[1])
+            else:
+                logger.debug(" - %s hashed in %.1fs", backup_file['path'], seconds)
+                cache.set(backup_file['path'], stats[backup_file['pk']], md5)
+            reporter.add(backup_file, md5)
+        reporter.flush()
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        cache.close()
+    logger.info("%d files verified, %d wrong, %d errors, %d gone in %s", reporter.verified, reporter.wrong, errors,
+                gone, datetime.datetime.now() - start)
+    return 1 if reporter.wrong or errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
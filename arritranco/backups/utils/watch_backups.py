@@ -0,0 +1,398 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Registers the backup files of this checker as soon as they are written.
+
+Watches the backup directories of the checker with inotify. When a file is
+closed after being written (or moved into a directory) and it is not written
+again for a few seconds, its name is matched with the file name patterns of the
+machines backed up in the directory and it is registered in the inventory, in
+batches, with addBackupFiles. Directories are only scanned when the kernel
+event queue overflows (or with -r at start), as events could have been lost.
+
+The files written by compress_backups match the patterns of their originals
+(patterns match name prefixes), so the ones being written and the ones whose
+original is still there are skipped; the inventory refuses the rest.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import getopt
+import logging
+import os
+import re
+import select
+import signal
+import struct
+import sys
+import time
+from logging.handlers import RotatingFileHandler
+
+from arritranco_client import ArritrancoClient, ArritrancoError
+
+WATCHED_DIRECTORIES_URL = 'https://inventario.stic.ull.es/rest/backup/watchedDirectories'
+ADD_BACKUP_FILES_URL = 'https://inventario.stic.ull.es/rest/backup/addBackupFiles'
+
+LOG_FILE = '/var/log/watch_backups.log'
+
+# From linux/inotify.h
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 02000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+# struct inotify_event: wd, mask, cookie and length of the name that follows
+EVENT_HEADER = struct.Struct('iIII')
+
+# Extensions compress_backups adds to the files it compresses, and to the ones being written
+COMPRESSED_EXTENSIONS = ('.bz2', '.gz')
+TEMPORARY_EXTENSION = '.tmp'
+
+# Seconds to wait before watching again the configuration when it can not be read
+CONFIGURATION_RETRY = 60
+
+logger = logging.getLogger(__name__)
+
+client = ArritrancoClient()
+
+
+def usage():
+    """
+        Prints help
+    """
+    print """
+Usage: watch_backups.py [options]
+
+ -c checker  Checker fqdn (the address of this machine by default).
+ -t seconds  Seconds a file must not be written to be registered (5 by default).
+ -n N        Files registered at once (100 by default).
+ -f seconds  Seconds between registrations of the files found (2 by default).
+ -R seconds  Seconds between refreshes of the directories to watch (600 by default).
+ -r          Scan the directories at start, for the files written while not running.
+ -d          Dry run, do not update arritranco information
+ -v          Verbose.
+ -h          Print this help message
+"""
+
+
+def parseOpts():
+    """
+        Parse command line options
+    """
+    options = {
+        'checker': None,
+        'debounce': 5.0,
+        'batch_size': 100,
+        'flush_interval': 2.0,
+        'refresh': 600.0,
+        'scan': False,
+        'dryrun': False,
+        'verbose': False,
+    }
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "c:t:n:f:R:rdvh")
+        for o, a in opts:
+            if o == "-c":
+                options['checker'] = a
+            elif o == "-t":
+                options['debounce'] = float(a)
+            elif o == "-n":
+                options['batch_size'] = int(a)
+            elif o == "-f":
+                options['flush_interval'] = float(a)
+            elif o == "-R":
+                options['refresh'] = float(a)
+            elif o == "-r":
+                options['scan'] = True
+            elif o == "-d":
+                options['dryrun'] = True
+            elif o == "-v":
+                options['verbose'] = True
+            elif o == "-h":
+                usage()
+                sys.exit(0)
+    except (getopt.GetoptError, ValueError):
+        # print help information and exit:
+        usage()
+        sys.exit(1)
+    return options
+
+
+def setup_logging(verbose):
+    formatter = logging.Formatter('%(asctime)s watch_backups[%(levelname)s] %(message)s')
+    handlers = []
+    try:
+        handlers.append(RotatingFileHandler(LOG_FILE, maxBytes=2 ** 20, backupCount=50))
+    except IOError:
+        pass
+    if sys.stdout.isatty() or not handlers:
+        handlers.append(logging.StreamHandler(sys.stdout))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    for log in (logger, logging.getLogger('arritranco_client')):
+        for handler in handlers:
+            log.addHandler(handler)
+        log.setLevel(logging.DEBUG if verbose else logging.INFO)
+
+
+class Inotify(object):
+    """The inotify calls of the C library."""
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            self._error()
+
+    def _error(self, path=None):
+        e = ctypes.get_errno()
+        raise OSError(e, os.strerror(e), path)
+
+    def add_watch(self, path, mask):
+        wd = self.libc.inotify_add_watch(self.fd, path, mask)
+        if wd < 0:
+            self._error(path)
+        return wd
+
+    def rm_watch(self, wd):
+        # Fails when the kernel already removed it, nothing to do then
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self, timeout):
+        """(watch descriptor, mask, name) of the events arriving in timeout seconds."""
+        try:
+            if not select.select([self.fd], [], [], timeout)[0]:
+                return []
+            data = os.read(self.fd, 64 * 1024)
+        except (select.error, OSError), e:
+            if e.args[0] in (errno.EINTR, errno.EAGAIN):
+                return []
+            raise
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            events.append((wd, mask, data[offset:offset + length].rstrip('\0')))
+            offset += length
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Watcher(object):
+    """Watches the backup directories and registers the files written in them."""
+
+    def __init__(self, options):
+        self.options = options
+        self.inotify = Inotify()
+        # directory -> [(host, compiled patterns)]
+        self.directories = {}
+        # watch descriptor -> directory
+        self.watches = {}
+        # path -> time to check the file again
+        self.pending = {}
+        self.queue = []
+        self.last_flush = time.time()
+        self.stopping = False
+
+    def configure(self, watched):
+        """Watches the directories of the inventory configuration, and only them."""
+        directories = {}
+        for item in watched:
+            hosts = []
+            for host in item['hosts']:
+                patterns = []
+                for pattern in host['patterns']:
+                    try:
+                        patterns.append(re.compile(pattern))
+                    except re.error, e:
+                        logger.error('Bad file name pattern %s for %s: %s', pattern, host['host'], e)
+                hosts.append((host['host'], patterns))
+            # Byte strings, as the names of the events
+            directories[item['directory'].encode(sys.getfilesystemencoding() or 'utf-8')] = hosts
+        for wd, directory in self.watches.items():
+            if directory not in directories:
+                logger.info("Not watching %s anymore", directory)
+                self.inotify.rm_watch(wd)
+                del self.watches[wd]
+        watching = set(self.watches.values())
+        for directory in sorted(directories):
+            if directory not in watching:
+                self.watch(directory)
+        self.directories = directories
+
+    def watch(self, directory):
+        try:
+            self.watches[self.inotify.add_watch(directory, WATCH_MASK)] = directory
+        except OSError, e:
+            # Tried again on the next refresh
+            logger.error("Can not watch %s: %s", directory, e)
+            return
+        logger.info("Watching %s", directory)
+
+    def scan(self, directory):
+        """Checks every file of a directory, only needed when events could have been lost."""
+        try:
+            names = os.listdir(directory)
+        except OSError, e:
+            logger.error("Can not scan %s: %s", directory, e)
+            return
+        for name in names:
+            self.schedule(os.path.join(directory, name))
+
+    def schedule(self, path, delay=None):
+        """Checks a file when it has not been written for the debounce time."""
+        self.pending[path] = time.time() + (self.options['debounce'] if delay is None else delay)
+
+    def handle(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            logger.warning("Events lost, scanning the watched directories")
+            for directory in self.watches.values():
+                self.scan(directory)
+            return
+        directory = self.watches.get(wd)
+        if directory is None:
+            return
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+            # Watched again when it is back, on the next refresh
+            logger.warning("%s is gone", directory)
+            self.inotify.rm_watch(wd)
+            del self.watches[wd]
+            return
+        if not mask & IN_ISDIR:
+            self.schedule(os.path.join(directory, name))
+
+    def check_pending(self):
+        """Registers the pending files not written for the debounce time."""
+        now = time.time()
+        for path, when in self.pending.items():
+            if when > now:
+                continue
+            del self.pending[path]
+            try:
+                st = os.stat(path)
+            except OSError:
+                # Removed or renamed meanwhile, a rename into a watched directory has its own event
+                continue
+            if now - self.options['debounce'] < st.st_mtime <= now:
+                # Written again after being closed
+                self.schedule(path, st.st_mtime + self.options['debounce'] - now)
+                continue
+            self.register(path, st)
+
+    def is_compressed(self, directory, filename):
+        """Whether filename is a file written by compress_backups."""
+        if filename.endswith(TEMPORARY_EXTENSION):
+            return True
+        stem, extension = os.path.splitext(filename)
+        return extension in COMPRESSED_EXTENSIONS and os.path.exists(os.path.join(directory, stem))
+
+    def register(self, path, st):
+        """Queues a file for the first host with a pattern matching it, in the order of the inventory."""
+        directory, filename = os.path.split(path)
+        if self.is_compressed(directory, filename):
+            logger.debug("%s is a compressed file", path)
+            return
+        for host, patterns in self.directories.get(directory, []):
+            if any(pattern.match(filename) for pattern in patterns):
+                self.queue.append({'host': host, 'filename': filename, 'filedate': st.st_mtime,
+                                   'filesize': st.st_size})
+                return
+        logger.debug("%s does not match any pattern", path)
+
+    def flush(self, force=False):
+        """Sends the queued files when there are batch_size of them, or flush_interval seconds passed."""
+        now = time.time()
+        if not self.queue or not (force or len(self.queue) >= self.options['batch_size'] or
+                                  now - self.last_flush >= self.options['flush_interval']):
+            return
+        self.last_flush = now
+        while self.queue:
+            batch = self.queue[:self.options['batch_size']]
+            if self.options['dryrun']:
+                logger.info("notify inventory: %s", batch)
+            else:
+                try:
+                    results = client.post_json(ADD_BACKUP_FILES_URL, batch)
+                except ArritrancoError, e:
+                    if e.status >= 500:
+                        # Kept in the queue to send them again later
+                        logger.error("Error registering %d files: %s", len(self.queue), e)
+                        return
+                    # Would be refused again, and block the files after them
+                    logger.error("The inventory refused %d files, dropped: %s (%s)", len(batch), e,
+                                 ', '.join(f['filename'] for f in batch))
+                    results = []
+                except Exception, e:
+                    # Kept in the queue to send them again later
+                    logger.error("Error registering %d files: %s", len(self.queue), e)
+                    return
+                for result in results:
+                    if result['status'] == 'created':
+                        logger.info("Registered %s of %s (%s)", result['filename'], result['host'],
+                                    result['task_time'])
+                    elif result['status'] == 'exists':
+                        logger.debug("%s of %s already registered", result['filename'], result['host'])
+                    elif result['status'] == 'compressed':
+                        logger.debug("%s of %s is a compressed file", result['filename'], result['host'])
+                    else:
+                        logger.error("Can not register %s of %s: %s", result['filename'], result['host'],
+                                     result['status'])
+            del self.queue[:len(batch)]
+
+    def stop(self, signum, frame):
+        self.stopping = True
+
+    def run(self):
+        params = {'checker': self.options['checker']} if self.options['checker'] else None
+        next_refresh = 0
+        first = True
+        while not self.stopping:
+            if time.time() >= next_refresh:
+                try:
+                    self.configure(client.get_json(WATCHED_DIRECTORIES_URL, params))
+                    next_refresh = time.time() + self.options['refresh']
+                except Exception, e:
+                    logger.error("Can not get the directories to watch: %s", e)
+                    next_refresh = time.time() + CONFIGURATION_RETRY
+                if first and self.options['scan']:
+                    for directory in self.watches.values():
+                        self.scan(directory)
+                first = False
+            deadlines = [next_refresh] + self.pending.values()
+            if self.queue:
+                deadlines.append(self.last_flush + self.options['flush_interval'])
+            timeout = min(deadlines) - time.time()
+            for wd, mask, name in self.inotify.read_events(max(timeout, 0)):
+                self.handle(wd, mask, name)
+            self.check_pending()
+            self.flush()
+        self.flush(force=True)
+        self.inotify.close()
+
+
+def main():
+    options = parseOpts()
+    setup_logging(options['verbose'])
+    watcher = Watcher(options)
+    signal.signal(signal.SIGTERM, watcher.stop)
+    signal.signal(signal.SIGINT, watcher.stop)
+    logger.info("Starting")
+    watcher.run()
+    logger.info("Stopped, %d files not registered", len(watcher.queue) + len(watcher.pending))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
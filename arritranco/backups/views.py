@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 from django.http import Http404, HttpResponse, HttpResponseBadRequest
+from django.db import transaction
 from django.db.models import Q
 from django.shortcuts import get_object_or_404
 
@@ -7,14 +8,19 @@ from rest_framework.views import APIView, Response
 from rest_framework import generics
 from rest_framework import mixins
 from rest_framework import status as httpstatus
+from rest_framework.exceptions import ParseError
+from rest_framework.utils.encoders import JSONEncoder
 from serializers import *
 from django.conf import settings
-from models import FileBackupTask, FileBackupProduct, BackupFile, TSMBackupTask, BackupTask
-from scheduler.models import TaskCheck, TaskStatus
+from models import FileBackupTask, FileBackupProduct, BackupFile, TSMBackupTask, BackupTask, DeletionManifest, \
+    TEMPORARY_EXTENSION
+from scheduler.models import TaskCheck
 from scheduler.views import Todo
+from retention import build_manifest, plan_deletions, tasks_with_files
 from inventory.models import Machine
 import datetime
-import math
+import hashlib
+import json
 import os
 import logging
 import time
@@ -23,31 +29,75 @@ logger = logging.getLogger(__name__)
 
 MACHINE_NOT_FOUND_ERROR = 'Machine object not found'
 
+# Maximum last run times looked up in a single query
+CHECKER_BATCH_SIZE = 400
+
+# Maximum file names of a directory looked up in a single query
+DELETED_FILES_BATCH_SIZE = 400
+
+# Files to verify listed per page when no limit is given
+VERIFY_PAGE_SIZE = 1000
+
+
+def get_checker(request):
+    """Machine of the checker parameter, or of the address doing the request."""
+    if 'checker' in request.GET:
+        machine = Machine.get_by_addr(request.GET['checker'])
+    else:
+        machine = Machine.get_by_addr(request.META['REMOTE_ADDR'])
+    if not machine:
+        logger.error(MACHINE_NOT_FOUND_ERROR)
+        raise Http404(MACHINE_NOT_FOUND_ERROR)
+    return machine
+
 
 class BackupFileCheckerView(APIView):
-    """List all non Ok tasks  """
+    """List all non Ok tasks
+
+    The response has an ETag, and is not sent again (304) while it does not change. The
+    ETag is a digest of the list, so a 304 saves sending it but the list is still built.
+    """
 
     def get(self, request, format=None):
         list_of_tasks = {}
-        tasks = []
         f = {}
         if 'checker' in request.GET:
             f = {'checker_fqdn': request.GET['checker']}
-        for fbt in FileBackupTask.objects.filter(active=True, machine__up=True, **f):
-            last_run = fbt.last_run()
-            try:
-                tc = TaskCheck.objects.get(task=fbt, task_time=last_run)
-                status = tc.last_status
-                if (isinstance(status, TaskStatus) and status.status == 'Ok') or (status == 'Ok'):
-                    continue
-            except TaskCheck.DoesNotExist:
-                pass
+        file_backup_tasks = FileBackupTask.objects.filter(active=True, machine__up=True, **f)
+        tasks = list(file_backup_tasks.select_related('machine').prefetch_related('file_backup__file_pattern'))
+
+        # Runs of every recurrence, computed once
+        now = datetime.datetime.now()
+        schedule_runs = {}
+        runs = {}
+        for fbt in tasks:
+            cron = fbt.cron_syntax()
+            if cron not in schedule_runs:
+                last_run = fbt.last_run(now)
+                schedule_runs[cron] = (last_run, fbt.last_run(last_run), fbt.next_run(now))
+            runs[fbt.pk] = schedule_runs[cron]
+
+        # Status of the check of the last run of every task
+        statuses = {}
+        last_runs = sorted(set(r[0] for r in schedule_runs.values()))
+        for i in range(0, len(last_runs), CHECKER_BATCH_SIZE):
+            for task, task_time, status in TaskCheck.objects.filter(
+                    task__in=file_backup_tasks.values('pk'), task_time__in=last_runs[i:i + CHECKER_BATCH_SIZE]
+            ).values_list('task', 'task_time', 'last_status__status'):
+                statuses[(task, task_time)] = status
+
+        for fbt in tasks:
+            if statuses.get((fbt.pk, runs[fbt.pk][0])) == 'Ok':
+                continue
 
             if fbt.machine.fqdn not in list_of_tasks:
                 list_of_tasks[fbt.machine.fqdn] = []
-            list_of_tasks[fbt.machine.fqdn].append(FileBackupTaskSerializer(fbt).data)
+            list_of_tasks[fbt.machine.fqdn].append(FileBackupTaskSerializer(fbt, context={'runs': runs}).data)
 
-        return Response(list_of_tasks, status=httpstatus.HTTP_200_OK)
+        etag = '"%s"' % hashlib.md5(json.dumps(list_of_tasks, sort_keys=True, cls=JSONEncoder)).hexdigest()
+        if etag in [tag.strip() for tag in request.META.get('HTTP_IF_NONE_MATCH', '').split(',')]:
+            return Response(status=httpstatus.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        return Response(list_of_tasks, status=httpstatus.HTTP_200_OK, headers={'ETag': etag})
 
 
 def add_backup_file(request, machine=False, windows=False):
@@ -100,12 +150,7 @@ def add_backup_file(request, machine=False, windows=False):
         msg = "There is no pattern for this file: %s" % filename
         logger.error(msg)
         return HttpResponse(msg)
-    next_run = fbp.file_backup_task.next_run(filedate)
-    previous_run = fbp.file_backup_task.last_run(filedate)
-    if (abs(next_run - filedate) <= abs(filedate - previous_run)):
-        tch_time = next_run
-    else:
-        tch_time = previous_run
+    tch_time = fbp.file_backup_task.nearest_run(filedate)
     if tch_time > datetime.datetime.now():
         logger.error('Future backup')
     tch, created = TaskCheck.objects.get_or_create(
@@ -144,17 +189,72 @@ def register_file_from_checker(request):
     return add_backup_file(request, machine)
 
 
+class AddBackupFilesView(APIView):
+    """Registers many backup files, of one or more hosts, in a single request."""
+
+    serializer = AddBackupFileSerializer
+
+    def post(self, request):
+        """Handle POST requests with a list of {host, filename, filedate, filesize} records.
+
+        Returns, in the same order, the result of every file: created, exists, no machine, no pattern
+        or compressed (a compressed file of a known backup file, or one being written)."""
+
+        data = self.serializer(data=request.DATA, many=True)
+        if not data.is_valid():
+            return Response(data.errors, httpstatus.HTTP_400_BAD_REQUEST)
+        machines = {}
+        for item in data.object:
+            host = item.get('host')
+            if host not in machines:
+                if host:
+                    machines[host] = Machine.get_by_addr(host)
+                else:
+                    machines[host] = Machine.get_by_addr(request.META['REMOTE_ADDR'], filter_up=True)
+        results = []
+        files = []
+        for item in data.object:
+            result = {'host': item.get('host'), 'filename': item['filename']}
+            results.append(result)
+            machine = machines[item.get('host')]
+            if not machine:
+                logger.error('There is no machine for address: %s', item.get('host') or request.META['REMOTE_ADDR'])
+                result['status'] = 'no machine'
+                continue
+            if item['filename'].endswith(TEMPORARY_EXTENSION):
+                result['status'] = 'compressed'
+                continue
+            fbp = FileBackupTask.get_fbp(machine, item['filename'])
+            if not fbp:
+                logger.error("There is no pattern for this file: %s", item['filename'])
+                result['status'] = 'no pattern'
+                continue
+            # Same as add_backup_file, one more minute to get this run as the last one
+            filedate = datetime.datetime.fromtimestamp(item['filedate']) + datetime.timedelta(minutes=1)
+            files.append((result, (fbp, item['filename'], filedate, item['filesize'])))
+        # Patterns match file name prefixes, so the compressed files match the pattern of their original
+        copies = BackupFile.objects.compressed_copies([(fbp.file_backup_task.directory, filename)
+                                                       for result, (fbp, filename, filedate, filesize) in files])
+        for result, (fbp, filename, filedate, filesize) in files:
+            if (fbp.file_backup_task.directory, filename) in copies:
+                logger.warning("%s is a compressed backup file, not registered", filename)
+                result['status'] = 'compressed'
+        files = [(result, f) for result, f in files if 'status' not in result]
+        now = datetime.datetime.now()
+        registered = BackupFile.objects.register([f for result, f in files])
+        for (result, f), (task_time, created) in zip(files, registered):
+            if task_time > now:
+                logger.error('Future backup')
+            result['status'] = 'created' if created else 'exists'
+            result['task_time'] = task_time
+        return Response(results, httpstatus.HTTP_200_OK)
+
+
 def add_compressed_backup_file(request):
     """Compressed file tied with original backup file."""
     id = directory = compressedmd5 = originalmd5 = None
 
-    if 'checker' in request.GET:
-        machine = Machine.get_by_addr(request.GET['checker'])
-    else:
-        machine = Machine.get_by_addr(request.META['REMOTE_ADDR'])
-    if not machine:
-        logger.error(MACHINE_NOT_FOUND_ERROR)
-        raise Http404(MACHINE_NOT_FOUND_ERROR)
+    machine = get_checker(request)
 
     logger.debug('add_compressed_backup_file called from %s', machine.fqdn)
 
@@ -190,17 +290,39 @@ def add_compressed_backup_file(request):
                                         original_file_name__startswith=os.path.splitext(compressed_file_name)[0],
                                         file_backup_product__file_backup_task__directory__startswith=directory
         )
-    backup_file.compressed_file_name = compressed_file_name
-    backup_file.compressed_file_size = filesize
-    backup_file.compressed_date = filedate
-    if compressedmd5:
-        backup_file.compressed_md5 = compressedmd5
-    if originalmd5:
-        backup_file.original_md5 = originalmd5
-    backup_file.save()
+    backup_file.set_compressed(compressed_file_name, filesize, filedate, compressedmd5, originalmd5)
     return HttpResponse("Ok")
 
 
+class AddCompressedBackupFilesView(APIView):
+    """Stores many compressed files, by the id of their backup file, in a single request."""
+
+    serializer = CompressedBackupFileSerializer
+
+    @transaction.atomic
+    def post(self, request):
+        """Handle POST requests with a list of {id, compressedfilename, filedate, filesize, compressedmd5,
+        originalmd5} records, as add_compressed_backup_file takes them.
+
+        Returns the [id, status] of every record, status is False for unknown ids."""
+
+        data = self.serializer(data=request.DATA, many=True)
+        if not data.is_valid():
+            return Response(data.errors, httpstatus.HTTP_400_BAD_REQUEST)
+        backup_files = BackupFile.objects.in_bulk(set(item['id'] for item in data.object))
+        response = []
+        for item in data.object:
+            backup_file = backup_files.get(item['id'])
+            if backup_file is not None:
+                backup_file.set_compressed(item['compressedfilename'], item['filesize'],
+                                           datetime.datetime.fromtimestamp(item['filedate']),
+                                           item.get('compressedmd5'), item.get('originalmd5'))
+            else:
+                logger.error('There is no backup file %s', item['id'])
+            response.append((item['id'], backup_file is not None))
+        return Response(response, httpstatus.HTTP_200_OK)
+
+
 class BackupTaskView(generics.RetrieveAPIView):
     """Detail of BackupTask."""
     queryset = BackupTask.objects.all()
@@ -219,151 +341,248 @@ class FileBackupsTodo(Todo):
     model = FileBackupTask
     serializer = FileBackupTaskSerializer
 
+    def get_tasks(self):
+        return super(FileBackupsTodo, self).get_tasks().prefetch_related('file_backup__file_pattern')
+
+
+class CheckerMixin(object):
+    def get_checker(self, request):
+        """Machine of the checker parameter, or of the address doing the request."""
+        return get_checker(request)
+
 
-class FilesToCompressView(APIView):
-    """Returns a json with the list of files to be compressed"""
+class FilesToCompressView(CheckerMixin, APIView):
+    """Returns a json with the list of files to be compressed
+
+    The newest files adding up to budget_gb (MAX_COMPRESS_GB by default) are returned,
+    at most limit of them. When there can be more files the X-Next-Cursor header holds
+    the after value for the next page, so several compressors can take different files.
+    """
+
+    def get_params(self, request):
+        """budget_gb, limit and after (the BackupFile) parameters."""
+        try:
+            budget = float(request.GET.get('budget_gb', settings.MAX_COMPRESS_GB))
+            limit = int(request.GET['limit']) if 'limit' in request.GET else None
+            after = int(request.GET['after']) if 'after' in request.GET else None
+        except ValueError:
+            raise ParseError('Bad budget_gb, limit or after')
+        if budget <= 0 or (limit is not None and limit < 1):
+            raise ParseError('Bad budget_gb or limit')
+        if after is not None:
+            try:
+                after = BackupFile.objects.only('original_date').get(pk=after)
+            except BackupFile.DoesNotExist:
+                raise ParseError('Bad after: %s' % after)
+        return budget, limit, after
 
     def get(self, request):
-        if 'checker' in request.GET:
-            machine = Machine.get_by_addr(request.GET['checker'])
-        else:
-            machine = Machine.get_by_addr(request.META['REMOTE_ADDR'])
-        if not machine:
-            logger.error(MACHINE_NOT_FOUND_ERROR)
-            raise Http404(MACHINE_NOT_FOUND_ERROR)
+        machine = self.get_checker(request)
+        budget, limit, after = self.get_params(request)
 
         logger.info('Files to compress in: %s', machine.fqdn)
-        tocompress = []
-        totalsize = 0
-        for bf in BackupFile.objects.filter(
-                compressed_file_name='', deletion_date__isnull=True,
-                file_backup_product__file_backup_task__checker_fqdn=machine.fqdn).order_by('-original_date'):
-            tocompress.append(BackupFileSerializer(bf).data)
-            totalsize += bf.original_file_size
-            if (totalsize > settings.MAX_COMPRESS_GB * 1024**3):
-                logger.warning('Total size max reached: %s', totalsize)
-                break
+        files, more = BackupFile.objects.to_compress(machine.fqdn, budget * 1024 ** 3, after, limit)
+        tocompress = [BackupFileSerializer(bf).data for bf in files]
+        totalsize = sum(bf.original_file_size for bf in files)
+        if totalsize > budget * 1024 ** 3:
+            logger.warning('Total size max reached: %s', totalsize)
         logger.info('Total files: %s', len(tocompress))
-        return Response(tocompress, status=httpstatus.HTTP_200_OK)
+        headers = {}
+        if more and files:
+            headers['X-Next-Cursor'] = '%d' % files[-1].pk
+        return Response(tocompress, status=httpstatus.HTTP_200_OK, headers=headers)
 
 
-class FilesToDeleteView(APIView):
-    """Returns a json with the list of files to be deleted"""
+class ClaimFilesToCompressView(FilesToCompressView):
+    """Leases files to compress to a compressor, so that other compressors do not get them
 
-    def task_checks_older_than_max_days_in_disk(self, task):
-        return list(TaskCheck.objects.filter(
-            task_time__lte=datetime.datetime.now() - datetime.timedelta(days=task.days_in_hard_drive),
-            task=task
-        )
-        )
+    Takes the same parameters as filesToCompress plus worker, the name of the compressor
+    (its address by default). The files are given back with their lease expiration, and
+    their compressed files can be stored with addCompressedBackupFiles.
+    """
+
+    http_method_names = ['post', 'options']
 
     def post(self, request):
-        if 'checker' in request.GET:
-            machine = Machine.get_by_addr(request.GET['checker'])
-        else:
-            machine = Machine.get_by_addr(request.META['REMOTE_ADDR'])
-        if not machine:
-            logger.error(MACHINE_NOT_FOUND_ERROR)
-            raise Http404(MACHINE_NOT_FOUND_ERROR)
+        machine = self.get_checker(request)
+        # Leased files are not listed anymore, so the claims always start with the newest file
+        budget, limit = self.get_params(request)[:2]
+        worker = request.QUERY_PARAMS.get('worker') or request.META['REMOTE_ADDR']
+        files = BackupFile.objects.claim(machine.fqdn, worker, budget * 1024 ** 3, limit)
+        logger.info('%d files to compress in %s claimed by %s', len(files), machine.fqdn, worker)
+        claimed = []
+        for bf in files:
+            data = BackupFileSerializer(bf).data
+            data['lease_expires'] = bf.compression_lease_expires
+            claimed.append(data)
+        return Response(claimed, status=httpstatus.HTTP_200_OK)
+
+
+class FilesToVerifyView(CheckerMixin, APIView):
+    """Returns a json with the list of files of a checker whose integrity can be verified
+
+    Files come with the size and MD5 they should have, in pages of limit files
+    (VERIFY_PAGE_SIZE by default). When there are more files the X-Next-Cursor header
+    holds the after value for the next page. With unchecked only the files never
+    verified are listed.
+    """
+
+    def get(self, request):
+        machine = self.get_checker(request)
+        try:
+            limit = int(request.GET.get('limit', VERIFY_PAGE_SIZE))
+            after = int(request.GET['after']) if 'after' in request.GET else None
+        except ValueError:
+            raise ParseError('Bad limit or after')
+        if limit < 1:
+            raise ParseError('Bad limit')
+        files = BackupFile.objects.to_verify(machine.fqdn, unchecked='unchecked' in request.GET)
+        if after is not None:
+            files = files.filter(pk__gt=after)
+        files = list(files.select_related('file_backup_product__file_backup_task').order_by('pk')[:limit + 1])
+        headers = {}
+        if len(files) > limit:
+            files = files[:limit]
+            headers['X-Next-Cursor'] = '%d' % files[-1].pk
+        logger.info('%d files to verify in %s', len(files), machine.fqdn)
+        return Response([BackupFileToVerifySerializer(bf).data for bf in files], status=httpstatus.HTTP_200_OK,
+                        headers=headers)
+
+
+class SetIntegrityStatusView(CheckerMixin, APIView):
+    """Stores the integrity of many backup files of a checker in a single request."""
+
+    serializer = IntegrityStatusSerializer
+
+    def post(self, request):
+        """Handle POST requests with a list of {id, md5, path} records, the MD5 computed for the file on disk.
+
+        Returns, in the same order, [id, integrity] for every file: true when the MD5 is the
+        expected one, false when it is not (or md5 is empty) and null for unknown files, or
+        when path (the file hashed, as listed by filesToVerify) is not its file anymore."""
+
+        machine = self.get_checker(request)
+        data = self.serializer(data=request.DATA, many=True)
+        if not data.is_valid():
+            return Response(data.errors, httpstatus.HTTP_400_BAD_REQUEST)
+        hashes = [(item['id'], item.get('md5'), item.get('path')) for item in data.object]
+        integrity = BackupFile.objects.set_integrity(machine.fqdn, hashes)
+        logger.info('Integrity of %d files of %s, %d wrong', len(hashes), machine.fqdn, integrity.count(False))
+        return Response([[pk, checked] for (pk, md5, path), checked in zip(hashes, integrity)],
+                        httpstatus.HTTP_200_OK)
+
+
+class WatchedDirectoriesView(CheckerMixin, APIView):
+    """Returns a json with the backup directories of a checker, to watch for new files
+
+    Every directory comes with the machines backed up in it and the regular
+    expressions of their file name patterns, in the order get_fbp tries them, so
+    the checker can match new files before registering them with addBackupFiles.
+    """
+
+    def get(self, request):
+        machine = self.get_checker(request)
+        directories = {}
+        fbps = FileBackupProduct.objects.filter(file_backup_task__checker_fqdn=machine.fqdn,
+                                                file_backup_task__active=True)
+        for fbp in fbps.select_related('file_backup_task__machine', 'file_pattern').order_by('pk'):
+            task = fbp.file_backup_task
+            hosts = directories.setdefault(task.directory, [])
+            for host in hosts:
+                if host['host'] == task.machine.fqdn:
+                    break
+            else:
+                host = {'host': task.machine.fqdn, 'patterns': []}
+                hosts.append(host)
+            pattern = fbp.file_pattern.get_re_pattern(task.machine)
+            if pattern not in host['patterns']:
+                host['patterns'].append(pattern)
+        watched = [{'directory': directory, 'hosts': directories[directory]} for directory in sorted(directories)]
+        return Response(watched, status=httpstatus.HTTP_200_OK)
+
+
+class FilesToDeleteView(CheckerMixin, APIView):
+    """Returns a json with the list of files to be deleted"""
+
+    def post(self, request):
+        machine = self.get_checker(request)
 
         if not 'deleted_files' in request.POST:
             logger.warning('Lack of  deleted_files POST data')
             return HttpResponseBadRequest()
         files_to_delete = request.POST.getlist('deleted_files')
         logger.debug('deleted_files: %s', files_to_delete)
-        response = []
 
+        directories = {}
         for f in files_to_delete:
             directory, filename = os.path.split(f)
-            logger.debug('Deleting directory: %s file: %s', directory, filename)
-            status = False
-            for backupFile in BackupFile.objects.filter(
-                    (Q(original_file_name=filename) | Q(compressed_file_name=filename)),
-                    Q(file_backup_product__file_backup_task__directory__startswith=directory),
-                    Q(file_backup_product__file_backup_task__checker_fqdn=machine.fqdn)):
-                backupFile.deletion_date = datetime.datetime.now()  # Se mantiene la entrada en la bd hasta que desaparezca de las cintas
-                backupFile.save()
-                status = True
+            directories.setdefault(directory, set()).add(filename)
+        deleted = set()
+        now = datetime.datetime.now()
+        for directory, filenames in directories.items():
+            logger.debug('Deleting %d files in directory: %s', len(filenames), directory)
+            filenames = sorted(filenames)
+            for i in range(0, len(filenames), DELETED_FILES_BATCH_SIZE):
+                names = filenames[i:i + DELETED_FILES_BATCH_SIZE]
+                lookup = set(names)
+                ids = []
+                for pk, original, compressed in BackupFile.objects.filter(
+                        (Q(original_file_name__in=names) | Q(compressed_file_name__in=names)),
+                        Q(file_backup_product__file_backup_task__directory__startswith=directory),
+                        Q(file_backup_product__file_backup_task__checker_fqdn=machine.fqdn)).values_list(
+                        'pk', 'original_file_name', 'compressed_file_name'):
+                    ids.append(pk)
+                    deleted.update((directory, name) for name in (original, compressed) if name in lookup)
+                # Se mantiene la entrada en la bd hasta que desaparezca de las cintas
+                BackupFile.objects.filter(pk__in=ids).update(deletion_date=now)
+
+        response = []
+        for f in files_to_delete:
+            status = os.path.split(f) in deleted
             response.append((f, status))
             if status:
-                logger.debug('Deleted')
+                logger.debug('Deleted %s', f)
             else:
-                logger.debug('Already deleted, nothing to do')
+                logger.debug('Already deleted, nothing to do: %s', f)
         response = Response(response, httpstatus.HTTP_200_OK)
         return (response)
 
     def get(self, request):
-        t0 = time.time()
-        if 'checker' in request.GET:
-            machine = Machine.get_by_addr(request.GET['checker'])
-        else:
-            machine = Machine.get_by_addr(request.META['REMOTE_ADDR'])
-        if not machine:
-            logger.error(MACHINE_NOT_FOUND_ERROR)
-            raise Http404(MACHINE_NOT_FOUND_ERROR)
+        machine = self.get_checker(request)
+
+        # Manifests are planned for the whole checker, filtering by host is planned now
+        manifest = None if 'host' in request.GET else DeletionManifest.objects.latest_for(machine.fqdn)
+        if manifest is not None:
+            if manifest.is_stale():
+                logger.warning('Deletion manifest %s is stale, planning it again', manifest)
+                manifest = build_manifest(machine.fqdn)
+            return self.manifest_response(request, manifest)
 
-        filter = {'taskcheck__backupfile__deletion_date__isnull': True,  # isnull matches checks without backups
-                  'taskcheck__backupfile__isnull': False}  # so we check that there are 1+ backupfiles
+        tasks = tasks_with_files(machine.fqdn)
         if 'host' in request.GET:
             host = Machine.get_by_addr(request.GET['host'])
-            filter['machine'] = host
+            tasks = tasks.filter(machine=host)
 
         logger.debug('Files to delete in: %s', machine.fqdn)
-        today = datetime.date.today()
-        task_to_delete = []
-        for task in FileBackupTask.objects.filter(checker_fqdn=machine.fqdn, **filter).distinct():
-            logger.debug('Delete files for task: %s: %s', task, task.description)
-            task_to_delete += self.task_checks_older_than_max_days_in_disk(task)
-            first_month_day = datetime.datetime(today.year, today.month, 1, 0, 0, 0)
-            #            first_month_day = datetime.datetime(last_month_day.year, last_month_day.month, 1, 0, 0, 0)
-
-            for m in range(1, 12):
-                last_month_day = first_month_day
-                tmp_day = last_month_day - datetime.timedelta(minutes=1)
-                first_month_day = datetime.datetime(tmp_day.year, tmp_day.month, 1, 0, 0, 0)
-                logger.debug('first month day: %s, Last month day: %s', first_month_day, last_month_day)
-                tchs = []
-
-                for tch in TaskCheck.objects.filter(
-                        task=task,
-                        task_time__gte=first_month_day,
-                        task_time__lte=last_month_day,
-                        backupfile__deletion_date__isnull=True,
-                        backupfile__original_date__isnull=False).select_related('task').distinct().order_by(
-                        'task_time'):
-                    if tch.backupfile_set.filter(deletion_date__isnull=True).count():
-                        tchs.append(tch)
-
-                logger.debug('len tash checks: %s, max_backup_month: %s', len(tchs), task.max_backup_month)
-                if len(tchs) > task.max_backup_month:
-                    logger.debug('Selecting task check to delete')
-                    step = float(len(tchs)) / (len(tchs) - task.max_backup_month)
-                    #last = len(tchs) - 1 - step
-                    last = len(tchs) - step
-                    logger.debug("Last: %s", last)
-                    while last >= 0:
-                        task_to_delete.append(tchs[int(math.ceil(last))])
-                        logger.debug('Selected: %s', tchs[int(math.ceil(last))].task_time)
-                        last -= step
-                        #                else:
-                        #                    break
-        files_to_delete = []
-        logger.debug("Start filling files_to_delete")
-        for tch in task_to_delete:
-            directory = tch.task.backuptask.filebackuptask.directory
-            logger.debug('Deleting files of task: [%d] %s %s', tch.id, tch, tch.task_time)
-            for bf in tch.backupfile_set.filter(deletion_date__isnull=True):
-                files_to_delete.append(BackupFileToDeleteSerializer(bf).data)
-                logger.debug('Adding: %s', bf.path)
-
-        logger.debug("End filling files_to_delete")
-
-        print ("time files to delete : " + str(time.time() - t0))
+        t0 = time.time()
+        files_to_delete = [BackupFileToDeleteSerializer(bf).data for bf in plan_deletions(tasks)]
+        logger.debug('Files to delete: %d, planned in %.3fs', len(files_to_delete), time.time() - t0)
 
         return Response(files_to_delete, httpstatus.HTTP_200_OK)
 
 
-class GetBackupFileInfo(APIView):
+    def manifest_response(self, request, manifest):
+        """Files of the manifest not deleted yet, or 304 when the checker already has them."""
+        files_to_delete = manifest.pending_files()
+        etag = manifest.etag(files_to_delete)
+        headers = {'ETag': etag, 'X-Manifest-Generation': manifest.generation}
+        if etag in [tag.strip() for tag in request.META.get('HTTP_IF_NONE_MATCH', '').split(',')]:
+            return Response(status=httpstatus.HTTP_304_NOT_MODIFIED, headers=headers)
+        logger.debug('Files to delete in: %s from manifest %s', manifest.checker_fqdn, manifest.generation)
+        return Response(files_to_delete, httpstatus.HTTP_200_OK, headers=headers)
+
+
+class GetBackupFileInfo(CheckerMixin, APIView):
     """Returns json with info about a file matching with filename."""
 
     def get(self, request):
@@ -373,45 +592,44 @@ class GetBackupFileInfo(APIView):
         if not 'directory' in request.GET:
             logger.debug('No directory in request')
             return HttpResponseBadRequest()
-        if 'checker' in request.GET:
-            machine = Machine.get_by_addr(request.GET['checker'])
-        else:
-            machine = Machine.get_by_addr(request.META['REMOTE_ADDR'])
-        if not machine:
-            logger.error(MACHINE_NOT_FOUND_ERROR)
-            raise Http404(MACHINE_NOT_FOUND_ERROR)
+        machine = self.get_checker(request)
 
         file_name = request.GET['file_name']
         logger.debug('Searching for: "%s" in "%s"', file_name, request.GET['directory'])
         logger.debug('Checker: "%s"', machine.fqdn)
-        file_info = BackupFile.objects.filter(
-            Q(file_backup_product__file_backup_task__checker_fqdn=machine.fqdn) &
-            Q(file_backup_product__file_backup_task__directory=request.GET['directory']) &
-            (
-                Q(compressed_file_name=file_name) |
-                Q(original_file_name=file_name) |
-                Q(compressed_file_name=os.path.splitext(file_name)[0]) |
-                Q(original_file_name=os.path.splitext(file_name)[0])
-            )
-        ).order_by('original_date')
-        if file_info.count() == 0:
+        file_info = BackupFile.objects.lookup(machine.fqdn, [(request.GET['directory'], file_name)])[0]
+        if file_info is None:
             logger.debug('File not found in DB')
             raise Http404('There is no such file in database')
-        info = BackupFileInfoSerializer(file_info[0]).data
+        info = BackupFileInfoSerializer(file_info).data
         return Response(info, httpstatus.HTTP_200_OK)
 
 
-class TSMHostsView(APIView):
+class BackupFilesInfoView(CheckerMixin, APIView):
+    """Info about many backup files of a checker in a single request."""
+
+    serializer = BackupFileLookupSerializer
+
+    def post(self, request):
+        """Handle POST requests with a list of {directory, file_name} records.
+
+        Returns, in the same order, the info of every file as backupFileInfo does, or null if it is not found."""
+
+        machine = self.get_checker(request)
+        data = self.serializer(data=request.DATA, many=True)
+        if not data.is_valid():
+            return Response(data.errors, httpstatus.HTTP_400_BAD_REQUEST)
+        files = BackupFile.objects.lookup(machine.fqdn, [(item['directory'], item['file_name'])
+                                                         for item in data.object])
+        return Response([BackupFileInfoSerializer(bf).data if bf is not None else None for bf in files],
+                        httpstatus.HTTP_200_OK)
+
+
+class TSMHostsView(CheckerMixin, APIView):
     """Lists of hosts baked up with tsm"""
 
     def get(self, request):
-        if 'checker' in request.GET:
-            machine = Machine.get_by_addr(request.GET['checker'])
-        else:
-            machine = Machine.get_by_addr(request.META['REMOTE_ADDR'])
-        if not machine:
-            logger.error(MACHINE_NOT_FOUND_ERROR)
-            raise Http404(MACHINE_NOT_FOUND_ERROR)
+        machine = self.get_checker(request)
 
         if 'tsm_server' in request.GET:
             qs = TSMBackupTask.objects.filter(tsm_server=request.GET['tsm_server'])
@@ -4,8 +4,6 @@ Created on 25/03/2011
 
 @author: esauro
 '''
-import random
-
 from django import forms
 from models import Machine, PhysicalMachine, VirtualMachine, OperatingSystem, OperatingSystemType, Interface
 from django.core.exceptions import ObjectDoesNotExist
@@ -21,6 +19,7 @@ from django.conf import settings
 from monitoring.nagios.admin import NagiosMachineCheckOptsInline
 from backups.models import FileBackupTask, BackupTask, FileBackupTaskTemplate, FileBackupProductTemplate, \
     FileBackupProduct
+from backups.planner import BackupWindowPlanner, DEFAULT_DURATION
 import datetime
 
 import logging
@@ -175,7 +174,6 @@ class MachineAdmin(admin.ModelAdmin):
 
     def apply_backupfile(self, request, queryset):
         """Admin action to aply a system backup by default."""
-        form = None
         if 'apply' in request.POST:
             machineDates = request.session["machineDate"]
             filebackuptemplate = FileBackupTaskTemplate.objects.get(pk=request.POST["filebackup"])
@@ -189,11 +187,12 @@ class MachineAdmin(admin.ModelAdmin):
                     filebackup.days_in_hard_drive = filebackuptemplate.days_in_hard_drive
                     filebackup.description = filebackuptemplate.name + " para " + machine.fqdn
                     filebackup.directory = filebackuptemplate.directory % {"fqdn": machineDate["machine"]}
-                    dt = datetime.datetime.combine(datetime.date.today(), datetime.time(0, 0)) + datetime.timedelta(minutes=filebackuptemplate.duration)
+                    dt = datetime.datetime.combine(datetime.date.today(), datetime.time(0, 0)) + datetime.timedelta(
+                        minutes=filebackuptemplate.duration or DEFAULT_DURATION)
                     filebackup.duration = dt.time()
                     filebackup.hour = machineDate["hour"]
                     filebackup.monthday = machineDate["mothday"]
-                    filebackup.minute = random.randint(0, 59)
+                    filebackup.minute = machineDate["minute"]
                     filebackup.extra_options = filebackuptemplate.extra_options
                     filebackup.machine = machine
                     filebackup.max_backup_month = filebackuptemplate.max_backup_month
@@ -213,57 +212,30 @@ class MachineAdmin(admin.ModelAdmin):
             messages.info(request, _(u'The action has been applied'))
 
             return HttpResponseRedirect(request.get_full_path())
-        if not form:  # first call render the form to ask for diferent parametters
-            #date = {mothdate:{"nbackups":x,"hours":[nbackpus ...]} ...}
-            date = {}
-            for mothday in xrange(1, 27):
-                hours = {}
-                for hour in xrange(0, 7):
-                    hours[hour] = FileBackupTask.objects.filter(monthday=mothday,
-                                                                hour=hour).count() + FileBackupTask.objects.filter(
-                        monthday=mothday, hour="0" + str(hour)).count()
-
-                date[mothday] = {"nbackups": FileBackupTask.objects.filter(monthday=mothday).count(),
-                                 "hours": hours}
-
-            # machineDate = [{"machine": machine.fqdn, "mothday": x, "hour": y},  ...]
-
-            machineDate = []
-
+        # First call render the form to choose the template, then preview the planned slots
+        form = self.BackupFileForm(request.POST if 'preview' in request.POST else None, initial={
+            '_selected_action': request.POST.getlist(admin.ACTION_CHECKBOX_NAME),
+        })
+        # machineDate = [{"machine": machine.fqdn, "mothday": x, "hour": y, "minute": z},  ...]
+        machineDate = []
+        if form.is_bound and form.is_valid():
+            filebackuptemplate = form.cleaned_data['filebackup']
+            # Monthly backups: plan over a month, with the load of every task of the checker
+            today = datetime.date.today()
+            next_month = datetime.date(today.year + today.month // 12, today.month % 12 + 1, 1)
+            planner = BackupWindowPlanner(datetime.datetime.combine(next_month, datetime.time()), days=28).build()
             for machine in queryset:
-
-                minNBackupsDay = min([date[mothday]["nbackups"] for mothday in xrange(1, 27)])
-                day = -1
-                for i in xrange(1, 27):
-                    if date[i]["nbackups"] == minNBackupsDay:
-                        day = i
-                        break
-                #FIXME
-                # con muchas maquinas aveces da 0 cuando ha de dar 1
-                minNBackupsHour = min([i for i in date[day]["hours"]])
-                hour = -1
-                for i in xrange(0, 7):
-                    if minNBackupsHour == date[day]["hours"][i]:
-                        hour = i
-                        break
-
-                machineDate.append({"machine": machine.fqdn, "mothday": day, "hour": hour})
-
-                date[day]["nbackups"] += 1
-                date[day]["hours"][hour] += 1
-                pass
-
-            form = self.BackupFileForm(initial={
-                '_selected_action': request.POST.getlist(admin.ACTION_CHECKBOX_NAME),
-            })
-
+                proposal = planner.propose(filebackuptemplate.checker_fqdn,
+                                           filebackuptemplate.duration or DEFAULT_DURATION, monthdays=range(1, 27))
+                machineDate.append({"machine": machine.fqdn, "mothday": proposal.monthday, "hour": proposal.hour,
+                                    "minute": proposal.minute, "peak": proposal.peak})
             request.session["machineDate"] = machineDate
 
-            return render_to_response('admin/inventory/machine/systembackup.html',
-                                      {"form": form,
-                                       "action": "apply_backupfile",
-                                       "machineDate": machineDate},
-                                      context_instance=RequestContext(request))
+        return render_to_response('admin/inventory/machine/systembackup.html',
+                                  {"form": form,
+                                   "action": "apply_backupfile",
+                                   "machineDate": machineDate},
+                                  context_instance=RequestContext(request))
 
     apply_backupfile.short_description = _(u'Apply backup file template')
 
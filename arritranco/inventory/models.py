@@ -8,8 +8,9 @@ from django.core.urlresolvers import reverse
 import socket
 import re
 import IPy
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from monitoring.nagios.models import assign_default_checks
+from arritranco.cache import TTLCache, MISSING
 
 import logging
 
@@ -21,6 +22,29 @@ try:
 except ImportError:
     DEFAULT_SVC_IFACE_NAME = None
 
+# Seconds an address is resolved to the same machine, or to none (negative TTL), without querying again
+try:
+    from arritranco.settings import MACHINE_ADDR_CACHE_TTL, MACHINE_ADDR_NEGATIVE_CACHE_TTL
+except ImportError:
+    MACHINE_ADDR_CACHE_TTL = 300
+    MACHINE_ADDR_NEGATIVE_CACHE_TTL = 60
+
+# Seconds a reverse DNS lookup is reused, DNS changes are not notified so it is never invalidated
+try:
+    from arritranco.settings import REVERSE_DNS_CACHE_TTL
+except ImportError:
+    REVERSE_DNS_CACHE_TTL = 3600
+
+ADDR_CACHE_SIZE = 10000
+
+_machine_addr_cache = TTLCache(MACHINE_ADDR_CACHE_TTL, max_size=ADDR_CACHE_SIZE)
+_reverse_dns_cache = TTLCache(REVERSE_DNS_CACHE_TTL, max_size=ADDR_CACHE_SIZE)
+
+
+def reverse_fqdn(addr):
+    """socket.getfqdn, caching the result (which is addr itself when the lookup fails)."""
+    return _reverse_dns_cache.get_or_set(addr, lambda: socket.getfqdn(addr))
+
 UPDATE_PRIORITY = (
     (10, _(u'Don\'t worry')),
     (20, _(u'Watch services.')),
@@ -174,7 +198,26 @@ class Machine(models.Model):
 
             addr: addrees or FQDN of the machine.
             filter_up: decide either yes or not wer want only up machines on results.
+
+            Results, including not found addresses, are cached until a Machine, Interface or IP is saved.
         """
+        key = (addr, filter_up)
+        machine = _machine_addr_cache.get(key)
+        if machine is MISSING:
+            machine = Machine._get_by_addr(addr, filter_up)
+            if machine is None:
+                _machine_addr_cache.set(key, None, MACHINE_ADDR_NEGATIVE_CACHE_TTL)
+            else:
+                _machine_addr_cache.set(key, machine)
+        return machine
+
+    @staticmethod
+    def get_by_addr_stats():
+        """Hits and misses of the address and reverse DNS caches used by get_by_addr."""
+        return {'machines': _machine_addr_cache.stats(), 'reverse_dns': _reverse_dns_cache.stats()}
+
+    @staticmethod
+    def _get_by_addr(addr, filter_up=False):
         try:
             # Search by IP
             if filter_up:
@@ -202,7 +245,7 @@ class Machine(models.Model):
             # FIXME
             # The addr name could have more than one reverse DNS name.
             # In these cases we would iterate by the list of reverse names
-            return Machine.objects.get(fqdn=socket.getfqdn(addr), up=True)
+            return Machine.objects.get(fqdn=reverse_fqdn(addr), up=True)
         except Machine.DoesNotExist:
             return None
 
@@ -359,4 +402,14 @@ class PhysicalMachine(Machine):
 
 post_save.connect(assign_default_checks, sender=Machine)
 post_save.connect(assign_default_checks, sender=PhysicalMachine)
-post_save.connect(assign_default_checks, sender=VirtualMachine)
\ No newline at end of file
+post_save.connect(assign_default_checks, sender=VirtualMachine)
+
+
+def clear_machine_addr_cache(sender, **kwargs):
+    _machine_addr_cache.clear()
+
+for model in (Machine, VirtualMachine, PhysicalMachine, Interface, IP):
+    post_save.connect(clear_machine_addr_cache, sender=model,
+                      dispatch_uid="clear_machine_addr_cache_save_%s" % model._meta.model_name)
+    post_delete.connect(clear_machine_addr_cache, sender=model,
+                        dispatch_uid="clear_machine_addr_cache_delete_%s" % model._meta.model_name)
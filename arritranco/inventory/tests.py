@@ -1,24 +1,56 @@
-"""
-This file demonstrates two different styles of tests (one doctest and one
-unittest). These will both pass when you run "manage.py test".
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
-Replace these with more appropriate tests for your application.
-"""
+from inventory import models as inventory_models
+from inventory.models import Interface, Machine
+from network.models import IP
 
-from django.test import TestCase
 
+class GetByAddrTest(TestCase):
+    def setUp(self):
+        inventory_models._machine_addr_cache.clear()
+        inventory_models._reverse_dns_cache.clear()
+        self.machine = Machine.objects.create(fqdn='host.example.com', up=True)
+        self.ip = IP.objects.create(addr='10.0.0.1')
+        Interface.objects.create(machine=self.machine, name='eth0', ip=self.ip, hwaddr='00:00:00:00:00:01')
+
+    def assertCached(self, addr, machine, **kwargs):
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(Machine.get_by_addr(addr, **kwargs), machine)
+        self.assertEqual(len(context), 0)
 
-class SimpleTest(TestCase):
-    def test_basic_addition(self):
-        """
-        Tests that 1 + 1 always equals 2.
-        """
-        self.failUnlessEqual(1 + 1, 2)
+    def test_cache(self):
+        self.assertEqual(Machine.get_by_addr('10.0.0.1'), self.machine)
+        self.assertEqual(Machine.get_by_addr('host.example.com', filter_up=True), self.machine)
+        self.assertCached('10.0.0.1', self.machine)
+        self.assertCached('host.example.com', self.machine, filter_up=True)
+        before = Machine.get_by_addr_stats()['machines']
+        self.assertCached('10.0.0.1', self.machine)
+        stats = Machine.get_by_addr_stats()['machines']
+        self.assertEqual((stats['hits'], stats['misses']), (before['hits'] + 1, before['misses']))
 
-__test__ = {"doctest": """
-Another way to test that 1 + 1 is equal to 2.
+    def test_negative_cache(self):
+        inventory_models._reverse_dns_cache.set('other.example.com', 'other.example.com')
+        self.assertEqual(Machine.get_by_addr('other.example.com'), None)
+        self.assertCached('other.example.com', None)
+        other = Machine.objects.create(fqdn='other.example.com', up=True)
+        self.assertEqual(Machine.get_by_addr('other.example.com'), other)
 
->>> 1 + 1 == 2
-True
-"""}
+    def test_reverse_dns(self):
+        inventory_models._reverse_dns_cache.set('10.0.0.2', 'host.example.com')
+        hits = Machine.get_by_addr_stats()['reverse_dns']['hits']
+        self.assertEqual(Machine.get_by_addr('10.0.0.2'), self.machine)
+        self.assertEqual(Machine.get_by_addr_stats()['reverse_dns']['hits'], hits + 1)
 
+    def test_invalidation(self):
+        self.assertEqual(Machine.get_by_addr('10.0.0.1', filter_up=True), self.machine)
+        self.machine.up = False
+        self.machine.save()
+        self.assertEqual(Machine.get_by_addr('10.0.0.1', filter_up=True), None)
+        other = Machine.objects.create(fqdn='other.example.com', up=True)
+        self.assertEqual(Machine.get_by_addr('10.0.0.1'), self.machine)
+        Interface.objects.filter(machine=self.machine).update(machine=other)
+        self.assertCached('10.0.0.1', self.machine)
+        self.ip.save()
+        self.assertEqual(Machine.get_by_addr('10.0.0.1'), other)
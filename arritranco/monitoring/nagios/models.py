@@ -2,7 +2,7 @@
 from django.db import models
 from django.db.models.signals import post_save
 from django.conf import settings
-from scheduler.models import TaskStatus
+from scheduler.models import TaskCheck, TaskStatus, statuses_stored, BULK_STATUS_BATCH_SIZE
 from nsca import NSCA
 from django.utils.translation import ugettext_lazy as _
 from network.models import Network, IP
@@ -282,19 +282,38 @@ class NagiosNetworkParent(models.Model):
         return ', '.join(nagios_parents)
 
 
+def send_task_statuses(statuses):
+    """Sends the TaskStatus of backup tasks to nagios, all of them with a single NSCA call."""
+    check_ids = list(set(status.task_check_id for status in statuses))
+    tasks = {}
+    for i in range(0, len(check_ids), BULK_STATUS_BATCH_SIZE):
+        for check in TaskCheck.objects.filter(pk__in=check_ids[i:i + BULK_STATUS_BATCH_SIZE]).select_related(
+                'task__backuptask__machine'):
+            tasks[check.pk] = check.task
+    nsca = NSCA()
+    for status in statuses:
+        task = tasks.get(status.task_check_id)
+        if task is not None and hasattr(task, 'backuptask'):
+            status_code = HUMAN_TO_NAGIOS[status.status]
+            nsca.add_custom_status(task.backuptask.machine.fqdn, nagios_safe(task.description), status_code,
+                                   status.comment or '')
+    if nsca.nagios_status:
+        nsca.send()
+
+
 def propagate_status(sender, **kwargs):
     if not settings.PROPAGATE_STATUS_TO_NAGIOS:
         return
     if kwargs['raw']:
         return
+    send_task_statuses([kwargs['instance']])
 
-    status = kwargs['instance']
-    task = status.task_check.task
-    if hasattr(task, 'backuptask'):
-        nsca = NSCA()
-        status_code = HUMAN_TO_NAGIOS[status.status]
-        nsca.add_custom_status(task.backuptask.machine.fqdn, nagios_safe(task.description), status_code, status.comment)
-        nsca.send()
+
+def propagate_statuses(sender, statuses, **kwargs):
+    """Statuses stored in bulk, without post_save."""
+    if not settings.PROPAGATE_STATUS_TO_NAGIOS:
+        return
+    send_task_statuses(statuses)
 
 
 def assign_default_checks(sender, **kwargs):
@@ -321,5 +340,6 @@ def assign_default_checks(sender, **kwargs):
                     machineCheckOpts.save()
 
 post_save.connect(propagate_status, sender=TaskStatus)
+statuses_stored.connect(propagate_statuses, sender=TaskStatus, dispatch_uid="propagate_statuses")
 
 
@@ -0,0 +1,59 @@
+import datetime
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from backups.models import FileBackupTask
+from inventory.models import Machine
+from monitoring.nagios import models as nagios_models
+from scheduler.models import Task, TaskCheck
+
+
+class FakeNSCA(object):
+    sent = []
+
+    def __init__(self):
+        self.nagios_status = []
+
+    def add_custom_status(self, host, service, status, message):
+        self.nagios_status.append((host, service, status, message))
+
+    def send(self):
+        FakeNSCA.sent.append(self.nagios_status)
+
+
+@override_settings(PROPAGATE_STATUS_TO_NAGIOS=True)
+class PropagateStatusTest(TestCase):
+    def setUp(self):
+        machine = Machine.objects.create(fqdn='host.example.com', up=True)
+        self.backup = FileBackupTask.objects.create(minute='0', hour='3', checker_fqdn='checker1', machine=machine,
+                                                    directory='/backups', description='backup')
+        self.other = Task.objects.create(minute='0', hour='5', description='other')
+        self.time = datetime.datetime(2014, 5, 1, 3, 0)
+        self.nsca = nagios_models.NSCA
+        nagios_models.NSCA = FakeNSCA
+        FakeNSCA.sent = []
+
+    def tearDown(self):
+        nagios_models.NSCA = self.nsca
+
+    def test_bulk(self):
+        send_task_statuses = nagios_models.send_task_statuses
+        calls = []
+        nagios_models.send_task_statuses = lambda statuses: calls.append([s.status for s in statuses])
+        try:
+            TaskCheck.objects.bulk_update_status([(self.backup.pk, self.time, 'Ok', 'found')])
+        finally:
+            nagios_models.send_task_statuses = send_task_statuses
+        self.assertEqual(calls, [['Ok']])
+
+    def test_single_send(self):
+        TaskCheck.objects.bulk_update_status([
+            (self.backup.pk, self.time, 'Warning', 'small'),
+            (self.other.pk, self.time, 'Ok', 'found'),
+            (self.backup.pk, self.time, 'Critical', None),
+        ])
+        self.assertEqual(FakeNSCA.sent, [[('host.example.com', 'backup', nagios_models.NAGIOS_WARNING, 'small'),
+                                          ('host.example.com', 'backup', nagios_models.NAGIOS_CRITICAL, '')]])
+        self.backup.update_status(self.time, 'Ok', 'found')
+        self.assertEqual(FakeNSCA.sent[-1], [('host.example.com', 'backup', nagios_models.NAGIOS_OK, 'found')])
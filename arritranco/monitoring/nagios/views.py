@@ -9,7 +9,7 @@ logger = logging.getLogger(__name__)
 from nsca import NSCA
 from models import Service, NagiosCheck, NagiosMachineCheckOpts, NagiosNetworkParent, HUMAN_TO_NAGIOS, \
     NagiosServiceCheckOpts, NagiosUnrackableNetworkedDeviceCheckOpts, NagiosHardwarePolicyCheckOpts
-from scheduler.models import TaskStatus, TaskCheck
+from scheduler.models import TaskStatus, TaskCheck, TaskState
 from templatetags.nagios_filters import nagios_safe
 from inventory.models import Machine, PhysicalMachine
 from hardware.models import UnrackableNetworkedDevice
@@ -97,13 +97,14 @@ def backup_checks(request):
 def refresh_nagios_status(request):
     logger.debug('Refreshing nagios status')
     nsca = NSCA()
-    for bt in BackupTask.objects.filter(active=True, machine__up=True):
-        try:
-            tch = TaskCheck.objects.filter(task=bt).order_by('-task_time')[0]
-        except IndexError:
+    backup_tasks = BackupTask.objects.filter(active=True, machine__up=True)
+    states = TaskState.objects.filter(task__in=backup_tasks.values('pk')).select_related('last_status')
+    states = dict((state.task_id, state) for state in states)
+    for bt in backup_tasks.select_related('machine'):
+        if bt.pk not in states:
             logger.debug('There is no TaskCheck for %s', bt)
             continue
-        status = tch.last_status
+        status = states[bt.pk].last_status
         if isinstance(status, TaskStatus):
             logger.debug('Last status for %s: %s is %s (%s)', bt, bt.description, status, status.check_time)
             logger.debug('Human to nagios de %s es %d' % (status.status, HUMAN_TO_NAGIOS[status.status]))
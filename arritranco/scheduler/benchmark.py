@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+Scheduler benchmarks.
+
+Builds synthetic Task and FileBackupTask populations in a throwaway SQLite
+database and times the scheduler code paths and the todo endpoints, counting
+the queries done by each one. Results are written as JSON, so runs of
+different versions can be compared.
+
+Run it from the project directory (the configured database is never used):
+
+    python -m scheduler.benchmark --sizes 1000,10000,50000 --output benchmark.json
+"""
+
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+DEFAULT_SIZES = '1000,10000,50000'
+
+# Fixed reference time, so every run expands the same executions
+NOW = datetime.datetime(2014, 5, 1, 12, 0)
+
+# Part of the population that are FileBackupTasks, the rest are plain Tasks
+FILE_BACKUP_RATIO = 0.5
+
+# File backup tasks per machine
+TASKS_PER_MACHINE = 5
+
+# (weight, cron template) pairs, each template is called with a random.Random
+CRON_MIX = (
+    (50, lambda r: (str(r.randint(0, 59)), str(r.randint(0, 23)), '*', '*', '*')),  # daily
+    (15, lambda r: (str(r.randint(0, 59)), str(r.randint(0, 6)), '*', '*', '1-5')),  # working days
+    (15, lambda r: (str(r.randint(0, 59)), str(r.randint(0, 23)), '*', '*', str(r.randint(0, 6)))),  # weekly
+    (8, lambda r: (str(r.randint(0, 59)), '%d,%d' % (r.randint(0, 11), r.randint(12, 23)), '*', '*', '*')),
+    (7, lambda r: (str(r.randint(0, 59)), str(r.randint(0, 23)), str(r.randint(1, 28)), '*', '*')),  # monthly
+    (3, lambda r: ('0', '*/%d' % r.choice((2, 4, 6)), '*', '*', '*')),
+    (2, lambda r: ('*/%d' % r.choice((10, 15, 30)), '*', '*', '*', '*')),
+)
+
+
+def random_cron(rnd):
+    """(minute, hour, monthday, month, weekday) following CRON_MIX."""
+    n = rnd.randint(1, sum(weight for weight, template in CRON_MIX))
+    for weight, template in CRON_MIX:
+        n -= weight
+        if n <= 0:
+            return template(rnd)
+
+
+def use_database(path):
+    """Points the default database to a new SQLite file and creates every table there."""
+    from django.conf import settings
+    from django.core.management import call_command
+    from django.db import connections
+
+    connection = connections['default']
+    connection.close()
+    connection.settings_dict['NAME'] = path
+    settings.DATABASES['default']['NAME'] = path
+    call_command('syncdb', migrate_all=True, migrate=False, interactive=False, load_initial_data=False,
+                 verbosity=0)
+
+
+def _insert(model, objs):
+    """Inserts the local fields of model for objs (which have their pk set) without calling save()."""
+    from django.db import connection
+
+    qn = connection.ops.quote_name
+    fields = model._meta.local_fields
+    sql = "INSERT INTO %s (%s) VALUES (%s)" % (qn(model._meta.db_table), ', '.join(qn(f.column) for f in fields),
+                                               ', '.join(['%s'] * len(fields)))
+    connection.cursor().executemany(sql, [[f.get_db_prep_save(f.pre_save(obj, True), connection) for f in fields]
+                                          for obj in objs])
+
+
+def populate(size, seed):
+    """Creates size tasks, FILE_BACKUP_RATIO of them FileBackupTasks spread over machines."""
+    from django.conf import settings
+    from django.db import transaction
+    from backups.models import BackupTask, FileBackupTask
+    from inventory.models import Machine
+    from scheduler.models import Task
+
+    rnd = random.Random(seed)
+    checkers = [fqdn for fqdn, name in settings.FILE_BACKUP_CHECKERS] or ['checker.example.com']
+    file_backups = int(size * FILE_BACKUP_RATIO)
+    machines = [Machine(id=i, fqdn='host%06d.example.com' % i, up=True)
+                for i in range(1, file_backups // TASKS_PER_MACHINE + 2)]
+    tasks = []
+    backup_tasks = []
+    for i in range(1, size + 1):
+        minute, hour, monthday, month, weekday = random_cron(rnd)
+        fields = dict(id=i, minute=minute, hour=hour, monthday=monthday, month=month, weekday=weekday,
+                      description='Task %d' % i, active=rnd.random() > 0.05)
+        if i <= file_backups:
+            machine = machines[(i - 1) // TASKS_PER_MACHINE]
+            backup_tasks.append(FileBackupTask(
+                task_ptr_id=i, backuptask_ptr_id=i, machine_id=machine.pk, checker_fqdn=rnd.choice(checkers),
+                directory='/backups/%s/%d' % (machine.fqdn, i), **fields))
+        else:
+            tasks.append(Task(**fields))
+    with transaction.atomic():
+        Machine.objects.bulk_create(machines, batch_size=500)
+        _insert(Task, tasks + backup_tasks)
+        _insert(BackupTask, backup_tasks)
+        _insert(FileBackupTask, backup_tasks)
+
+
+def measure(name, func, repeat):
+    """Runs func repeat times, returning its timings and the queries of the first run."""
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    seconds = []
+    queries = None
+    for i in range(repeat):
+        with CaptureQueriesContext(connection) as context:
+            start = time.time()
+            func()
+            seconds.append(time.time() - start)
+        if queries is None:
+            queries = len(context)
+    return {
+        'name': name,
+        'seconds': seconds,
+        'min': min(seconds),
+        'median': sorted(seconds)[len(seconds) // 2],
+        'queries': queries,
+    }
+
+
+def run(size, repeat, seed, horizon_days):
+    """Every benchmark for a population of size tasks."""
+    from croniter import croniter
+    from django.test.client import Client
+    from backups.models import FileBackupTask
+    from scheduler.cron import SimpleCrontabEntry
+    from scheduler.models import Task, TaskOccurrence
+
+    populate(size, seed)
+    end = NOW + datetime.timedelta(days=1)
+    tasks = list(Task.objects.all())
+    expressions = [task.cron_syntax() for task in tasks]
+    client = Client()
+    window = '?start_time=%d&end_time=%d' % (time.mktime(NOW.timetuple()), time.mktime(end.timetuple()))
+
+    def get(url):
+        response = client.get(url + window, HTTP_ACCEPT='application/json')
+        assert response.status_code == 200, response.status_code
+
+    def task_runs():
+        for task in tasks:
+            task.next_run(NOW)
+            task.last_run(NOW)
+
+    def crontab_entry():
+        for expression in expressions:
+            entry = SimpleCrontabEntry(expression)
+            entry.next_run(NOW)
+            entry.prev_run(NOW)
+
+    def croniter_runs():
+        for expression in expressions:
+            croniter(expression, NOW).get_next(datetime.datetime)
+            croniter(expression, NOW).get_prev(datetime.datetime)
+
+    results = [
+        measure('Task.next_run/last_run', task_runs, repeat),
+        measure('SimpleCrontabEntry', crontab_entry, repeat),
+        measure('croniter', croniter_runs, repeat),
+    ]
+    for suffix in ('', ' (materialized)'):
+        results.extend([
+            measure('Task.objects.todo' + suffix, lambda: Task.objects.todo(NOW, end), repeat),
+            measure('FileBackupTask.objects.todo' + suffix, lambda: FileBackupTask.objects.todo(NOW, end), repeat),
+            measure('/rest/scheduler/todo/' + suffix, lambda: get('/rest/scheduler/todo/'), repeat),
+            measure('/rest/backup/todo/' + suffix, lambda: get('/rest/backup/todo/'), repeat),
+        ])
+        if not suffix:
+            results.append(measure('TaskOccurrence.objects.roll',
+                                   lambda: TaskOccurrence.objects.roll(NOW, days=horizon_days), 1))
+    for result in results:
+        result['size'] = size
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.STDOUT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = OptionParser(usage='python -m scheduler.benchmark [options]')
+    parser.add_option('--sizes', dest='sizes', default=DEFAULT_SIZES,
+                      help='comma separated task population sizes [%default]')
+    parser.add_option('--repeat', dest='repeat', type='int', default=3, help='runs of each benchmark [%default]')
+    parser.add_option('--seed', dest='seed', type='int', default=2014, help='random seed [%default]')
+    parser.add_option('--horizon-days', dest='horizon_days', type='int', default=2,
+                      help='days of materialized occurrences around the reference time [%default]')
+    parser.add_option('--output', dest='output', default=None, help='JSON results file [stdout]')
+    options, args = parser.parse_args(argv)
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "arritranco.settings")
+    from django.conf import settings
+    # Before anything opens a connection to the configured database
+    settings.DATABASES = {'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ''}}
+    import django
+    from django.test.utils import setup_test_environment
+    # Lets the test client reach the endpoints whatever ALLOWED_HOSTS is
+    setup_test_environment()
+
+    directory = tempfile.mkdtemp(prefix='arritranco-benchmark-')
+    results = []
+    try:
+        for size in [int(s) for s in options.sizes.split(',')]:
+            use_database(os.path.join(directory, 'benchmark-%d.db' % size))
+            results.extend(run(size, options.repeat, options.seed, options.horizon_days))
+            sys.stderr.write('%d tasks done\n' % size)
+    finally:
+        from django.db import connection
+        connection.close()
+        shutil.rmtree(directory)
+
+    report = {
+        'created': datetime.datetime.now().isoformat(),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'reference_time': NOW.isoformat(),
+        'seed': options.seed,
+        'results': results,
+    }
+    output = open(options.output, 'w') if options.output else sys.stdout
+    try:
+        json.dump(report, output, indent=2)
+        output.write('\n')
+    finally:
+        if options.output:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -20,14 +20,24 @@
 
 import re
 import datetime
+import logging
+from bisect import bisect_left, bisect_right
 from calendar import monthrange
 
+logger = logging.getLogger(__name__)
+
+ONE_MINUTE = datetime.timedelta(minutes=1)
+
+# Give up searching for an execution after this many years (e.g. "0 0 30 2 *").
+MAX_SEARCH_YEARS = 10
+
 
 class SimpleCrontabEntry(object):
     """Contrab-like parser.
 
     Only deals with the first 5 fields of a normal crontab
-    entry."""
+    entry. Every field is kept as a sorted list of values, so next
+    and previous executions are found with binary searches."""
 
     def __init__(self, entry, expiration=0):
         self.__setup_timespec()
@@ -38,7 +48,7 @@ class SimpleCrontabEntry(object):
         self.expiration = datetime.timedelta(minutes=val)
 
     def set_value(self, entry):
-        self.data = entry
+        self.data = self.special.get(entry.strip(), entry)
         fields = re.findall("\S+", self.data)
         if len(fields) != 5:
             raise ValueError("Crontab entry needs 5 fields")
@@ -51,6 +61,7 @@ class SimpleCrontabEntry(object):
         }
         if not self._is_valid():
             raise ValueError("Bad Entry: %s" % entry)
+        self._compile(fields)
 
     #### HERE BEGINS THE CODE BORROWED FROM gnome-schedule ###
     def __setup_timespec(self):
@@ -212,337 +223,172 @@ class SimpleCrontabEntry(object):
             for typ, exp in self.fields.items():
                 self.checkfield(exp, typ)
         except ValueError, (specific, caused, explanation):
-            print "PROBLEM TYPE: %s, ON FIELD: %s -> %s " % (specific, caused, explanation)
-            return False
-        return True
-
-    def __next_time(self, time_list, time_now):
-        """Little helper function to find next element on the list"""
-        #        print "__next_time", time_list, time_now
-        tmp = [x for x in time_list if x >= time_now]
-        #        print "tmp", tmp
-        carry = False
-        if len(tmp) == 0:
-            carry = True
-            sol = time_list[0]
-        else:
-            if not carry:
-                sol = tmp[0]
-            else:
-                if len(tmp) == 1:
-                    carry = True
-                    sol = time_list[0]
-                else:
-                    carry = False
-                    sol = tmp[1]
-        return sol, carry
-
-    def __prev_time(self, time_list, item):
-        """Little helper function to find next element on the list"""
-        #        print "time_list: %s" % time_list
-        #        print "item: %s" % item
-        pos = time_list.index(item)
-        #        print "pos: %s" % pos
-        elem = time_list[pos - 1]
-        #        print "elem: %s" % elem
-        carry = elem >= time_list[pos]
-        return elem, carry
-
-    def __next_month(self, month, sol):
-        """Find next month of execution given the month arg. If month
-        is different than current calls all the other __next_*
-        functions to set up the time."""
-
-        sol['month'], carry = self.__next_time(self.fields['month'], month)
-        if carry:
-            sol['year'] += 1
-        if sol['month'] != month:
-            self.__next_day(1, sol)
-            self.__next_hour(0, sol)
-            self.__next_minute(0, sol)
-            return False
-        return True
-
-    def __next_minute(self, minute, sol):
-        """Find next minute of execution given the minute arg."""
-        sol['minute'], carry = self.__next_time(self.fields['minute'], minute)
-        if carry:
-            self.__next_hour(sol['hour'] + 1, sol)
-        return True
-
-    def __next_hour(self, hour, sol):
-        """Find next hour of execution given the hour arg. If hour is
-        different than current calls the __next_hour function to set
-        up the minute """
-        #        print "__next_hour", hour, sol
-        sol['hour'], carry = self.__next_time(self.fields['hour'], hour)
-        #        print "sol['hour']", sol['hour'], "carry", carry
-        if carry:
-            self.__next_day(sol['day'] + 1, sol)
-        if sol['hour'] != hour:
-            self.__next_minute(0, sol)
-            return False
-        return True
-
-    #el weekday se calcula a partir del dia, el mes y ao dentro de sol
-    def __next_day(self, day, sol):
-        """Find next day of execution given the day and the month/year
-        information held on the sol arg. If day is different than
-        current calls __next_hour and __next_minute functions to set
-        them to the correct values"""
-
-        while True:
-            try:
-                now = datetime.date(sol['year'], sol['month'], day)
-                # first calculate day
-                day_tmp, day_carry = self.__next_time(self.fields['day'], day)
-                #                print "day_tmp", day_tmp
-                #                print "day_carry", day_carry
-                day_diff = datetime.date(sol['year'], sol['month'], day_tmp) - now
-                #                print "day_diff", day_diff
-                break
-            except ValueError:
-                self.__next_month(sol['month'] + 1, sol)
-                day = 1
-                now = datetime.date(sol['year'], sol['month'], day)
-
-        # The way is handled on the system is monday = 0, but for crontab sunday =0
-        weekday = now.weekday() + 1
-
-        # if we have all days but we don't have all weekdays we need to
-        # perform different
-        if len(self.fields['day']) == 31 and len(self.fields['weekday']) != 8:
-            #            print "Entra el colega por aqui ...."
-            weekday_tmp, weekday_carry = self.__next_time(self.fields['weekday'], weekday)
-            # Both 0 and 7 represent sunday
-            weekday_tmp -= 1
-            if weekday_tmp < 0: weekday_tmp = 6
-            weekday_diff = datetime.timedelta(days=weekday_tmp - (weekday - 1))
-            if weekday_carry:
-                weekday_diff += datetime.timedelta(weeks=1)
-            weekday_next_month = (now + weekday_diff).month != now.month
-            #            print "weekday_next_month", weekday_next_month
-            # If next weekday is not on the next month
-            if not weekday_next_month:
-                #                print "weekday_diff", weekday_diff
-                #                print "now", now
-                sol['day'] = (now + weekday_diff).day
-                #                print "sol['day']", sol['day'], "day", day
-                #                print "sol['month']", sol['month'], "day", day
-                if sol['day'] != day:
-                    self.__next_hour(0, sol)
-                    self.__next_minute(0, sol)
-                    return False
-                return True
-            else:
-                flag = self.__next_month(sol['month'] + 1, sol)
-                if flag:
-                    #                    print "flag!"
-                    #return self.__next_day(1, sol)
-                    self.__next_day(1, sol)
-                    self.__next_hour(0, sol)
-                    self.__next_minute(0, sol)
-                    #return False
-                return False
-
-        # if we don't have all the weekdays means that we need to use
-        # them to calculate next day
-        if len(self.fields['weekday']) != 8:
-            weekday_tmp, weekday_carry = self.__next_time(self.fields['weekday'], weekday)
-            # Both 0 and 7 represent sunday
-            weekday_tmp -= 1
-            if weekday_tmp < 0: weekday_tmp = 6
-            weekday_diff = datetime.timedelta(days=weekday_tmp - (weekday - 1))
-            if weekday_carry:
-                weekday_diff += datetime.timedelta(weeks=1)
-            weekday_next_month = (now + weekday_diff).month != now.month
-            # If next weekday is not on the next month
-            if not weekday_next_month:
-                #  If the next day is on other month, the next weekday
-                #  is closer to happen so is what we choose
-                if day_carry:
-                    sol['day'] = (now + weekday_diff).day
-                    if sol['day'] != day:
-                        self.__next_hour(0, sol)
-                        self.__next_minute(0, sol)
-                        return False
-                    return True
-                else:
-                    # Both day and weekday are good candidates, let's
-                    # find out who is going to happen
-                    # sooner
-                    diff = min(day_diff, weekday_diff)
-                    sol['day'] = (now + diff).day
-                    if sol['day'] != day:
-                        self.__next_hour(0, sol)
-                        self.__next_minute(0, sol)
-                        return False
-                    return True
-
-        sol['day'] = day_tmp
-        if day_carry:
-            self.__next_month(sol['month'] + 1, sol)
-        if sol['day'] != day:
-            self.__next_hour(0, sol)
-            self.__next_minute(0, sol)
+            logger.debug("PROBLEM TYPE: %s, ON FIELD: %s -> %s ", specific, caused, explanation)
             return False
         return True
 
-
-    def next_run(self, time=datetime.datetime.now()):
-        """Calculates when will the next execution be."""
-        sol = {'minute': 0, 'hour': 0, 'day': 0, 'month': 0, 'year': time.year}
-        # next_month if calculated first as next_day depends on
-        # it. Also if next_month is different than time.month the
-        # function will set up the rest of the fields
-        self.__next_month(time.month, sol) and \
-        self.__next_day(time.day, sol) and \
-        self.__next_hour(time.hour, sol) and \
-        self.__next_minute(time.minute, sol)
-        return datetime.datetime(sol['year'], sol['month'], sol['day'], sol['hour'], sol['minute'])
-
-    def prev_run(self, time=datetime.datetime.now()):
-        """Calculates when the previous execution was."""
-        base = self.next_run(time)
-        #        print "Ya se ha calculado la siguente vez: %s" % base
-        # minute
-        prev_minute, carry = self.__prev_time(self.fields['minute'], base.minute)
-        min_diff = datetime.timedelta(minutes=(base.minute - prev_minute))
-        base -= min_diff
-        if not carry:
-            return base
-
-        # hour
-        prev_hour, carry = self.__prev_time(self.fields['hour'], base.hour)
-        hour_diff = datetime.timedelta(hours=(base.hour - prev_hour))
-        base -= hour_diff
-        if not carry:
-            return base
-
-        tmp_base = base
-        previous_months = False
-        while True:
-            # day
-            while True:
-                try:
-                    #                    print "__prev_time day"
-                    prev_day, carry_day = self.__prev_time(self.fields['day'], tmp_base.day)
-                    #                    print "prev_day", prev_day
-                    #                    print "carry_day", carry_day
-                    break
-                except ValueError:
-                    tmp_base -= datetime.timedelta(days=1)
-                #            print "base.day", base.day
-                #            print "base.month", base.month
-                #            print "prev_day", prev_day
-                #            print "carry_day", carry_day
-            if carry_day:
-                #                if base.month <= 11:
-                #                    no_days = monthrange(base.year, base.month + 1)[1]
-                #                else:
-                #                    no_days = monthrange(base.year + 1, 1)[1]
-                if (base.month == 1):
-                    no_days = monthrange(base.year - 1, 12)[1]
-                    carry_day = False
-                else:
-                    no_days = monthrange(base.year, base.month - 1)[1]
-                #                print "no_days", no_days
-                #                print "dias de diferencia:", no_days - prev_day + base.day
-                day_diff = datetime.timedelta(days=(no_days - prev_day + base.day))
-            else:
-                day_diff = datetime.timedelta(days=(base.day - prev_day))
-            #            print "day_diff", day_diff
-
-            prev_weekday, carry_weekday = self.__prev_time(self.fields['weekday'], base.weekday() + 1)
-            #            print "prev_weekday: %s" % prev_weekday
-            #            print "carry_weekday: %s" % carry_weekday
-
-            # if we have all days but we don't have all weekdays we need to
-            # perform different
-            if len(self.fields['day']) == 31 and len(self.fields['weekday']) != 8:
-                # Both 0 and 7 represent sunday
-                #                print "Entrando por los dias raros estos ..."
-                prev_weekday -= 1
-                if prev_weekday < 0: prev_weekday = 6
-
-                if carry_weekday:
-                    day_diff = datetime.timedelta(days=7 + base.weekday() - prev_weekday)
-                    #                    print "day_diff: %s" % day_diff
-                    carry = base.month != (base - day_diff).month
-                #                    print "carry: %s" % carry
-                else:
-                    weekday_diff = datetime.timedelta(days=base.weekday() - prev_weekday)
-                    # weekday no es en el otro mes
-                    day_diff = max([day_diff, weekday_diff])
-                    carry = False
-
-            elif len(self.fields['weekday']) != 8:
-                # Both 0 and 7 represent sunday
-                prev_weekday -= 1
-                if prev_weekday < 0: prev_weekday = 6
-                weekday_diff = datetime.timedelta(days=base.weekday() - prev_weekday)
-
-                if carry_weekday:
-                    weekday_diff += datetime.timedelta(weeks=1)
-                    if carry_day:
-                        # ambos son el otro mes
-                        day_diff = max([day_diff, weekday_diff])
-                        carry = True
-                    else:
-                        # el day simple esta en el mismo mes y el weekday en otro
-                        pass
-                else:
-                    # weekday no es en el otro mes
-                    if carry_day:
-                        # el day esta en el otro mes y el weekday no
-                        prev_day = weekday_diff
-                        carry = False
-                    else:
-                        # ambos estan el el mero mes
-                        day_diff = min([day_diff, weekday_diff])
-                        carry = False
-
-            else:
-                carry = carry_day
-
-            #            print "day_diff", day_diff
-            #            print "base", base
-            base -= day_diff
-            #            print "base", base
-            #            print "carry", carry
-            if not carry:
-                return base
-
-            # month
-            try:
-                if not previous_months:
-                    #                    print "Mes anterior cuidado -----------------------------------------------------"
-                    #                    print "base: %s    base.month: %s" % (base, base.month)
-                    #                    print "tmp_base: %s    tmp_base.month: %s" % (tmp_base, tmp_base.month)
-                    prev_month, carry = self.__prev_time(self.fields['month'], tmp_base.month)
-                    #                    print "prev_month: %s   carry: %s" % (prev_month, carry)
-                    month_diff = datetime.date(base.year, base.month, base.day) - \
-                                 datetime.date(not carry and base.year or base.year - 1, prev_month, base.day)
-                    #                    print "month_diff: %s" % month_diff
-                    #                    print "Base: %s" % base
-                    base -= month_diff
-                #                    print "Base menos month_diff: %s" % base
-                #                    print "---------------------------------------------------------------------------"
+    def _compile(self, fields):
+        """Precomputes the sorted arrays used by the binary searches."""
+        self.minutes = sorted(set(self.fields['minute']))
+        self.hours = sorted(set(self.fields['hour']))
+        self.days = sorted(set(self.fields['day']))
+        self.months = sorted(set(self.fields['month']))
+        # Both 0 and 7 represent sunday
+        weekdays = set(w % 7 for w in self.fields['weekday'])
+        # As in cron, when both day fields are restricted a day matches either of them
+        self.day_restricted = fields[2] != '*'
+        self.weekday_restricted = fields[4] != '*'
+        # Days to add to a crontab weekday (sunday = 0) to reach the next/previous allowed one
+        self.weekday_next = []
+        self.weekday_prev = []
+        for w in range(7):
+            self.weekday_next.append(min((x - w) % 7 for x in weekdays))
+            self.weekday_prev.append(min((w - x) % 7 for x in weekdays))
+
+    def __next_day(self, year, month, day):
+        """First day of execution >= day in the month, or None."""
+        days_in_month = monthrange(year, month)[1]
+        if day > days_in_month:
+            return None
+        candidates = []
+        if self.day_restricted or not self.weekday_restricted:
+            i = bisect_left(self.days, day)
+            if i < len(self.days) and self.days[i] <= days_in_month:
+                candidates.append(self.days[i])
+        if self.weekday_restricted:
+            weekday = (datetime.date(year, month, day).weekday() + 1) % 7
+            next_day = day + self.weekday_next[weekday]
+            if next_day <= days_in_month:
+                candidates.append(next_day)
+        if candidates:
+            return min(candidates)
+        return None
+
+    def __prev_day(self, year, month, day):
+        """Last day of execution <= day in the month, or None."""
+        day = min(day, monthrange(year, month)[1])
+        candidates = []
+        if self.day_restricted or not self.weekday_restricted:
+            i = bisect_right(self.days, day)
+            if i:
+                candidates.append(self.days[i - 1])
+        if self.weekday_restricted:
+            weekday = (datetime.date(year, month, day).weekday() + 1) % 7
+            prev_day = day - self.weekday_prev[weekday]
+            if prev_day >= 1:
+                candidates.append(prev_day)
+        if candidates:
+            return max(candidates)
+        return None
+
+    def _next(self, time):
+        """First execution at or after time (seconds are ignored)."""
+        year, month, day, hour, minute = time.year, time.month, time.day, time.hour, time.minute
+        limit = year + MAX_SEARCH_YEARS
+        while year <= limit:
+            i = bisect_left(self.months, month)
+            if i == len(self.months):
+                year, month, day, hour, minute = year + 1, self.months[0], 1, 0, 0
+                continue
+            if self.months[i] != month:
+                month, day, hour, minute = self.months[i], 1, 0, 0
+            next_day = self.__next_day(year, month, day)
+            if next_day is None:
+                year, month, day, hour, minute = year + month // 12, month % 12 + 1, 1, 0, 0
+                continue
+            if next_day != day:
+                day, hour, minute = next_day, 0, 0
+            i = bisect_left(self.hours, hour)
+            if i == len(self.hours):
+                day, hour, minute = day + 1, 0, 0
+                continue
+            if self.hours[i] != hour:
+                hour, minute = self.hours[i], 0
+            i = bisect_left(self.minutes, minute)
+            if i == len(self.minutes):
+                hour, minute = hour + 1, 0
+                continue
+            return datetime.datetime(year, month, day, hour, self.minutes[i])
+        raise ValueError("No execution found for %s" % self.data)
+
+    def _prev(self, time):
+        """Last execution at or before time (seconds are ignored)."""
+        year, month, day, hour, minute = time.year, time.month, time.day, time.hour, time.minute
+        limit = year - MAX_SEARCH_YEARS
+        while year >= limit:
+            i = bisect_right(self.months, month)
+            if i == 0:
+                year, month, day, hour, minute = year - 1, self.months[-1], 31, 23, 59
+                continue
+            if self.months[i - 1] != month:
+                month, day, hour, minute = self.months[i - 1], 31, 23, 59
+            prev_day = self.__prev_day(year, month, day)
+            if prev_day is None:
+                if month == 1:
+                    year, month = year - 1, 12
                 else:
-                    base = tmp_base
-                break
-            except ValueError:
-                tmp_base -= datetime.timedelta(days=tmp_base.day)
-                previous_months = True
-
-        return base
-
-
-    def is_expired(self, time=datetime.datetime.now()):
+                    month -= 1
+                day, hour, minute = 31, 23, 59
+                continue
+            if prev_day != day:
+                day, hour, minute = prev_day, 23, 59
+            i = bisect_right(self.hours, hour)
+            if i == 0:
+                day, hour, minute = day - 1, 23, 59
+                if day == 0:
+                    # __prev_day will carry to the previous month
+                    day, month = 31, month - 1
+                    if month == 0:
+                        year, month = year - 1, 12
+                continue
+            if self.hours[i - 1] != hour:
+                hour, minute = self.hours[i - 1], 59
+            i = bisect_right(self.minutes, minute)
+            if i == 0:
+                hour, minute = hour - 1, 59
+                if hour < 0:
+                    day, hour = day - 1, 23
+                    if day == 0:
+                        day, month = 31, month - 1
+                        if month == 0:
+                            year, month = year - 1, 12
+                continue
+            return datetime.datetime(year, month, day, hour, self.minutes[i - 1])
+        raise ValueError("No execution found for %s" % self.data)
+
+    def next_run(self, time=None):
+        """Calculates when will the next execution be (time itself included)."""
+        if time is None:
+            time = datetime.datetime.now()
+        return self._next(time)
+
+    def prev_run(self, time=None):
+        """Calculates when the previous execution was (time itself excluded)."""
+        if time is None:
+            time = datetime.datetime.now()
+        return self._prev(time.replace(second=0, microsecond=0) - ONE_MINUTE)
+
+    def iter_runs(self, start, end):
+        """Generates the executions from start (included) to end (excluded) in order."""
+        run = self._next(start)
+        while run < end:
+            yield run
+            run = self._next(run + ONE_MINUTE)
+
+    def iter_runs_reverse(self, end, start):
+        """Generates the executions before end and since start (included) in reverse order."""
+        run = self.prev_run(end)
+        while run >= start:
+            yield run
+            run = self._prev(run - ONE_MINUTE)
+
+    def is_expired(self, time=None):
         """If the expiration parameter has been set this will check
         wether too much time has been since the cron-entry. If the
         expiration has not been set, it throws ValueError."""
-        if self.expiration == 0:
+        if time is None:
+            time = datetime.datetime.now()
+        if not self.expiration:
             raise ValueError("Missing argument",
                              "Expiration time has not been set")
         next_beg = self.next_run(time)
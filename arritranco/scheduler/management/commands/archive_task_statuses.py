@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from scheduler.models import TaskStatus, TASK_STATUS_RETENTION_DAYS, TASK_STATUS_ARCHIVE_FILE
+from optparse import make_option
+import datetime
+
+
+class Command(BaseCommand):
+    args = ''
+    help = 'Archives old task statuses, counting them into the daily rollup'
+    option_list = BaseCommand.option_list + (
+        make_option('--days',
+                    dest='days',
+                    type='int',
+                    default=TASK_STATUS_RETENTION_DAYS,
+                    help='archive the statuses older than this number of days'),
+        make_option('--file',
+                    dest='file',
+                    default=TASK_STATUS_ARCHIVE_FILE,
+                    help='gzipped JSON lines file (strftime format) to archive to instead of the archive table'),
+    )
+
+    def handle(self, *args, **options):
+        before = datetime.datetime.now() - datetime.timedelta(days=options['days'])
+        archived = TaskStatus.objects.archive(before, options['file'])
+        self.stdout.write('%d task statuses older than %s archived' % (archived, before))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from scheduler.models import TaskOccurrence, TASK_OCCURRENCE_HORIZON_DAYS
+from optparse import make_option
+
+
+class Command(BaseCommand):
+    args = ''
+    help = 'Moves the materialized task occurrences horizon forward'
+    option_list = BaseCommand.option_list + (
+        make_option('--days',
+                    dest='days',
+                    type='int',
+                    default=TASK_OCCURRENCE_HORIZON_DAYS,
+                    help='days before and after now to materialize'),
+    )
+
+    def handle(self, *args, **options):
+        horizon = TaskOccurrence.objects.roll(days=options['days'])
+        self.stdout.write('Task occurrences materialized from %s to %s' % (horizon.start_time, horizon.end_time))
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'TaskState'
+        db.create_table(u'scheduler_taskstate', (
+            ('task', self.gf('django.db.models.fields.related.OneToOneField')(related_name='state', unique=True, primary_key=True, to=orm['scheduler.Task'])),
+            ('task_check', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['scheduler.TaskCheck'], null=True, on_delete=models.SET_NULL)),
+            ('task_time', self.gf('django.db.models.fields.DateTimeField')(null=True, blank=True)),
+            ('last_status', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['scheduler.TaskStatus'], null=True, on_delete=models.SET_NULL)),
+            ('status', self.gf('django.db.models.fields.CharField')(max_length=100, null=True, blank=True)),
+            ('check_time', self.gf('django.db.models.fields.DateTimeField')(null=True, blank=True)),
+        ))
+        db.send_create_signal(u'scheduler', ['TaskState'])
+
+
+    def backwards(self, orm):
+        # Deleting model 'TaskState'
+        db.delete_table(u'scheduler_taskstate')
+
+
+    models = {
+        u'scheduler.occurrencehorizon': {
+            'Meta': {'object_name': 'OccurrenceHorizon'},
+            'end_time': ('django.db.models.fields.DateTimeField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'start_time': ('django.db.models.fields.DateTimeField', [], {})
+        },
+        u'scheduler.task': {
+            'Meta': {'object_name': 'Task'},
+            'active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'description': ('django.db.models.fields.TextField', [], {}),
+            'hour': ('django.db.models.fields.CharField', [], {'default': "'0'", 'max_length': '10'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'minute': ('django.db.models.fields.CharField', [], {'default': "'0'", 'max_length': '10'}),
+            'month': ('django.db.models.fields.CharField', [], {'default': "'*'", 'max_length': '10'}),
+            'monthday': ('django.db.models.fields.CharField', [], {'default': "'*'", 'max_length': '10'}),
+            'weekday': ('django.db.models.fields.CharField', [], {'default': "'*'", 'max_length': '40'})
+        },
+        u'scheduler.taskcheck': {
+            'Meta': {'object_name': 'TaskCheck'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_status': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['scheduler.TaskStatus']", 'null': 'True'}),
+            'task': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['scheduler.Task']"}),
+            'task_time': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'})
+        },
+        u'scheduler.taskoccurrence': {
+            'Meta': {'ordering': "['execution_time']", 'object_name': 'TaskOccurrence'},
+            'execution_time': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'task': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['scheduler.Task']"})
+        },
+        u'scheduler.taskstate': {
+            'Meta': {'object_name': 'TaskState'},
+            'check_time': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'last_status': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['scheduler.TaskStatus']", 'null': 'True', 'on_delete': 'models.SET_NULL'}),
+            'status': ('django.db.models.fields.CharField', [], {'max_length': '100', 'null': 'True', 'blank': 'True'}),
+            'task': ('django.db.models.fields.related.OneToOneField', [], {'related_name': "'state'", 'unique': 'True', 'primary_key': 'True', 'to': u"orm['scheduler.Task']"}),
+            'task_check': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['scheduler.TaskCheck']", 'null': 'True', 'on_delete': 'models.SET_NULL'}),
+            'task_time': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'})
+        },
+        u'scheduler.taskstatus': {
+            'Meta': {'object_name': 'TaskStatus'},
+            'check_time': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'null': 'True', 'blank': 'True'}),
+            'comment': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'status': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'task_check': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['scheduler.TaskCheck']"})
+        }
+    }
+
+    complete_apps = ['scheduler']
\ No newline at end of file
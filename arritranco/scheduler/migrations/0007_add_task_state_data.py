@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import DataMigration
+from django.db import models
+
+class Migration(DataMigration):
+
+    def forwards(self, orm):
+        "Write your forwards methods here."
+        # Note: Don't use "from appname.models import ModelName". 
+        # Use orm.ModelName to refer to models in this application,
+        # and orm['appname.ModelName'] for models in other applications.
+        latest = {}
+        for check in orm.TaskCheck.objects.values('id', 'task', 'task_time', 'last_status', 'last_status__status',
+                                                  'last_status__check_time'):
+            current = latest.get(check['task'])
+            if current is None or (check['task_time'] or datetime.datetime.min) >= \
+                    (current['task_time'] or datetime.datetime.min):
+                latest[check['task']] = check
+        orm.TaskState.objects.all().delete()
+        orm.TaskState.objects.bulk_create([
+            orm.TaskState(task_id=task_id, task_check_id=check['id'], task_time=check['task_time'],
+                          last_status_id=check['last_status'], status=check['last_status__status'],
+                          check_time=check['last_status__check_time'])
+            for task_id, check in latest.items()], batch_size=500)
+
+    def backwards(self, orm):
+        "Write your backwards methods here."
+        orm.TaskState.objects.all().delete()
+
+    models = {
+        u'scheduler.occurrencehorizon': {
+            'Meta': {'object_name': 'OccurrenceHorizon'},
+            'end_time': ('django.db.models.fields.DateTimeField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'start_time': ('django.db.models.fields.DateTimeField', [], {})
+        },
+        u'scheduler.task': {
+            'Meta': {'object_name': 'Task'},
+            'active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'description': ('django.db.models.fields.TextField', [], {}),
+            'hour': ('django.db.models.fields.CharField', [], {'default': "'0'", 'max_length': '10'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'minute': ('django.db.models.fields.CharField', [], {'default': "'0'", 'max_length': '10'}),
+            'month': ('django.db.models.fields.CharField', [], {'default': "'*'", 'max_length': '10'}),
+            'monthday': ('django.db.models.fields.CharField', [], {'default': "'*'", 'max_length': '10'}),
+            'weekday': ('django.db.models.fields.CharField', [], {'default': "'*'", 'max_length': '40'})
+        },
+        u'scheduler.taskcheck': {
+            'Meta': {'object_name': 'TaskCheck'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_status': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['scheduler.TaskStatus']", 'null': 'True'}),
+            'task': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['scheduler.Task']"}),
+            'task_time': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'})
+        },
+        u'scheduler.taskoccurrence': {
+            'Meta': {'ordering': "['execution_time']", 'object_name': 'TaskOccurrence'},
+            'execution_time': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'task': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['scheduler.Task']"})
+        },
+        u'scheduler.taskstate': {
+            'Meta': {'object_name': 'TaskState'},
+            'check_time': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'last_status': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['scheduler.TaskStatus']", 'null': 'True', 'on_delete': 'models.SET_NULL'}),
+            'status': ('django.db.models.fields.CharField', [], {'max_length': '100', 'null': 'True', 'blank': 'True'}),
+            'task': ('django.db.models.fields.related.OneToOneField', [], {'related_name': "'state'", 'unique': 'True', 'primary_key': 'True', 'to': u"orm['scheduler.Task']"}),
+            'task_check': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['scheduler.TaskCheck']", 'null': 'True', 'on_delete': 'models.SET_NULL'}),
+            'task_time': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'})
+        },
+        u'scheduler.taskstatus': {
+            'Meta': {'object_name': 'TaskStatus'},
+            'check_time': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'null': 'True', 'blank': 'True'}),
+            'comment': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'status': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'task_check': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['scheduler.TaskCheck']"})
+        }
+    }
+
+    complete_apps = ['scheduler']
+    symmetrical = True
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import connection, models, transaction
 from django.db.models import Q
 from django.http import Http404
 from django.shortcuts import get_object_or_404
@@ -6,29 +6,127 @@ from django.utils.translation import gettext_lazy as _
 from validators import validate_day_of_month, validate_day_of_week, validate_hour, validate_minute, validate_month
 
 import datetime
+import gzip
+import json
 from cron import *
 from croniter import croniter
-from django.db.models.signals import post_save
+from schedule import get_schedule, expand_runs
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import Signal
 
+# Days before and after now with materialized TaskOccurrences
+try:
+    from arritranco.settings import TASK_OCCURRENCE_HORIZON_DAYS
+except ImportError:
+    TASK_OCCURRENCE_HORIZON_DAYS = 45
+
+# Age in days of the TaskStatus moved to the archive
+try:
+    from arritranco.settings import TASK_STATUS_RETENTION_DAYS
+except ImportError:
+    TASK_STATUS_RETENTION_DAYS = 90
+
+# gzipped JSON lines file (strftime format) to archive TaskStatus to, instead of ArchivedTaskStatus
+try:
+    from arritranco.settings import TASK_STATUS_ARCHIVE_FILE
+except ImportError:
+    TASK_STATUS_ARCHIVE_FILE = None
+
+# Period of time expanded at once by TaskManager.iter_occurrences
+OCCURRENCE_STEP = datetime.timedelta(hours=1)
+
+# Status records handled per query by TaskCheck.objects.bulk_update_status
+# (keeps the IN clauses under the SQLite variable limit)
+BULK_STATUS_BATCH_SIZE = 400
+
+# Sent with the TaskStatus stored by TaskCheck.objects.bulk_update_status once stored, as their post_save is not sent
+statuses_stored = Signal(providing_args=['statuses'])
 
-class TaskManager(models.Manager):
-    def todo(self, start_time=None, end_time=None):
-        """List of Tasks to be done in a period of time."""
 
+class TaskManager(models.Manager):
+    def _get_window(self, start_time=None, end_time=None):
         if not start_time:
             start_time = datetime.datetime.now()
         if not end_time:
             end_time = datetime.datetime.now() + datetime.timedelta(days=1)
         if start_time > end_time:
             raise ValueError
-        queryset = self.model.objects.filter(active=True)
+        return start_time, end_time
+
+    def _get_runs(self, start_time, end_time, queryset=None):
+        """Pairs of (task, list of execution times), from TaskOccurrence when the window is materialized."""
+        if queryset is None:
+            queryset = self.model.objects.filter(active=True)
+        horizon = OccurrenceHorizon.objects.current()
+        if horizon is None or not horizon.covers(start_time, end_time):
+            return expand_runs(queryset, start_time, end_time)
+        runs = {}
+        for task_id, execution_time in TaskOccurrence.objects.filter(
+                task__in=queryset.values('pk'),
+                execution_time__gt=start_time,
+                execution_time__lt=end_time).values_list('task', 'execution_time'):
+            runs.setdefault(task_id, []).append(execution_time)
+        return [(task, runs.get(task.pk, [])) for task in queryset]
+
+    def occurrences(self, start_time=None, end_time=None, queryset=None):
+        """List of (task, execution_time) pairs to be done in a period of time, ordered by time.
+
+        queryset restricts the tasks to expand, by default every active task.
+        """
+        start_time, end_time = self._get_window(start_time, end_time)
+        occurrences = []
+        for task, runs in self._get_runs(start_time, end_time, queryset):
+            occurrences.extend((task, t) for t in runs)
+        occurrences.sort(key=lambda occurrence: occurrence[1])
+        return occurrences
+
+    def iter_occurrences(self, start_time=None, end_time=None, queryset=None, step=OCCURRENCE_STEP):
+        """Iterator over the (task, execution_time) pairs of a period of time ordered by time (and task).
+
+        Unlike occurrences() the window is not expanded at once: materialized occurrences
+        are read with a database iterator and the others are computed step by step, so
+        the first pairs are available right away and stopping early saves the rest.
+        """
+        start_time, end_time = self._get_window(start_time, end_time)
+        if queryset is None:
+            queryset = self.model.objects.filter(active=True)
+        # Not a generator itself, so that a bad window raises here
+        return self._iter_occurrences(start_time, end_time, queryset, step)
 
+    def _iter_occurrences(self, start_time, end_time, queryset, step):
+        horizon = OccurrenceHorizon.objects.current()
+        tasks = dict((task.pk, task) for task in queryset)
+        if horizon is not None and horizon.covers(start_time, end_time):
+            for task_id, execution_time in TaskOccurrence.objects.filter(
+                    task__in=queryset.values('pk'),
+                    execution_time__gt=start_time,
+                    execution_time__lt=end_time).order_by('execution_time', 'task').values_list(
+                    'task', 'execution_time').iterator():
+                yield tasks[task_id], execution_time
+            return
+        schedules = {}
+        for task in tasks.values():
+            schedules.setdefault(task.get_schedule(), []).append(task)
+        lower = start_time
+        upper = start_time.replace(second=0, microsecond=0)
+        while upper < end_time:
+            upper = min(upper + step, end_time)
+            occurrences = []
+            for schedule, schedule_tasks in schedules.items():
+                for t in schedule.runs_between(lower, upper):
+                    occurrences.extend((t, task.pk) for task in schedule_tasks)
+            occurrences.sort()
+            for t, task_id in occurrences:
+                yield tasks[task_id], t
+            # Runs are whole minutes, so the next step starts with upper and nothing before it
+            lower = upper - datetime.timedelta(seconds=1)
+
+    def todo(self, start_time=None, end_time=None, queryset=None):
+        """List of Tasks to be done in a period of time, once per execution."""
+        start_time, end_time = self._get_window(start_time, end_time)
         todo = []
-        for t in queryset:
-            execution_time = t.next_run(start_time)
-            while execution_time < end_time:
-                todo.append(t)
-                execution_time = t.next_run(execution_time + datetime.timedelta(minutes=1))
+        for task, runs in self._get_runs(start_time, end_time, queryset):
+            todo.extend([task] * len(runs))
         return todo
 
 
@@ -63,17 +161,27 @@ class Task(models.Model):
     def _get_crontab_entry(self):
         return SimpleCrontabEntry(self.cron_syntax())
 
+    def get_schedule(self):
+        """Compiled schedule for this task, shared with every task with the same recurrence."""
+        cron = self.cron_syntax()
+        schedule = getattr(self, '_schedule', None)
+        if schedule is None or schedule.expression != cron:
+            schedule = self._schedule = get_schedule(cron)
+        return schedule
+
+    def save(self, *args, **kwargs):
+        self._schedule = None
+        super(Task, self).save(*args, **kwargs)
+
     def next_run(self, start_time=None):
         if not start_time:
             start_time = datetime.datetime.now()
-        #return self._get_crontab_entry().next_run(start_time)
-        return self._get_croniter_entry(start_time).get_next(datetime.datetime)
+        return self.get_schedule().next_run(start_time)
 
     def last_run(self, start_time=None):
         if not start_time:
             start_time = datetime.datetime.now()
-        #return self._get_crontab_entry().prev_run(start_time)
-        return self._get_croniter_entry(start_time).get_prev(datetime.datetime)
+        return self.get_schedule().last_run(start_time)
 
     def update_status(self, task_time, status, comment=None):
         task_check, created = TaskCheck.objects.get_or_create(task=self, task_time=task_time)
@@ -85,14 +193,81 @@ class Task(models.Model):
         if d is not None:
             task_check = get_object_or_404(TaskCheck, task=self, task_time=d)
             return task_check.last_status
-        task_check = TaskCheck.objects.filter(task=self).order_by('-task_time')
-        if len(task_check):
-            return task_check[0].last_status
-        return None
+        try:
+            state = TaskState.objects.select_related('last_status').get(task=self)
+        except TaskState.DoesNotExist:
+            return None
+        return state.last_status
 
     get_status.short_description = 'Last check and status'
 
 
+class TaskCheckManager(models.Manager):
+    def bulk_update_status(self, records):
+        """Stores many statuses at once.
+
+        records is a list of (task_id, task_time, status, comment) tuples. Missing
+        TaskChecks are created and last_status is updated, with a fixed number of
+        queries per batch of records. The post_save signals of the statuses are not
+        sent, statuses_stored is sent instead with all of them once stored.
+        """
+        check_time = datetime.datetime.now()
+        statuses = []
+        with transaction.atomic():
+            for i in range(0, len(records), BULK_STATUS_BATCH_SIZE):
+                statuses.extend(self._bulk_update_status(records[i:i + BULK_STATUS_BATCH_SIZE], check_time))
+        statuses_stored.send(sender=TaskStatus, statuses=statuses)
+        return len(records)
+
+    def _get_checks(self, keys):
+        checks = {}
+        for check in self.filter(task__in=set(k[0] for k in keys), task_time__in=set(k[1] for k in keys)):
+            checks[(check.task_id, check.task_time)] = check.pk
+        return checks
+
+    def get_or_create_checks(self, keys):
+        """Ids of the TaskChecks for (task_id, task_time) keys, creating the missing ones.
+
+        Returns a dict of key -> id and the list of keys created. Checks are created
+        with bulk_create, so the post_save signal is not sent.
+        """
+        keys = set(keys)
+        checks = self._get_checks(keys)
+        missing = [k for k in keys if k not in checks]
+        if missing:
+            self.bulk_create([TaskCheck(task_id=task_id, task_time=task_time) for task_id, task_time in missing])
+            checks = self._get_checks(keys)
+        return checks, missing
+
+    def _bulk_update_status(self, records, check_time):
+        keys = set((task_id, task_time) for task_id, task_time, status, comment in records)
+        checks, created = self.get_or_create_checks(keys)
+        statuses = [TaskStatus(task_check_id=checks[(task_id, task_time)], check_time=check_time, status=status,
+                               comment=comment)
+                    for task_id, task_time, status, comment in records]
+        TaskStatus.objects.bulk_create(statuses)
+        check_ids = sorted(set(checks[k] for k in keys))
+        qn = connection.ops.quote_name
+        status_table = qn(TaskStatus._meta.db_table)
+        check_table = qn(self.model._meta.db_table)
+        # Same criteria as TaskCheck.get_status, in a single statement for every check
+        connection.cursor().execute(
+            "UPDATE %(check)s SET %(last_status)s = ("
+            "SELECT %(status)s.%(id)s FROM %(status)s WHERE %(status)s.%(task_check)s = %(check)s.%(id)s "
+            "ORDER BY %(status)s.%(check_time)s DESC, %(status)s.%(id)s DESC LIMIT 1) "
+            "WHERE %(check)s.%(id)s IN (%(ids)s)" % {
+                'check': check_table,
+                'status': status_table,
+                'id': qn('id'),
+                'last_status': qn('last_status_id'),
+                'task_check': qn('task_check_id'),
+                'check_time': qn('check_time'),
+                'ids': ', '.join(['%s'] * len(check_ids)),
+            }, check_ids)
+        TaskState.objects.refresh(check_ids)
+        return statuses
+
+
 class TaskCheck(models.Model):
     """
         Model to store all backup ckecks done.
@@ -101,6 +276,8 @@ class TaskCheck(models.Model):
     task_time = models.DateTimeField(blank=True, null=True, help_text='Task time')
     last_status = models.ForeignKey("scheduler.TaskStatus", help_text='Status', null=True)
 
+    objects = TaskCheckManager()
+
     def __unicode__(self):
         status = ''
         tch_status = self.last_status
@@ -125,6 +302,67 @@ class TaskCheck(models.Model):
         return self.taskstatus_set.count()
 
 
+class TaskStatusManager(models.Manager):
+    def archive(self, before=None, path=None, batch_size=1000):
+        """Moves the statuses checked before a time out of TaskStatus.
+
+        Statuses still referenced as the last status of a TaskCheck are kept. Each batch is
+        locked, counted into TaskStatusRollup, written to ArchivedTaskStatus and deleted at
+        once; with path the batch is appended to that gzipped JSON lines file instead, once
+        committed. Concurrent runs skip the statuses already archived by the other one.
+        Returns the number of archived statuses.
+        """
+        if before is None:
+            before = datetime.datetime.now() - datetime.timedelta(days=TASK_STATUS_RETENTION_DAYS)
+        # Statuses only become the last one of a check when newer, so the ones kept are read once
+        kept = set(TaskCheck.objects.filter(last_status__isnull=False).values_list('last_status', flat=True))
+        queryset = self.filter(check_time__lt=before).order_by('pk')
+        archived = 0
+        last_pk = 0
+        while True:
+            statuses = list(queryset.filter(pk__gt=last_pk).values(
+                'id', 'task_check', 'task_check__task', 'task_check__task_time', 'check_time', 'status',
+                'comment')[:batch_size])
+            if not statuses:
+                return archived
+            last_pk = statuses[-1]['id']
+            statuses = [status for status in statuses if status['id'] not in kept]
+            if not statuses:
+                continue
+            with transaction.atomic():
+                # Without the ones archived meanwhile by another run
+                locked = set(self.select_for_update().filter(pk__in=[status['id'] for status in statuses]).values_list(
+                    'pk', flat=True))
+                statuses = [status for status in statuses if status['id'] in locked]
+                TaskStatusRollup.objects.add(statuses)
+                if not path:
+                    ArchivedTaskStatus.objects.bulk_create([ArchivedTaskStatus(
+                        task_check_id=status['task_check'], task_id=status['task_check__task'],
+                        task_time=status['task_check__task_time'], check_time=status['check_time'],
+                        status=status['status'], comment=status['comment']) for status in statuses])
+                self.filter(pk__in=locked).delete()
+            if path:
+                # Once committed, so a failed batch is not written twice
+                self._write_archive(path, statuses)
+            archived += len(statuses)
+
+    def _write_archive(self, path, statuses):
+        archive = gzip.open(datetime.datetime.now().strftime(path), 'ab')
+        try:
+            for status in statuses:
+                archive.write(json.dumps({
+                    'id': status['id'],
+                    'task_check': status['task_check'],
+                    'task': status['task_check__task'],
+                    'task_time': status['task_check__task_time'] and status['task_check__task_time'].isoformat(),
+                    'check_time': status['check_time'].isoformat(),
+                    'status': status['status'],
+                    'comment': status['comment'],
+                }) + '\n')
+        finally:
+            archive.close()
+
+
 class TaskStatus(models.Model):
     """
         Model to store information about status.
@@ -141,12 +379,236 @@ class TaskStatus(models.Model):
     status = models.CharField(choices=STATUS_CHOICES, max_length=100, null=False, blank=False, help_text='Status')
     comment = models.TextField(blank=True, null=True, help_text='Comment')
 
+    objects = TaskStatusManager()
+
+    def __unicode__(self):
+        return "%s %s" % (self.check_time.strftime('%d-%m-%Y %H:%M:%S'), self.status)
+
+
+class ArchivedTaskStatus(models.Model):
+    """
+        TaskStatus moved out of the status table. It keeps plain ids, so it survives the deletion
+        of its task or check.
+    """
+    task_check_id = models.IntegerField(db_index=True, help_text='TaskCheck id')
+    task_id = models.IntegerField(db_index=True, help_text='Task id')
+    task_time = models.DateTimeField(blank=True, null=True, help_text='Task time')
+    check_time = models.DateTimeField(blank=True, null=True, help_text='Check time')
+    status = models.CharField(choices=TaskStatus.STATUS_CHOICES, max_length=100, help_text='Status')
+    comment = models.TextField(blank=True, null=True, help_text='Comment')
+
     def __unicode__(self):
         return "%s %s" % (self.check_time.strftime('%d-%m-%Y %H:%M:%S'), self.status)
 
 
+class TaskStatusRollupManager(models.Manager):
+    def add(self, statuses):
+        """Counts statuses (dicts with task_check__task, check_time and status) into the daily rollup."""
+        counts = {}
+        for status in statuses:
+            key = (status['task_check__task'], status['check_time'].date(), status['status'])
+            counts[key] = counts.get(key, 0) + 1
+        existing = self.filter(task__in=set(k[0] for k in counts), day__in=set(k[1] for k in counts))
+        for rollup in existing:
+            key = (rollup.task_id, rollup.day, rollup.status)
+            if key in counts:
+                self.filter(pk=rollup.pk).update(count=models.F('count') + counts.pop(key))
+        self.bulk_create([TaskStatusRollup(task_id=task_id, day=day, status=status, count=count)
+                          for (task_id, day, status), count in counts.items()])
+
+
+class TaskStatusRollup(models.Model):
+    """
+        Number of archived statuses of a task per day and status. Statuses still in TaskStatus
+        are not counted here.
+    """
+    task = models.ForeignKey(Task)
+    day = models.DateField(help_text='Check day')
+    status = models.CharField(choices=TaskStatus.STATUS_CHOICES, max_length=100, help_text='Status')
+    count = models.IntegerField(default=0, help_text='Number of statuses')
+
+    objects = TaskStatusRollupManager()
+
+    class Meta:
+        unique_together = (('task', 'day', 'status'),)
+
+    def __unicode__(self):
+        return u"%s %s %s: %d" % (self.task.description, self.day, self.status, self.count)
+
+
+class TaskStateManager(models.Manager):
+    def _lock(self, task_ids=None):
+        """Locks the tasks (every task by default) until the end of the transaction.
+
+        Their states can not be locked as they do not exist before the first check, so two
+        first refreshes of a task would both insert its state. Tasks are locked in id order
+        to avoid deadlocks, before reading their checks so the newest values are stored.
+        """
+        tasks = Task.objects.select_for_update().order_by('pk')
+        if task_ids is not None:
+            tasks = tasks.filter(pk__in=task_ids)
+        list(tasks.values_list('pk', flat=True))
+
+    def _store(self, checks):
+        """Replaces the state of the tasks of checks (dicts of TaskCheck values) with the newest check."""
+        latest = {}
+        for check in checks:
+            current = latest.get(check['task'])
+            if current is None or (check['task_time'] or datetime.datetime.min) >= \
+                    (current['task_time'] or datetime.datetime.min):
+                latest[check['task']] = check
+        self.filter(task__in=latest.keys()).delete()
+        self.bulk_create([TaskState(task_id=task_id, task_check_id=check['id'], task_time=check['task_time'],
+                                    last_status_id=check['last_status'], status=check['last_status__status'],
+                                    check_time=check['last_status__check_time'])
+                          for task_id, check in latest.items()])
+
+    @transaction.atomic
+    def refresh(self, check_ids):
+        """Moves the state of the tasks to the given TaskChecks when they are the newest ones."""
+        self._lock(set(TaskCheck.objects.filter(pk__in=check_ids).values_list('task', flat=True)))
+        checks = list(TaskCheck.objects.filter(pk__in=check_ids).values(
+            'id', 'task', 'task_time', 'last_status', 'last_status__status', 'last_status__check_time'))
+        states = dict(self.filter(task__in=set(c['task'] for c in checks)).values_list('task', 'task_time'))
+        self._store(c for c in checks
+                    if c['task'] not in states or states[c['task']] is None or
+                    (c['task_time'] is not None and c['task_time'] >= states[c['task']]))
+
+    @transaction.atomic
+    def rebuild(self, task_ids=None):
+        """Recomputes the state of the given tasks (every task by default) from their TaskChecks."""
+        self._lock(task_ids)
+        checks = TaskCheck.objects.all()
+        if task_ids is None:
+            self.all().delete()
+        else:
+            checks = checks.filter(task__in=task_ids)
+            self.filter(task__in=task_ids).delete()
+        self._store(checks.values('id', 'task', 'task_time', 'last_status', 'last_status__status',
+                                  'last_status__check_time'))
+
+
+class TaskState(models.Model):
+    """
+        Current state of a task: its newest TaskCheck and the last status of that check.
+    """
+    task = models.OneToOneField(Task, primary_key=True, related_name='state')
+    task_check = models.ForeignKey(TaskCheck, null=True, on_delete=models.SET_NULL)
+    task_time = models.DateTimeField(blank=True, null=True, help_text='Task time')
+    last_status = models.ForeignKey(TaskStatus, null=True, on_delete=models.SET_NULL)
+    status = models.CharField(choices=TaskStatus.STATUS_CHOICES, max_length=100, null=True, blank=True,
+                              help_text='Status')
+    check_time = models.DateTimeField(blank=True, null=True, help_text='Check time')
+
+    objects = TaskStateManager()
+
+    def __unicode__(self):
+        return u"%s %s (%s)" % (self.task.description, self.task_time, self.status)
+
+
 def update_status(sender, instance, **kwargs):
     instance.task_check.last_status = instance.task_check.get_status()
     instance.task_check.save()
 
 post_save.connect(update_status, sender=TaskStatus, dispatch_uid="update_status")
+
+
+def update_state(sender, instance, raw=False, **kwargs):
+    if not raw:
+        TaskState.objects.refresh([instance.pk])
+
+post_save.connect(update_state, sender=TaskCheck, dispatch_uid="update_state")
+
+
+def rebuild_state(sender, instance, **kwargs):
+    # The state of the task loses its check (set to NULL) only when it was the deleted one
+    if TaskState.objects.filter(task=instance.task_id, task_check__isnull=True).exists():
+        TaskState.objects.rebuild([instance.task_id])
+
+post_delete.connect(rebuild_state, sender=TaskCheck, dispatch_uid="rebuild_state")
+
+
+class OccurrenceHorizonManager(models.Manager):
+    def current(self):
+        try:
+            return self.get_queryset().latest('end_time')
+        except OccurrenceHorizon.DoesNotExist:
+            return None
+
+
+class OccurrenceHorizon(models.Model):
+    """
+        Time window with materialized TaskOccurrences (both ends excluded).
+    """
+    start_time = models.DateTimeField(help_text='Horizon start')
+    end_time = models.DateTimeField(help_text='Horizon end')
+
+    objects = OccurrenceHorizonManager()
+
+    def __unicode__(self):
+        return u"%s - %s" % (self.start_time, self.end_time)
+
+    def covers(self, start_time, end_time):
+        return self.start_time <= start_time and end_time <= self.end_time
+
+
+class TaskOccurrenceManager(models.Manager):
+    @transaction.atomic
+    def refresh_task(self, task):
+        """Recomputes the occurrences of one task inside the current horizon."""
+        self.filter(task=task).delete()
+        horizon = OccurrenceHorizon.objects.current()
+        if horizon is None or not task.active:
+            return
+        runs = task.get_schedule().runs_between(horizon.start_time, horizon.end_time)
+        self.bulk_create([TaskOccurrence(task_id=task.pk, execution_time=t) for t in runs], batch_size=500)
+
+    @transaction.atomic
+    def roll(self, now=None, days=TASK_OCCURRENCE_HORIZON_DAYS):
+        """Moves the horizon to now +/- days, computing only the occurrences not materialized yet."""
+        if now is None:
+            now = datetime.datetime.now()
+        now = now.replace(second=0, microsecond=0)
+        start_time = now - datetime.timedelta(days=days)
+        end_time = now + datetime.timedelta(days=days)
+        horizon = OccurrenceHorizon.objects.current()
+        if horizon is None or not (horizon.start_time <= start_time <= horizon.end_time):
+            # Nothing reusable, build the whole window
+            self.all().delete()
+            OccurrenceHorizon.objects.all().delete()
+            from_time = start_time
+        else:
+            # A smaller window than the current one leaves occurrences past its end
+            self.filter(Q(execution_time__lte=start_time) | Q(execution_time__gte=end_time)).delete()
+            from_time = min(horizon.end_time, end_time)
+        occurrences = []
+        for task, runs in expand_runs(Task.objects.filter(active=True), from_time - datetime.timedelta(minutes=1),
+                                      end_time):
+            occurrences.extend(TaskOccurrence(task_id=task.pk, execution_time=t) for t in runs if t >= from_time)
+        self.bulk_create(occurrences, batch_size=500)
+        OccurrenceHorizon.objects.all().delete()
+        return OccurrenceHorizon.objects.create(start_time=start_time, end_time=end_time)
+
+
+class TaskOccurrence(models.Model):
+    """
+        Precomputed execution time of a task, kept inside the OccurrenceHorizon.
+    """
+    task = models.ForeignKey(Task)
+    execution_time = models.DateTimeField(db_index=True, help_text='Execution time')
+
+    objects = TaskOccurrenceManager()
+
+    class Meta:
+        ordering = ['execution_time']
+
+    def __unicode__(self):
+        return u"%s %s" % (self.task.description, self.execution_time.strftime('%d-%m-%Y %H:%M'))
+
+
+def update_occurrences(sender, instance, raw=False, **kwargs):
+    """Keeps the materialized occurrences of a task in sync when it changes."""
+    if not raw:
+        TaskOccurrence.objects.refresh_task(instance)
+
+post_save.connect(update_occurrences, sender=Task, dispatch_uid="update_occurrences")
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+import json
+
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class NDJSONRenderer(BaseRenderer):
+    """Newline delimited JSON: one line per item of a list, or a single line for anything else."""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    encoder_class = JSONEncoder
+
+    def render_item(self, item):
+        return json.dumps(item, cls=self.encoder_class) + '\n'
+
+    def render_lines(self, items):
+        """Generates the lines for an iterable of items, used for streaming responses."""
+        for item in items:
+            yield self.render_item(item)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return ''
+        if isinstance(data, (list, tuple)):
+            return ''.join(self.render_lines(data))
+        return self.render_item(data)
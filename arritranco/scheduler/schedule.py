@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+Compiled cron schedules.
+
+A CronSchedule parses a five field cron expression once and keeps every field
+as a bitset, so next and previous occurrences are found with a few integer
+operations instead of re-parsing the expression on every call.
+
+Schedules are immutable and shared: get_schedule() keeps them in a bounded LRU
+keyed by the cron expression, so all the tasks with the same recurrence use the
+same compiled object.
+"""
+
+import datetime
+import threading
+from collections import OrderedDict
+
+# Maximum number of compiled schedules kept in memory.
+SCHEDULE_CACHE_SIZE = 1024
+
+# Give up searching for an occurrence after this many years (e.g. "0 0 30 2 *").
+MAX_SEARCH_YEARS = 10
+
+MONTH_NAMES = {
+    'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
+    'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12,
+}
+
+WEEKDAY_NAMES = {
+    'sun': 0, 'mon': 1, 'tue': 2, 'wed': 3, 'thu': 4, 'fri': 5, 'sat': 6,
+}
+
+ONE_MINUTE = datetime.timedelta(minutes=1)
+ONE_HOUR = datetime.timedelta(hours=1)
+ONE_DAY = datetime.timedelta(days=1)
+
+
+def parse_field(expr, first, last, names=None):
+    """Returns the sorted list of values allowed by a cron field.
+
+    Supports "*", single values, "a-b" ranges, "/step" suffixes, comma separated
+    lists and (for months and weekdays) three letter names.
+    """
+    values = set()
+    for item in expr.lower().split(','):
+        step = 1
+        if '/' in item:
+            item, step = item.split('/', 1)
+            step = _to_int(step, expr)
+            if step < 1:
+                raise ValueError("Bad step in cron field: %s" % expr)
+        if item == '*':
+            start, end = first, last
+        elif '-' in item:
+            start, end = item.split('-', 1)
+            start, end = _to_value(start, expr, names), _to_value(end, expr, names)
+        else:
+            start = _to_value(item, expr, names)
+            # "5/15" means from 5 to the end of the range every 15
+            end = last if step > 1 else start
+        if start < first or end > last or start > end:
+            raise ValueError("Cron field out of range [%s-%s]: %s" % (first, last, expr))
+        values.update(range(start, end + 1, step))
+    return sorted(values)
+
+
+def _to_int(value, expr):
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError("Bad cron field: %s" % expr)
+
+
+def _to_value(value, expr, names):
+    if names and value in names:
+        return names[value]
+    return _to_int(value, expr)
+
+
+def to_bitset(values):
+    """Packs a list of small integers into an int with those bits set."""
+    mask = 0
+    for v in values:
+        mask |= 1 << v
+    return mask
+
+
+def bits(mask):
+    """Sorted list of the bits set in mask."""
+    return [n for n in range(mask.bit_length()) if mask >> n & 1]
+
+
+def next_bit(mask, n):
+    """Lowest bit set in mask that is >= n, or None."""
+    x = mask >> n
+    if not x:
+        return None
+    return n + (x & -x).bit_length() - 1
+
+
+def prev_bit(mask, n):
+    """Highest bit set in mask that is <= n, or None."""
+    x = mask & ((2 << n) - 1)
+    if not x:
+        return None
+    return x.bit_length() - 1
+
+
+class CronSchedule(object):
+    """Cron expression compiled to per field bitsets.
+
+    next_run() and last_run() follow croniter semantics: the returned occurrence
+    is strictly after (or before) the given time.
+    """
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError("Crontab entry needs 5 fields: %s" % expression)
+        self.expression = expression
+        self.minutes = to_bitset(parse_field(fields[0], 0, 59))
+        self.hours = to_bitset(parse_field(fields[1], 0, 23))
+        self.days = to_bitset(parse_field(fields[2], 1, 31))
+        self.months = to_bitset(parse_field(fields[3], 1, 12, MONTH_NAMES))
+        weekdays = parse_field(fields[4], 0, 7, WEEKDAY_NAMES)
+        # Both 0 and 7 are sunday
+        self.weekdays = to_bitset([w % 7 for w in weekdays])
+        # As in cron, when both day fields are restricted a day matches either of them
+        self.day_or = fields[2] != '*' and fields[4] != '*'
+        self.hour_list = bits(self.hours)
+        self.minute_list = bits(self.minutes)
+
+    def __repr__(self):
+        return "<CronSchedule: %s>" % self.expression
+
+    def matches_day(self, d):
+        """Whether the cron day, month and weekday fields allow date d."""
+        if not self.months >> d.month & 1:
+            return False
+        dom = self.days >> d.day & 1
+        # datetime weekday is monday = 0, cron is sunday = 0
+        dow = self.weekdays >> ((d.weekday() + 1) % 7) & 1
+        if self.day_or:
+            return bool(dom or dow)
+        return bool(dom and dow)
+
+    def next_run(self, start_time):
+        """First occurrence strictly after start_time."""
+        t = start_time.replace(second=0, microsecond=0) + ONE_MINUTE
+        limit = t.year + MAX_SEARCH_YEARS
+        while t.year <= limit:
+            if not self.months >> t.month & 1:
+                if t.month == 12:
+                    t = datetime.datetime(t.year + 1, 1, 1)
+                else:
+                    t = datetime.datetime(t.year, t.month + 1, 1)
+                continue
+            if not self.matches_day(t):
+                t = datetime.datetime(t.year, t.month, t.day) + ONE_DAY
+                continue
+            hour = next_bit(self.hours, t.hour)
+            if hour is None:
+                t = datetime.datetime(t.year, t.month, t.day) + ONE_DAY
+                continue
+            if hour != t.hour:
+                t = t.replace(hour=hour, minute=0)
+            minute = next_bit(self.minutes, t.minute)
+            if minute is None:
+                t = t.replace(minute=0) + ONE_HOUR
+                continue
+            return t.replace(minute=minute)
+        raise ValueError("No occurrence found for %s" % self.expression)
+
+    def last_run(self, start_time):
+        """Last occurrence strictly before start_time."""
+        t = start_time.replace(second=0, microsecond=0)
+        if t == start_time:
+            t -= ONE_MINUTE
+        limit = t.year - MAX_SEARCH_YEARS
+        while t.year >= limit:
+            if not self.months >> t.month & 1:
+                t = datetime.datetime(t.year, t.month, 1) - ONE_MINUTE
+                continue
+            if not self.matches_day(t):
+                t = datetime.datetime(t.year, t.month, t.day) - ONE_MINUTE
+                continue
+            hour = prev_bit(self.hours, t.hour)
+            if hour is None:
+                t = datetime.datetime(t.year, t.month, t.day) - ONE_MINUTE
+                continue
+            if hour != t.hour:
+                t = t.replace(hour=hour, minute=59)
+            minute = prev_bit(self.minutes, t.minute)
+            if minute is None:
+                t = t.replace(minute=0) - ONE_MINUTE
+                continue
+            return t.replace(minute=minute)
+        raise ValueError("No occurrence found for %s" % self.expression)
+
+    def runs_between(self, start_time, end_time):
+        """Every occurrence strictly after start_time and strictly before end_time.
+
+        Days are checked once and each matching day is expanded with the
+        precomputed hour and minute lists, so the cost depends on the number of
+        days in the window and not on the number of occurrences searched.
+        """
+        runs = []
+        day = datetime.datetime(start_time.year, start_time.month, start_time.day)
+        while day <= end_time:
+            if self.matches_day(day):
+                for hour in self.hour_list:
+                    for minute in self.minute_list:
+                        t = day.replace(hour=hour, minute=minute)
+                        if start_time < t < end_time:
+                            runs.append(t)
+            day += ONE_DAY
+        return runs
+
+
+def expand_runs(tasks, start_time, end_time):
+    """Pairs of (task, list of execution times) for every task in a window.
+
+    Tasks sharing a recurrence share their compiled schedule, so each distinct
+    schedule is expanded only once however many tasks use it.
+    """
+    runs = {}
+    for task in tasks:
+        schedule = task.get_schedule()
+        if schedule.expression not in runs:
+            runs[schedule.expression] = schedule.runs_between(start_time, end_time)
+        yield task, runs[schedule.expression]
+
+
+def expand_occurrences(tasks, start_time, end_time):
+    """Every (task, execution_time) pair of tasks in a window, ordered by time."""
+    occurrences = []
+    for task, runs in expand_runs(tasks, start_time, end_time):
+        occurrences.extend((task, t) for t in runs)
+    occurrences.sort(key=lambda occurrence: occurrence[1])
+    return occurrences
+
+
+_schedules = OrderedDict()
+_schedules_lock = threading.Lock()
+
+
+def get_schedule(expression):
+    """Returns the shared CronSchedule for a cron expression."""
+    with _schedules_lock:
+        schedule = _schedules.pop(expression, None)
+        if schedule is not None:
+            _schedules[expression] = schedule
+            return schedule
+    schedule = CronSchedule(expression)
+    with _schedules_lock:
+        _schedules[expression] = schedule
+        while len(_schedules) > SCHEDULE_CACHE_SIZE:
+            _schedules.popitem(last=False)
+    return schedule
+
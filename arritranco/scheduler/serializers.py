@@ -10,6 +10,14 @@ class TaskStatusSerializer(serializers.ModelSerializer):
         fields = ('check_time', 'status', 'comment')
 
 
+class BulkTaskStatusSerializer(serializers.Serializer):
+    """One record of a bulk status update. task_time defaults to the last run of the task."""
+    task = serializers.IntegerField()
+    task_time = serializers.DateTimeField(required=False)
+    status = serializers.ChoiceField(choices=TaskStatus.STATUS_CHOICES)
+    comment = serializers.CharField(required=False)
+
+
 class TaskCheckSerializer(serializers.ModelSerializer):
     class Meta:
         model = TaskCheck
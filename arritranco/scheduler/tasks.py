@@ -0,0 +1,14 @@
+from __future__ import absolute_import
+
+from celery import shared_task
+from scheduler.models import TaskOccurrence, TaskStatus, TASK_STATUS_ARCHIVE_FILE
+
+
+@shared_task
+def roll_task_occurrences():
+    TaskOccurrence.objects.roll()
+
+
+@shared_task
+def archive_task_statuses():
+    TaskStatus.objects.archive(path=TASK_STATUS_ARCHIVE_FILE)
@@ -1,16 +1,422 @@
-"""
-This file demonstrates writing tests using the unittest module. These will pass
-when you run "manage.py test".
-
-Replace this with more appropriate tests for your application.
-"""
+import datetime
+import doctest
+import gzip
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
 
+from croniter import croniter
+from django.core.urlresolvers import reverse
 from django.test import TestCase
 
+from scheduler.models import Task, TaskCheck, TaskStatus, TaskState, TaskOccurrence, OccurrenceHorizon, \
+    ArchivedTaskStatus, TaskStatusRollup
+from scheduler.schedule import CronSchedule, get_schedule
+from scheduler.cron import SimpleCrontabEntry
+
+
+class CronScheduleTest(TestCase):
+    expressions = (
+        '0 0 * * *',
+        '30 2 * * 1,3,5',
+        '15 23 1 * *',
+        '0 4 13 * 5',
+        '*/20 */6 * * *',
+        '5 1-5 * 2-4 *',
+        '0 12 29 2 *',
+        '10 3 * * 0',
+        '10 3 * * 7',
+    )
+
+    def test_croniter_parity(self):
+        starts = [datetime.datetime(2014, 1, 1), datetime.datetime(2014, 2, 28, 23, 59, 30),
+                  datetime.datetime(2015, 12, 31, 23, 59), datetime.datetime(2016, 3, 1, 12, 0)]
+        for expression in self.expressions:
+            schedule = CronSchedule(expression)
+            for start in starts:
+                self.assertEqual(schedule.next_run(start), croniter(expression, start).get_next(datetime.datetime),
+                                 expression)
+                self.assertEqual(schedule.last_run(start), croniter(expression, start).get_prev(datetime.datetime),
+                                 expression)
+
+    def test_bad_expression(self):
+        self.assertRaises(ValueError, CronSchedule, '0 0 * *')
+        self.assertRaises(ValueError, CronSchedule, '60 0 * * *')
+        self.assertRaises(ValueError, CronSchedule, '0 0 0 * *')
+
+    def test_shared_schedule(self):
+        self.assertTrue(get_schedule('0 3 * * *') is get_schedule('0 3 * * *'))
+
+
+class TaskScheduleTest(TestCase):
+    def test_schedule_invalidated_on_save(self):
+        task = Task.objects.create(minute='0', hour='3', description='test')
+        start = datetime.datetime(2014, 5, 1)
+        self.assertEqual(task.next_run(start), datetime.datetime(2014, 5, 1, 3, 0))
+        task.hour = '5'
+        task.save()
+        self.assertEqual(task.next_run(start), datetime.datetime(2014, 5, 1, 5, 0))
+        self.assertEqual(task.last_run(start), datetime.datetime(2014, 4, 30, 5, 0))
+
+
+class TodoTest(TestCase):
+    def setUp(self):
+        self.daily = Task.objects.create(minute='0', hour='3', description='daily')
+        self.twice = Task.objects.create(minute='30', hour='1,13', weekday='1', description='mondays')
+        Task.objects.create(minute='0', hour='3', description='inactive', active=False)
+
+    def test_occurrences(self):
+        start = datetime.datetime(2014, 5, 1)
+        end = datetime.datetime(2014, 5, 8)
+        occurrences = Task.objects.occurrences(start, end)
+        expected = []
+        for task in (self.daily, self.twice):
+            it = croniter(task.cron_syntax(), start)
+            t = it.get_next(datetime.datetime)
+            while t < end:
+                expected.append((t, task.pk))
+                t = it.get_next(datetime.datetime)
+        self.assertEqual([(t, task.pk) for task, t in occurrences], sorted(expected))
+
+    def test_todo(self):
+        todo = Task.objects.todo(datetime.datetime(2014, 5, 1), datetime.datetime(2014, 5, 8))
+        self.assertEqual([t.pk for t in todo], [self.daily.pk] * 7 + [self.twice.pk] * 2)
+        self.assertRaises(ValueError, Task.objects.todo, datetime.datetime(2014, 5, 8), datetime.datetime(2014, 5, 1))
+
+    def test_iter_occurrences(self):
+        Task.objects.create(minute='30', hour='1', description='same time')
+        start = datetime.datetime(2014, 5, 1, 0, 0, 30)
+        end = datetime.datetime(2014, 5, 8, 1, 30)
+        expected = [(t, task.pk) for task, t in sorted(Task.objects.occurrences(start, end),
+                                                       key=lambda o: (o[1], o[0].pk))]
+        for step in (datetime.timedelta(minutes=30), datetime.timedelta(days=2)):
+            self.assertEqual([(t, task.pk) for task, t in Task.objects.iter_occurrences(start, end, step=step)],
+                             expected)
+        TaskOccurrence.objects.roll(datetime.datetime(2014, 5, 4), days=5)
+        self.assertEqual([(t, task.pk) for task, t in Task.objects.iter_occurrences(start, end)], expected)
+        self.assertRaises(ValueError, Task.objects.iter_occurrences, end, start)
+
+    def get_todo(self, **params):
+        return self.client.get(reverse('tasks-todo'), params, HTTP_ACCEPT='application/json')
+
+    def test_todo_cursor(self):
+        start = datetime.datetime(2014, 5, 1)
+        end = datetime.datetime(2014, 5, 8)
+        expected = [(t, task.pk) for task, t in Task.objects.occurrences(start, end)]
+        after = time.mktime(start.timetuple())
+        seen = []
+        while True:
+            response = self.get_todo(after=after, end_time=time.mktime(end.timetuple()), limit=2)
+            self.assertEqual(response.status_code, 200)
+            page = json.loads(response.content)
+            after = response['X-Next-Cursor']
+            if not page:
+                break
+            self.assertTrue(len(page) <= 2)
+            seen.extend((datetime.datetime.strptime(item['execution_time'], '%Y-%m-%dT%H:%M:%S'), item['id'])
+                        for item in page)
+        self.assertEqual(seen, expected)
+        self.assertEqual(int(after), time.mktime(end.timetuple()) - 1)
+        self.assertEqual(self.get_todo(limit=0).status_code, 400)
+        self.assertEqual(self.get_todo(after='tomorrow').status_code, 400)
+
+    def test_todo_ndjson(self):
+        start = datetime.datetime(2014, 5, 1)
+        end = start + datetime.timedelta(days=7)
+        response = self.client.get(reverse('tasks-todo'), {'format': 'ndjson', 'start_time': time.mktime(start.timetuple()),
+                                                           'end_time': time.mktime(end.timetuple())})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in ''.join(response.streaming_content).splitlines()]
+        self.assertEqual([item['id'] for item in lines],
+                         [task.pk for task, t in Task.objects.occurrences(start, end)])
+        # Without cursor nor streaming it is the plain list of tasks
+        response = self.get_todo(start_time=time.mktime(start.timetuple()), end_time=time.mktime(end.timetuple()))
+        self.assertEqual([item['id'] for item in json.loads(response.content)], [self.daily.pk] * 7 + [self.twice.pk] * 2)
+        self.assertFalse(response.has_header('X-Next-Cursor'))
+
+
+class TaskOccurrenceTest(TestCase):
+    def setUp(self):
+        self.now = datetime.datetime(2014, 5, 10, 12, 0)
+        self.task = Task.objects.create(minute='0', hour='3', description='daily')
+
+    def test_roll(self):
+        horizon = TaskOccurrence.objects.roll(self.now, days=2)
+        self.assertEqual(TaskOccurrence.objects.filter(task=self.task).count(), 4)
+        self.assertTrue(horizon.covers(self.now, self.now + datetime.timedelta(days=1)))
+        TaskOccurrence.objects.roll(self.now + datetime.timedelta(days=1), days=2)
+        self.assertEqual([o.execution_time.day for o in TaskOccurrence.objects.filter(task=self.task)],
+                         [10, 11, 12, 13])
+        self.assertEqual(OccurrenceHorizon.objects.count(), 1)
+
+    def test_shrink(self):
+        TaskOccurrence.objects.roll(self.now, days=3)
+        TaskOccurrence.objects.roll(self.now, days=1)
+        self.assertEqual([o.execution_time.day for o in TaskOccurrence.objects.filter(task=self.task)], [10, 11])
+        # The occurrences past the smaller window are not kept, so rolling again does not repeat them
+        TaskOccurrence.objects.roll(self.now + datetime.timedelta(hours=16), days=1)
+        self.assertEqual([o.execution_time.day for o in TaskOccurrence.objects.filter(task=self.task)], [11, 12])
+
+    def test_refresh_on_save(self):
+        TaskOccurrence.objects.roll(self.now, days=2)
+        self.task.hour = '3,15'
+        self.task.save()
+        self.assertEqual(TaskOccurrence.objects.filter(task=self.task).count(), 8)
+        self.task.active = False
+        self.task.save()
+        self.assertEqual(TaskOccurrence.objects.filter(task=self.task).count(), 0)
+
+    def test_todo_from_occurrences(self):
+        TaskOccurrence.objects.roll(self.now, days=2)
+        TaskOccurrence.objects.filter(task=self.task).delete()
+        window = (self.now, self.now + datetime.timedelta(days=1))
+        self.assertEqual(Task.objects.todo(*window), [])
+        self.assertEqual(len(Task.objects.todo(window[0], window[1] + datetime.timedelta(days=2))), 3)
+
+
+class BulkTaskStatusTest(TestCase):
+    def setUp(self):
+        self.task = Task.objects.create(minute='0', hour='3', description='daily')
+        self.other = Task.objects.create(minute='0', hour='5', description='other')
+        self.time = datetime.datetime(2014, 5, 1, 3, 0)
+
+    def test_bulk_update_status(self):
+        self.task.update_status(self.time, 'Critical', 'missing')
+        TaskCheck.objects.bulk_update_status([
+            (self.task.pk, self.time, 'Warning', 'small'),
+            (self.task.pk, self.time, 'Ok', 'found'),
+            (self.other.pk, self.time, 'Unknown', None),
+        ])
+        self.assertEqual(TaskCheck.objects.count(), 2)
+        self.assertEqual(TaskStatus.objects.count(), 4)
+        self.assertEqual(self.task.get_status(self.time).status, 'Ok')
+        self.assertEqual(self.task.get_status(self.time).comment, 'found')
+        self.assertEqual(self.other.get_status().status, 'Unknown')
+
+    def test_post(self):
+        records = [
+            {'task': self.task.pk, 'task_time': '2014-05-01T03:00:00', 'status': 'Ok', 'comment': 'found'},
+            {'task': self.other.pk, 'status': 'Warning'},
+        ]
+        response = self.client.post(reverse('taskstatus-bulk'), json.dumps(records), content_type='application/json',
+                                    HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.task.get_status(self.time).status, 'Ok')
+        self.assertEqual(TaskCheck.objects.get(task=self.other).task_time, self.other.last_run())
+        records[1]['task'] = 0
+        response = self.client.post(reverse('taskstatus-bulk'), json.dumps(records), content_type='application/json',
+                                    HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(TaskStatus.objects.count(), 2)
+
+
+class TaskStateTest(TestCase):
+    def setUp(self):
+        self.task = Task.objects.create(minute='0', hour='3', description='daily')
+        self.first = datetime.datetime(2014, 5, 1, 3, 0)
+        self.second = datetime.datetime(2014, 5, 2, 3, 0)
+
+    def test_update_status(self):
+        self.assertEqual(self.task.get_status(), None)
+        self.task.update_status(self.second, 'Critical', 'missing')
+        self.task.update_status(self.first, 'Ok', 'old check')
+        state = TaskState.objects.get(task=self.task)
+        self.assertEqual((state.task_time, state.status), (self.second, 'Critical'))
+        self.task.update_status(self.second, 'Ok', 'found')
+        self.assertEqual(self.task.get_status().comment, 'found')
+        self.assertEqual(TaskState.objects.get(task=self.task).status, 'Ok')
+
+    def test_bulk_update_status(self):
+        self.task.update_status(self.first, 'Ok', 'old check')
+        TaskCheck.objects.bulk_update_status([(self.task.pk, self.second, 'Warning', 'small')])
+        state = TaskState.objects.get(task=self.task)
+        self.assertEqual((state.task_time, state.status), (self.second, 'Warning'))
+        self.assertEqual(state.last_status, TaskStatus.objects.get(comment='small'))
+
+    def test_delete_check(self):
+        self.task.update_status(self.first, 'Ok', 'old check')
+        self.task.update_status(self.second, 'Warning', 'small')
+        TaskCheck.objects.get(task_time=self.second).delete()
+        state = TaskState.objects.get(task=self.task)
+        self.assertEqual((state.task_time, state.status), (self.first, 'Ok'))
+        TaskState.objects.all().delete()
+        TaskState.objects.rebuild()
+        self.assertEqual(self.task.get_status().comment, 'old check')
+
+    def test_delete_old_check(self):
+        self.task.update_status(self.first, 'Ok', 'old check')
+        self.task.update_status(self.second, 'Warning', 'small')
+        rebuilt = []
+        TaskState.objects.rebuild = lambda task_ids=None: rebuilt.append(task_ids)
+        try:
+            TaskCheck.objects.get(task_time=self.first).delete()
+        finally:
+            del TaskState.objects.rebuild
+        self.assertEqual(rebuilt, [])
+        state = TaskState.objects.get(task=self.task)
+        self.assertEqual((state.task_time, state.status), (self.second, 'Warning'))
+
+
+class TaskStatusArchiveTest(TestCase):
+    def setUp(self):
+        self.task = Task.objects.create(minute='0', hour='3', description='daily')
+        self.old = datetime.datetime(2014, 5, 1, 3, 5)
+        for day in range(1, 4):
+            check = TaskCheck.objects.create(task=self.task, task_time=datetime.datetime(2014, 5, day, 3, 0))
+            for status in ('Critical', 'Critical', 'Ok'):
+                TaskStatus.objects.create(task_check=check, status=status, comment=status)
+        # Two days of statuses are old, the last one of each check is kept as its last_status
+        TaskStatus.objects.filter(task_check__task_time__lt=datetime.datetime(2014, 5, 3)).update(check_time=self.old)
+        TaskStatus.objects.filter(task_check__task_time__lt=datetime.datetime(2014, 5, 2), status='Critical').update(
+            check_time=self.old - datetime.timedelta(days=1))
+        self.before = datetime.datetime(2014, 6, 1)
+
+    def test_archive(self):
+        self.assertEqual(TaskStatus.objects.archive(self.before, batch_size=3), 4)
+        self.assertEqual(TaskStatus.objects.count(), 5)
+        self.assertEqual(ArchivedTaskStatus.objects.filter(task_id=self.task.pk, status='Critical').count(), 4)
+        self.assertEqual(sorted(TaskStatusRollup.objects.values_list('day', 'status', 'count')),
+                         [(datetime.date(2014, 4, 30), 'Critical', 2), (datetime.date(2014, 5, 1), 'Critical', 2)])
+        for check in TaskCheck.objects.all():
+            self.assertEqual(check.last_status.status, 'Ok')
+        self.assertEqual(TaskStatus.objects.archive(self.before), 0)
+
+    def test_rollup_adds(self):
+        TaskStatus.objects.archive(self.before)
+        check = TaskCheck.objects.get(task_time=datetime.datetime(2014, 5, 1, 3, 0))
+        last_status_id = check.last_status_id
+        status = TaskStatus.objects.create(task_check=check, status='Critical')
+        # A late status for an old day, that is not the last one of its check
+        TaskStatus.objects.filter(pk=status.pk).update(check_time=self.old - datetime.timedelta(days=1))
+        TaskCheck.objects.filter(pk=check.pk).update(last_status=last_status_id)
+        TaskStatus.objects.archive(self.before)
+        self.assertEqual(TaskStatusRollup.objects.get(day=datetime.date(2014, 4, 30)).count, 3)
+
+    def test_archive_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'statuses.jsonl.gz')
+            self.assertEqual(TaskStatus.objects.archive(self.before, path), 4)
+            lines = [json.loads(line) for line in gzip.open(path)]
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(ArchivedTaskStatus.objects.count(), 0)
+        self.assertEqual([(line['task'], line['status']) for line in lines], [(self.task.pk, 'Critical')] * 4)
+        self.assertEqual(TaskStatusRollup.objects.count(), 2)
+
+    def test_archive_file_failed_batch(self):
+        directory = tempfile.mkdtemp()
+        filter = TaskStatus.objects.filter
+        deleted = []
+
+        def failing_filter(*args, **kwargs):
+            # The second batch fails when deleted
+            if 'pk__in' in kwargs:
+                deleted.append(list(kwargs['pk__in']))
+                if len(deleted) == 2:
+                    raise ValueError
+            return filter(*args, **kwargs)
+        TaskStatus.objects.filter = failing_filter
+        try:
+            path = os.path.join(directory, 'statuses.jsonl.gz')
+            self.assertRaises(ValueError, TaskStatus.objects.archive, self.before, path, 2)
+            lines = [json.loads(line) for line in gzip.open(path)]
+        finally:
+            del TaskStatus.objects.filter
+            shutil.rmtree(directory)
+        # Only the committed batch is in the file, the other one is still in TaskStatus
+        self.assertEqual(sorted(line['id'] for line in lines), sorted(deleted[0]))
+        self.assertEqual(TaskStatus.objects.count(), 7)
+
+    def test_archived_meanwhile(self):
+        select_for_update = TaskStatus.objects.select_for_update
+        archived = []
+
+        def concurrent_select_for_update():
+            # Another run archives the first old status once this one has read its batch
+            if not archived:
+                archived.append(TaskStatus.objects.filter(check_time__lt=self.old).order_by('pk')[0])
+                archived[0].delete()
+            return select_for_update()
+        TaskStatus.objects.select_for_update = concurrent_select_for_update
+        try:
+            self.assertEqual(TaskStatus.objects.archive(self.before), 3)
+        finally:
+            del TaskStatus.objects.select_for_update
+        self.assertEqual(sorted(TaskStatusRollup.objects.values_list('day', 'status', 'count')),
+                         [(datetime.date(2014, 4, 30), 'Critical', 1), (datetime.date(2014, 5, 1), 'Critical', 2)])
+        self.assertEqual(ArchivedTaskStatus.objects.count(), 3)
+
+
+class SimpleCrontabEntryTest(TestCase):
+    def random_field(self, rnd, first, last):
+        kind = rnd.randint(0, 3)
+        if kind == 0:
+            return '*'
+        if kind == 1:
+            return str(rnd.randint(first, last))
+        if kind == 2:
+            # croniter mishandles single value ranges like "4-4"
+            start = rnd.randint(first, last - 1)
+            field = '%d-%d' % (start, rnd.randint(start + 1, last))
+            if rnd.random() < 0.3:
+                field += '/%d' % rnd.randint(2, 5)
+            return field
+        return ','.join(str(v) for v in sorted(set(rnd.randint(first, last) for _ in range(3))))
+
+    def random_expression(self, rnd):
+        return ' '.join([
+            self.random_field(rnd, 0, 59),
+            self.random_field(rnd, 0, 23),
+            self.random_field(rnd, 1, 28) if rnd.random() < 0.5 else '*',
+            self.random_field(rnd, 1, 12),
+            self.random_field(rnd, 0, 6) if rnd.random() < 0.5 else '*',
+        ])
+
+    def test_croniter_parity(self):
+        rnd = random.Random(2014)
+        for _ in range(300):
+            expression = self.random_expression(rnd)
+            entry = SimpleCrontabEntry(expression)
+            start = datetime.datetime(2010, 1, 1) + datetime.timedelta(minutes=rnd.randint(0, 10 * 365 * 1440))
+            # next_run includes the given minute, croniter starts after it
+            self.assertEqual(entry.next_run(start),
+                             croniter(expression, start - datetime.timedelta(minutes=1)).get_next(datetime.datetime),
+                             "%s from %s" % (expression, start))
+            self.assertEqual(entry.prev_run(start), croniter(expression, start).get_prev(datetime.datetime),
+                             "%s from %s" % (expression, start))
+
+    def test_iter_runs(self):
+        rnd = random.Random(2015)
+        for _ in range(50):
+            expression = self.random_expression(rnd)
+            entry = SimpleCrontabEntry(expression)
+            start = datetime.datetime(2014, 1, 1) + datetime.timedelta(minutes=rnd.randint(0, 365 * 1440))
+            end = start + datetime.timedelta(days=2)
+            expected = []
+            it = croniter(expression, start - datetime.timedelta(minutes=1))
+            run = it.get_next(datetime.datetime)
+            while run < end:
+                expected.append(run)
+                run = it.get_next(datetime.datetime)
+            self.assertEqual(list(entry.iter_runs(start, end)), expected, expression)
+            self.assertEqual(list(entry.iter_runs_reverse(end, start)), expected[::-1], expression)
+
+    def test_special_entries(self):
+        entry = SimpleCrontabEntry('@daily')
+        self.assertEqual(entry.next_run(datetime.datetime(2014, 3, 1, 0, 0, 30)), datetime.datetime(2014, 3, 1))
+        self.assertEqual(entry.prev_run(datetime.datetime(2014, 3, 1)), datetime.datetime(2014, 2, 28))
+
+    def test_no_execution(self):
+        entry = SimpleCrontabEntry('0 0 30 2 *')
+        self.assertRaises(ValueError, entry.next_run, datetime.datetime(2014, 1, 1))
+        self.assertRaises(ValueError, entry.prev_run, datetime.datetime(2014, 1, 1))
+
 
-class SimpleTest(TestCase):
-    def test_basic_addition(self):
-        """
-        Tests that 1 + 1 always equals 2.
-        """
-        self.assertEqual(1 + 1, 2)
+def load_tests(loader, tests, ignore):
+    tests.addTests(doctest.DocFileSuite('cronTest.txt', optionflags=doctest.IGNORE_EXCEPTION_DETAIL))
+    return tests
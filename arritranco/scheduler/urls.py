@@ -1,7 +1,7 @@
 from django.conf.urls import patterns, url
 
 from models import Task, TaskCheck
-from views import Todo, TaskCheckListCreateView, TaskStatusView, TaskDetailView, TaskListCreateView, TaskCheckDetailView
+from views import Todo, BulkTaskStatusView, TaskCheckListCreateView, TaskStatusView, TaskDetailView, TaskListCreateView, TaskCheckDetailView
 
 urlpatterns = patterns('',
     url(r'^taskchecks/$', TaskCheckListCreateView.as_view(), name='taskchecks'),
@@ -10,5 +10,6 @@ urlpatterns = patterns('',
     url(r'^tasks/(?P<pk>[0-9]+)$', TaskDetailView.as_view(), name='tasksdetail'),
     url(r'^tasks/(?P<pk>[0-9]+)/status$', TaskStatusView.as_view(), name='taskstatus'),
     url(r'^todo/$', Todo.as_view(), name='tasks-todo'), 
+    url(r'^taskstatus/$', BulkTaskStatusView.as_view(), name='taskstatus-bulk'),
     url(r'^(?P<pk>[^/]+)/$', TaskCheckDetailView.as_view()),
 )
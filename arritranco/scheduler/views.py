@@ -3,30 +3,113 @@
 from rest_framework.views import APIView
 from rest_framework.generics import ListAPIView, ListCreateAPIView, RetrieveUpdateDestroyAPIView
 from rest_framework import status as httpstatus
+from rest_framework.exceptions import ParseError
 from rest_framework.views import Response
 
 from models import Task, TaskCheck
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from serializers import TaskCheckSerializer, TaskSerializer, TaskStatusSerializer
+from renderers import NDJSONRenderer
+from serializers import BulkTaskStatusSerializer, TaskCheckSerializer, TaskSerializer, TaskStatusSerializer
 import datetime
+import time
+
+# Period of time paged through when after is given without end_time
+TODO_CURSOR_WINDOW = datetime.timedelta(days=1)
 
 
 class Todo(ListAPIView):
-    """Class to handle tasks todo."""
+    """Class to handle tasks todo.
+
+    With after=<timestamp> (and/or limit=N) the occurrences after that time are returned
+    with their execution_time, at most limit of them but never splitting the ones with the
+    same execution time, and the X-Next-Cursor header holds the after value for the next page.
+    With format=ndjson (or Accept: application/x-ndjson) the occurrences are streamed, one
+    JSON object per line, as they are computed.
+    """
     model = Task
     serializer = TaskSerializer
+    renderer_classes = list(ListAPIView.renderer_classes) + [NDJSONRenderer]
+
+    def get_tasks(self):
+        """Tasks to expand, every active one."""
+        return self.model.objects.filter(active=True)
+
+    def _get_param(self, name, convert):
+        if name not in self.request.GET:
+            return None
+        try:
+            return convert(self.request.GET[name])
+        except ValueError:
+            raise ParseError('Bad %s: %s' % (name, self.request.GET[name]))
+
+    def _get_time(self, name):
+        value = self._get_param(name, float)
+        if value is not None:
+            return datetime.datetime.fromtimestamp(value)
+
+    def _page(self, occurrences, limit):
+        """First limit occurrences plus the ones at the same time as the last, and the next cursor time."""
+        page = []
+        for task, execution_time in occurrences:
+            if len(page) >= limit and execution_time != page[-1][1]:
+                return page, page[-1][1]
+            page.append((task, execution_time))
+        return page, None
+
+    def _items(self, occurrences):
+        for task, execution_time in occurrences:
+            data = self.serializer(task).data
+            data['execution_time'] = execution_time
+            yield data
 
     def get(self, request, *args, **kwargs):
         """Return a list of all the tasks to be done."""
-        start_time = None
-        end_time = None
-        if request.GET.has_key('start_time'):
-            start_time = datetime.datetime.fromtimestamp(float(request.GET['start_time']))
-        if request.GET.has_key('end_time'):
-            end_time = datetime.datetime.fromtimestamp(float(request.GET['end_time']))
-        queryset = self.model.objects.todo(start_time, end_time)
+        start_time = self._get_time('start_time')
+        end_time = self._get_time('end_time')
+        after = self._get_time('after')
+        limit = self._get_param('limit', int)
+        if limit is not None and limit < 1:
+            raise ParseError('Bad limit: %s' % limit)
+        streaming = request.accepted_renderer.format == NDJSONRenderer.format
+        if after is None and limit is None and not streaming:
+            queryset = self.model.objects.todo(start_time, end_time, self.get_tasks())
+            return Response(self.serializer(queryset).data, httpstatus.HTTP_200_OK)
+
+        headers = {}
+        start_time = after or start_time or datetime.datetime.now()
+        if end_time is None:
+            end_time = start_time + TODO_CURSOR_WINDOW
+        # Whole seconds, so that the cursor after the window does not repeat an occurrence
+        end_time = end_time.replace(microsecond=0)
+        try:
+            occurrences = self.model.objects.iter_occurrences(start_time, end_time, self.get_tasks())
+        except ValueError:
+            raise ParseError('The window ends before it starts')
+        if after is not None or limit is not None:
+            next_time = None
+            if limit is not None:
+                occurrences, next_time = self._page(occurrences, limit)
+            if next_time is None:
+                next_time = end_time - datetime.timedelta(seconds=1)
+            headers['X-Next-Cursor'] = '%d' % time.mktime(next_time.timetuple())
+
+        if streaming:
+            response = StreamingHttpResponse(request.accepted_renderer.render_lines(self._items(occurrences)),
+                                             content_type=NDJSONRenderer.media_type)
+        else:
+            response = Response(list(self._items(occurrences)), httpstatus.HTTP_200_OK)
+        for header, value in headers.items():
+            response[header] = value
+        return response
 
-        return Response(self.serializer(queryset).data, httpstatus.HTTP_200_OK)
+    def finalize_response(self, request, response, *args, **kwargs):
+        """Streaming responses are not Responses, so they skip the rendering setup."""
+        if isinstance(response, StreamingHttpResponse):
+            for key, value in self.headers.items():
+                response[key] = value
+            return response
+        return super(Todo, self).finalize_response(request, response, *args, **kwargs)
 
 
 class TaskListCreateView(ListCreateAPIView):
@@ -90,3 +173,29 @@ class TaskStatusView(APIView):
         task_time = task.last_run()
         task.update_status(task_time, cleaned_data['status'], cleaned_data['comment'])
         return Response(self.serializer(task.get_status()).data, httpstatus.HTTP_200_OK)
+
+
+class BulkTaskStatusView(APIView):
+    """Updates the status of many tasks in a single request."""
+
+    serializer = BulkTaskStatusSerializer
+
+    def post(self, request):
+        """Handle POST requests with a list of {task, task_time, status, comment} records.
+
+        All the records are stored in a single transaction, none if any of them is not valid."""
+
+        data = self.serializer(data=request.DATA, many=True)
+        if not data.is_valid():
+            return Response(data.errors, httpstatus.HTTP_400_BAD_REQUEST)
+        task_ids = set(item['task'] for item in data.object)
+        tasks = Task.objects.in_bulk(task_ids)
+        unknown = sorted(task_ids - set(tasks))
+        if unknown:
+            return Response({'task': ['Unknown tasks: %s' % ', '.join(str(pk) for pk in unknown)]},
+                            httpstatus.HTTP_400_BAD_REQUEST)
+        records = []
+        for item in data.object:
+            task_time = item.get('task_time') or tasks[item['task']].last_run()
+            records.append((item['task'], task_time, item['status'], item.get('comment')))
+        return Response({'count': TaskCheck.objects.bulk_update_status(records)}, httpstatus.HTTP_201_CREATED)